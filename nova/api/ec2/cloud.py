@@ -1065,6 +1065,15 @@ class CloudController(object):
         result['groupSet'] = utils.convert_to_list_dict(
             security_group_names, 'groupId')
 
+    def _iter_found_instances(self, context, **kwargs):
+        """Iterate over compute_api.get_all_iter(), ending the iteration
+        if reading the instances raises NotFound."""
+        try:
+            for instance in self.compute_api.get_all_iter(context, **kwargs):
+                yield instance
+        except exception.NotFound:
+            return
+
     def _format_instances(self, context, instance_id=None, use_v6=False,
             **search_opts):
         # TODO(termie): this method is poorly named as its name does not imply
@@ -1084,14 +1093,14 @@ class CloudController(object):
                     continue
                 instances.append(instance)
         else:
-            try:
-                # always filter out deleted instances
-                search_opts['deleted'] = False
-                instances = self.compute_api.get_all(context,
-                                                     search_opts=search_opts,
-                                                     sort_dir='asc')
-            except exception.NotFound:
-                instances = []
+            # always filter out deleted instances
+            search_opts['deleted'] = False
+            # NOTE: Stream the instances rather than loading them all
+            # at once, and only join what is formatted below.
+            instances = self._iter_found_instances(context,
+                    search_opts=search_opts, sort_dir='asc',
+                    columns_to_join=['info_cache', 'security_groups',
+                                     'instance_type'])
         for instance in instances:
             if not context.is_admin:
                 if instance['image_ref'] == str(CONF.vpn_image_id):
@@ -29,6 +29,7 @@ from nova import block_device
 from nova import context
 from nova import db
 from nova import network
+from nova.network import model as network_model
 from nova.openstack.common import cfg
 from nova.openstack.common import timeutils
 from nova.virt import netutils
@@ -97,17 +98,13 @@ class InstanceMetadata():
 
         ctxt = context.get_admin_context()
 
-        services = db.service_get_all_by_host(ctxt.elevated(),
-                instance['host'])
-        self.availability_zone = ec2utils.get_availability_zone_by_host(
-                services, instance['host'])
+        self.availability_zone = self._get_availability_zone(ctxt)
 
         self.ip_info = ec2utils.get_ip_info_for_instance(ctxt, instance)
 
-        self.security_groups = db.security_group_get_by_instance(ctxt,
-                                                            instance['id'])
+        self.security_groups = self._get_security_groups(ctxt)
 
-        self.mappings = _format_instance_mapping(ctxt, instance)
+        self.mappings = self._get_mappings(ctxt)
 
         if instance.get('user_data', None) is not None:
             self.userdata_raw = base64.b64decode(instance['user_data'])
@@ -147,10 +144,11 @@ class InstanceMetadata():
 
         self.content = {}
         self.files = []
+        self.rendered = {}
 
         # get network info, and the rendered network template
         ctxt = context.get_admin_context()
-        network_info = network.API().get_instance_nw_info(ctxt, instance)
+        network_info = self._get_network_info(ctxt)
 
         self.network_config = None
         cfg = netutils.get_injected_network_template(network_info)
@@ -171,6 +169,21 @@ class InstanceMetadata():
                 'content_path': "/%s/%s" % (CONTENT_DIR, key)})
             self.content[key] = contents
 
+    def _get_availability_zone(self, ctxt):
+        services = db.service_get_all_by_host(ctxt.elevated(),
+                self.instance['host'])
+        return ec2utils.get_availability_zone_by_host(services,
+                self.instance['host'])
+
+    def _get_security_groups(self, ctxt):
+        return db.security_group_get_by_instance(ctxt, self.instance['id'])
+
+    def _get_mappings(self, ctxt):
+        return _format_instance_mapping(ctxt, self.instance)
+
+    def _get_network_info(self, ctxt):
+        return network.API().get_instance_nw_info(ctxt, self.instance)
+
     def get_ec2_metadata(self, version):
         if version == "latest":
             version = VERSIONS[-1]
@@ -334,7 +347,7 @@ class InstanceMetadata():
                            '.' if CONF.dhcp_domain else '',
                            CONF.dhcp_domain)
 
-    def lookup(self, path):
+    def _get_path_tokens(self, path):
         if path == "" or path[0] != "/":
             path = posixpath.normpath("/" + path)
         else:
@@ -348,7 +361,11 @@ class InstanceMetadata():
                 path_tokens = ["ec2"]
             else:
                 path_tokens = ["ec2"] + path_tokens
-            path = "/" + "/".join(path_tokens)
+        return path_tokens
+
+    def lookup(self, path):
+        path_tokens = self._get_path_tokens(path)
+        path = "/" + "/".join(path_tokens)
 
         # all values of 'path' input starts with '/' and have no trailing /
 
@@ -373,6 +390,50 @@ class InstanceMetadata():
 
         return data
 
+    def _render_path(self, path_tokens):
+        path = "/" + "/".join(path_tokens)
+        try:
+            data = self.lookup(path)
+        except InvalidMetadataPath:
+            return
+        if callable(data):
+            # e.g. the password handler, which must run for each request
+            return
+
+        self.rendered[path] = ec2_md_print(data)
+
+        if isinstance(data, dict):
+            children = [key for key in data if key != '_name']
+        elif isinstance(data, list) and (len(path_tokens) == 1 or
+                                         path_tokens[0] == "openstack"):
+            # Listings of versions and of openstack version contents.
+            # Other lists in the ec2 tree are values, not paths.
+            children = data
+        else:
+            children = []
+        for child in children:
+            self._render_path(path_tokens + [child])
+
+    def render(self):
+        """Render the text served for every path in the metadata tree,
+        so that lookup_rendered() only needs a dictionary lookup.
+        """
+        self.rendered = {}
+        self._render_path(["ec2"])
+        self._render_path(["openstack"])
+        for key in self.content:
+            self._render_path(["openstack", CONTENT_DIR, key])
+
+    def lookup_rendered(self, path):
+        """Return the text rendered for path by render(), falling back
+        to lookup() for paths that were not rendered.
+        """
+        path_tokens = self._get_path_tokens(path)
+        rendered = self.rendered.get("/" + "/".join(path_tokens))
+        if rendered is not None:
+            return rendered
+        return self.lookup(path)
+
     def metadata_for_config_drive(self):
         """Yields (path, value) tuples for metadata elements."""
         # EC2 style metadata
@@ -406,7 +467,53 @@ class InstanceMetadata():
             yield ('%s/%s/%s' % ("openstack", CONTENT_DIR, cid), content)
 
 
+class PreloadedInstanceMetadata(InstanceMetadata):
+    """Instance metadata for an instance loaded by
+    db.instance_get_all_by_fixed_ip_addresses(), which needs no further
+    queries for the availability zone, security groups, block device
+    mappings or network info.
+    """
+
+    def __init__(self, instance, address, availability_zone):
+        self._availability_zone = availability_zone
+        InstanceMetadata.__init__(self, instance, address)
+
+    def _get_availability_zone(self, ctxt):
+        return self._availability_zone or 'unknown zone'
+
+    def _get_security_groups(self, ctxt):
+        return self.instance['security_groups']
+
+    def _get_mappings(self, ctxt):
+        return block_device.instance_block_mapping(
+                self.instance, self.instance['block_device_mapping'])
+
+    def _get_network_info(self, ctxt):
+        info_cache = self.instance['info_cache'] or {}
+        return network_model.NetworkInfo.hydrate(
+                info_cache.get('network_info') or [])
+
+
+def get_metadata_by_addresses(addresses):
+    """Return a dict of InstanceMetadata for the instances with the given
+    fixed ip addresses, loaded with a single query.  Addresses without
+    an instance are left out.
+    """
+    ctxt = context.get_admin_context()
+    found = db.instance_get_all_by_fixed_ip_addresses(ctxt, addresses)
+    return dict((address, PreloadedInstanceMetadata(instance, address,
+                                                    availability_zone))
+                for address, (instance, availability_zone)
+                in found.iteritems())
+
+
 def get_metadata_by_address(address):
+    meta_data = get_metadata_by_addresses([address]).get(address)
+    if meta_data is not None:
+        return meta_data
+
+    # The address may belong to a network the nova database does not
+    # know about, so ask the network API.
     ctxt = context.get_admin_context()
     fixed_ip = network.API().get_fixed_ip_by_address(ctxt, address)
 
@@ -48,7 +48,20 @@ metadata_proxy_opts = [
          help='Shared secret to validate proxies Quantum metadata requests')
 ]
 
+metadata_cache_opts = [
+    cfg.BoolOpt('metadata_prerender',
+                default=False,
+                help='Render the response for every metadata path when an '
+                     'instance\'s metadata is loaded, and cache the rendered '
+                     'responses with it'),
+    cfg.IntOpt('metadata_warm_cache_expiration',
+               default=300,
+               help='Seconds the metadata cached by warm_cache() for a newly '
+                    'spawned instance is kept'),
+]
+
 CONF.register_opts(metadata_proxy_opts)
+CONF.register_opts(metadata_cache_opts)
 
 LOG = logging.getLogger(__name__)
 
@@ -58,6 +71,23 @@ else:
     from nova.common import memorycache as memcache
 
 
+def warm_cache(addresses):
+    """Load the metadata of the instances with the given fixed ip
+    addresses into the memcached servers used by the metadata API, before
+    the instances ask for it.
+    """
+    if not CONF.memcached_servers:
+        # Every metadata API process has a cache of its own
+        return
+    cache = memcache.Client(CONF.memcached_servers, debug=0)
+    found = base.get_metadata_by_addresses(addresses)
+    for address, meta_data in found.iteritems():
+        if CONF.metadata_prerender:
+            meta_data.render()
+        cache.set('metadata-%s' % address, meta_data,
+                  CONF.metadata_warm_cache_expiration)
+
+
 class MetadataRequestHandler(wsgi.Application):
     """Serve metadata."""
 
@@ -78,6 +108,9 @@ class MetadataRequestHandler(wsgi.Application):
         except exception.NotFound:
             return None
 
+        if CONF.metadata_prerender:
+            data.render()
+
         self._cache.set(cache_key, data, CACHE_EXPIRATION)
 
         return data
@@ -93,6 +126,9 @@ class MetadataRequestHandler(wsgi.Application):
         except exception.NotFound:
             return None
 
+        if CONF.metadata_prerender:
+            data.render()
+
         self._cache.set(cache_key, data, CACHE_EXPIRATION)
 
         return data
@@ -116,7 +152,10 @@ class MetadataRequestHandler(wsgi.Application):
             raise webob.exc.HTTPNotFound()
 
         try:
-            data = meta_data.lookup(req.path_info)
+            if CONF.metadata_prerender:
+                data = meta_data.lookup_rendered(req.path_info)
+            else:
+                data = meta_data.lookup(req.path_info)
         except base.InvalidMetadataPath:
             raise webob.exc.HTTPNotFound()
 
@@ -70,15 +70,21 @@ class QuotaClassSetsController(object):
         context = req.environ['nova.context']
         authorize(context)
         quota_class = id
-        for key in body['quota_class_set'].keys():
-            if key in QUOTAS:
-                value = int(body['quota_class_set'][key])
-                try:
-                    db.quota_class_update(context, quota_class, key, value)
-                except exception.QuotaClassNotFound:
-                    db.quota_class_create(context, quota_class, key, value)
-                except exception.AdminRequired:
-                    raise webob.exc.HTTPForbidden()
+        try:
+            for key in body['quota_class_set'].keys():
+                if key in QUOTAS:
+                    value = int(body['quota_class_set'][key])
+                    try:
+                        db.quota_class_update(context, quota_class, key,
+                                              value)
+                    except exception.QuotaClassNotFound:
+                        db.quota_class_create(context, quota_class, key,
+                                              value)
+                    except exception.AdminRequired:
+                        raise webob.exc.HTTPForbidden()
+        finally:
+            # Enforce the new limits at once in this process
+            QUOTAS.invalidate(quota_class=quota_class)
         return {'quota_class_set': QUOTAS.get_class_quotas(context,
                                                            quota_class)}
 
@@ -86,16 +86,20 @@ class QuotaSetsController(object):
         context = req.environ['nova.context']
         authorize_update(context)
         project_id = id
-        for key in body['quota_set'].keys():
-            if key in QUOTAS:
-                value = int(body['quota_set'][key])
-                self._validate_quota_limit(value)
-                try:
-                    db.quota_update(context, project_id, key, value)
-                except exception.ProjectQuotaNotFound:
-                    db.quota_create(context, project_id, key, value)
-                except exception.AdminRequired:
-                    raise webob.exc.HTTPForbidden()
+        try:
+            for key in body['quota_set'].keys():
+                if key in QUOTAS:
+                    value = int(body['quota_set'][key])
+                    self._validate_quota_limit(value)
+                    try:
+                        db.quota_update(context, project_id, key, value)
+                    except exception.ProjectQuotaNotFound:
+                        db.quota_create(context, project_id, key, value)
+                    except exception.AdminRequired:
+                        raise webob.exc.HTTPForbidden()
+        finally:
+            # Enforce the new limits at once in this process
+            QUOTAS.invalidate(project_id=project_id)
         return {'quota_set': self._get_quotas(context, id)}
 
     @wsgi.serializers(xml=QuotaTemplate)
@@ -15,6 +15,7 @@
 #    under the License.
 
 import base64
+import itertools
 import os
 import re
 import socket
@@ -50,6 +51,7 @@ CONF = cfg.CONF
 CONF.register_opts(server_opts)
 CONF.import_opt('network_api_class', 'nova.config')
 CONF.import_opt('reclaim_instance_interval', 'nova.compute.manager')
+CONF.import_opt('instance_list_chunk_size', 'nova.compute.api')
 
 LOG = logging.getLogger(__name__)
 
@@ -481,6 +483,23 @@ class Controller(wsgi.Controller):
 
         return instances
 
+    def _iter_instances(self, req, instances, is_detail):
+        """Read instances a chunk at a time, adding their faults and
+        caching them in the request for the extensions as they are read.
+        """
+        context = req.environ['nova.context']
+        instances = iter(instances)
+        while True:
+            chunk = list(itertools.islice(instances,
+                                          CONF.instance_list_chunk_size))
+            if not chunk:
+                return
+            if is_detail:
+                self._add_instance_faults(context, chunk)
+            req.cache_db_instances(chunk)
+            for instance in chunk:
+                yield instance
+
     def _get_servers(self, req, is_detail):
         """Returns a list of servers, based on any search options specified."""
 
@@ -533,11 +552,18 @@ class Controller(wsgi.Controller):
                 search_opts['user_id'] = context.user_id
 
         limit, marker = common.get_limit_and_marker(req)
+        # NOTE: The instances are read from the database while the view is
+        # built, so errors in reading them are raised from the view builder.
         try:
-            instance_list = self.compute_api.get_all(context,
-                                                     search_opts=search_opts,
-                                                     limit=limit,
-                                                     marker=marker)
+            instances = self.compute_api.get_all_iter(context,
+                                                      search_opts=search_opts,
+                                                      limit=limit,
+                                                      marker=marker)
+            instances = self._iter_instances(req, instances, is_detail)
+            if is_detail:
+                response = self._view_builder.detail(req, instances)
+            else:
+                response = self._view_builder.index(req, instances)
         except exception.MarkerNotFound as e:
             msg = _('marker [%s] not found') % marker
             raise webob.exc.HTTPBadRequest(explanation=msg)
@@ -545,12 +571,6 @@ class Controller(wsgi.Controller):
             msg = _("Flavor could not be found")
             raise webob.exc.HTTPUnprocessableEntity(explanation=msg)
 
-        if is_detail:
-            self._add_instance_faults(context, instance_list)
-            response = self._view_builder.detail(req, instance_list)
-        else:
-            response = self._view_builder.index(req, instance_list)
-        req.cache_db_instances(instance_list)
         return response
 
     def _get_server(self, context, req, instance_uuid):
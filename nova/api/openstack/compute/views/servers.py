@@ -129,8 +129,10 @@ class ViewBuilder(common.ViewBuilder):
     def _list_view(self, func, request, servers):
         """Provide a view for a list of servers."""
         server_list = [func(request, server)["server"] for server in servers]
+        # NOTE: servers may be an iterator, so the links are made from the
+        # views, whose 'id' is the server's uuid.
         servers_links = self._get_collection_links(request,
-                                                   servers,
+                                                   server_list,
                                                    self._collection_name)
         servers_dict = dict(servers=server_list)
 
@@ -18,34 +18,107 @@
 
 """Super simple fake memcache client."""
 
+import collections
+import heapq
+
+from nova.openstack.common import cfg
 from nova.openstack.common import timeutils
 
+memorycache_opts = [
+    cfg.IntOpt('memorycache_max_items',
+               default=10000,
+               help='Maximum number of keys kept by the in-process cache '
+                    'used when memcached_servers is not set.  The least '
+                    'recently used keys are evicted first.  0 means '
+                    'unbounded.'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(memorycache_opts)
+
 
 class Client(object):
     """Replicates a tiny subset of memcached client interface."""
 
     def __init__(self, *args, **kwargs):
-        """Ignores the passed in args."""
+        """Ignores the passed in args, except max_items."""
+        max_items = kwargs.get('max_items')
+        if max_items is None:
+            max_items = CONF.memorycache_max_items
+        self.max_items = max_items
+        # { key : (timeout, value, last use) }
         self.cache = {}
+        # (last use, key) in the order keys were used, and a heap of
+        # (timeout, key) for the keys with a timeout.  Entries for keys
+        # that were since used, set or deleted again are skipped.
+        self._uses = collections.deque()
+        self._timeouts = []
+        self._clock = 0
+        self.stats = dict(hits=0, misses=0, evictions=0, expirations=0)
+
+    def _expire(self, now):
+        """Drop the keys that have timed out."""
+        timeouts = self._timeouts
+        while timeouts and timeouts[0][0] <= now:
+            timeout, key = heapq.heappop(timeouts)
+            item = self.cache.get(key)
+            if item is not None and item[0] == timeout:
+                del self.cache[key]
+                self.stats['expirations'] += 1
+
+    def _store(self, key, timeout, value):
+        """Store a value and mark the key as most recently used."""
+        self._clock += 1
+        self.cache[key] = (timeout, value, self._clock)
+        self._uses.append((self._clock, key))
+        if len(self._uses) > 2 * len(self.cache) + 64:
+            # Too many skipped entries, rebuild the queue
+            self._uses = collections.deque(sorted(
+                    (use, k) for k, (_t, _v, use) in self.cache.iteritems()))
+
+    def _evict(self):
+        """Drop the least recently used keys above max_items."""
+        while self.max_items and len(self.cache) > self.max_items:
+            use, key = self._uses.popleft()
+            item = self.cache.get(key)
+            if item is not None and item[2] == use:
+                del self.cache[key]
+                self.stats['evictions'] += 1
+
+    def _get_item(self, key):
+        self._expire(timeutils.utcnow_ts())
+        item = self.cache.get(key)
+        if item is not None:
+            self._store(key, item[0], item[1])
+        return item
 
     def get(self, key):
         """Retrieves the value for a key or None.
 
         this expunges expired keys during each get"""
 
-        for k in self.cache.keys():
-            (timeout, _value) = self.cache[k]
-            if timeout and timeutils.utcnow_ts() >= timeout:
-                del self.cache[k]
-
-        return self.cache.get(key, (0, None))[1]
+        item = self._get_item(key)
+        if item is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return item[1]
 
     def set(self, key, value, time=0, min_compress_len=0):
         """Sets the value for a key."""
+        now = timeutils.utcnow_ts()
+        self._expire(now)
         timeout = 0
         if time != 0:
-            timeout = timeutils.utcnow_ts() + time
-        self.cache[key] = (timeout, value)
+            timeout = now + time
+            if len(self._timeouts) > 2 * len(self.cache) + 64:
+                # Too many skipped entries, rebuild the heap
+                self._timeouts = [(t, k) for k, (t, _v, _u) in
+                                  self.cache.iteritems() if t and k != key]
+                heapq.heapify(self._timeouts)
+            heapq.heappush(self._timeouts, (timeout, key))
+        self._store(key, timeout, value)
+        self._evict()
         return True
 
     def add(self, key, value, time=0, min_compress_len=0):
@@ -56,9 +129,14 @@ class Client(object):
 
     def incr(self, key, delta=1):
         """Increments the value for a key."""
-        value = self.get(key)
-        if value is None:
+        item = self._get_item(key)
+        if item is None:
             return None
-        new_value = int(value) + delta
-        self.cache[key] = (self.cache[key][0], str(new_value))
+        new_value = int(item[1]) + delta
+        self._store(key, item[0], str(new_value))
         return new_value
+
+    def delete(self, key, time=0):
+        """Deletes the value for a key."""
+        self._expire(timeutils.utcnow_ts())
+        return self.cache.pop(key, None) is not None
@@ -84,6 +84,10 @@ compute_opts = [
     cfg.StrOpt('security_group_api',
                default='nova.compute.api.SecurityGroupAPI',
                help='The full class name of the security API class'),
+    cfg.IntOpt('instance_list_chunk_size',
+               default=1000,
+               help='Number of instances to read from the database at a '
+                    'time when listing instances'),
 ]
 
 
@@ -1149,6 +1153,19 @@ class API(base.Base):
         'sort_dir' parameter using the key specified in the 'sort_key'
         parameter.
         """
+        return list(self.get_all_iter(context, search_opts=search_opts,
+                                      sort_key=sort_key, sort_dir=sort_dir,
+                                      limit=limit, marker=marker))
+
+    def get_all_iter(self, context, search_opts=None, sort_key='created_at',
+                     sort_dir='desc', limit=None, marker=None,
+                     columns_to_join=None):
+        """Like get_all(), but return an iterator over the instances that
+        reads them from the database a chunk at a time.
+
+        columns_to_join is the list of instance relations to load, which
+        defaults to all of them.
+        """
 
         #TODO(bcwaldon): determine the best argument for target here
         target = {
@@ -1210,27 +1227,28 @@ class API(base.Base):
                     # We already know we can't match the filter, so
                     # return an empty list
                     except ValueError:
-                        return []
+                        return iter([])
 
         inst_models = self._get_instances_by_filters(context, filters,
-                                                     sort_key, sort_dir,
-                                                     limit=limit,
-                                                     marker=marker)
+                sort_key, sort_dir, limit=limit, marker=marker,
+                columns_to_join=columns_to_join)
 
         # Convert the models to dictionaries
-        instances = []
-        for inst_model in inst_models:
-            instance = dict(inst_model.iteritems())
-            # NOTE(comstud): Doesn't get returned by iteritems
-            instance['name'] = inst_model['name']
-            instances.append(instance)
+        return (self._instance_model_to_dict(inst_model)
+                for inst_model in inst_models)
 
-        return instances
+    @staticmethod
+    def _instance_model_to_dict(inst_model):
+        instance = dict(inst_model.iteritems())
+        # NOTE(comstud): Doesn't get returned by iteritems
+        instance['name'] = inst_model['name']
+        return instance
 
     def _get_instances_by_filters(self, context, filters,
                                   sort_key, sort_dir,
                                   limit=None,
-                                  marker=None):
+                                  marker=None,
+                                  columns_to_join=None):
         if 'ip6' in filters or 'ip' in filters:
             res = self.network_api.get_instance_uuids_by_ip_filter(context,
                                                                    filters)
@@ -1239,9 +1257,37 @@ class API(base.Base):
             uuids = set([r['instance_uuid'] for r in res])
             filters['uuid'] = uuids
 
-        return self.db.instance_get_all_by_filters(context, filters,
-                                                   sort_key, sort_dir,
-                                                   limit=limit, marker=marker)
+        return self._get_instances_by_filters_chunked(context, filters,
+                sort_key, sort_dir, limit=limit, marker=marker,
+                columns_to_join=columns_to_join)
+
+    def _get_instances_by_filters_chunked(self, context, filters,
+                                          sort_key, sort_dir,
+                                          limit=None,
+                                          marker=None,
+                                          columns_to_join=None):
+        """Read instances instance_list_chunk_size at a time, using the
+        last instance of each chunk as the marker for the next one, so
+        only one chunk is loaded from the database at once.
+        """
+        chunk_size = CONF.instance_list_chunk_size
+        kwargs = {}
+        if columns_to_join is not None:
+            kwargs['columns_to_join'] = columns_to_join
+
+        while limit is None or limit > 0:
+            chunk_limit = chunk_size
+            if limit is not None:
+                chunk_limit = min(chunk_limit, limit)
+                limit -= chunk_limit
+            instances = self.db.instance_get_all_by_filters(context, filters,
+                    sort_key, sort_dir, limit=chunk_limit, marker=marker,
+                    **kwargs)
+            for instance in instances:
+                yield instance
+            if len(instances) < chunk_limit:
+                break
+            marker = instances[-1]['uuid']
 
     @wrap_check_policy
     @check_instance_state(vm_state=[vm_states.ACTIVE, vm_states.STOPPED])
@@ -103,6 +103,10 @@ compute_opts = [
                 default=False,
                 help='Whether to start guests that were running before the '
                      'host rebooted'),
+    cfg.BoolOpt('metadata_cache_warming',
+                default=False,
+                help='Have the conductor load the metadata of spawned '
+                     'instances into the metadata API\'s memcached_servers'),
     ]
 
 interval_opts = [
@@ -113,13 +117,21 @@ interval_opts = [
                default=60,
                help="Number of seconds between instance info_cache self "
                         "healing updates"),
+    cfg.IntOpt('sync_power_state_interval',
+               default=600,
+               help='Number of seconds between syncing the power states of '
+                    'instances with the hypervisor'),
     cfg.IntOpt('host_state_interval',
                default=120,
                help='Interval in seconds for querying the host status'),
     cfg.IntOpt("image_cache_manager_interval",
-               default=40,
-               help="Number of periodic scheduler ticks to wait between "
-                    "runs of the image cache manager."),
+               default=2400,
+               help="Number of seconds to wait between runs of the image "
+                    "cache manager.  0 disables it."),
+    cfg.IntOpt('update_resources_interval',
+               default=60,
+               help='Number of seconds between updates of the resources '
+                    'available on the host'),
     cfg.IntOpt('reclaim_instance_interval',
                default=0,
                help='Interval in seconds for reclaiming deleted instances'),
@@ -882,12 +894,29 @@ class ComputeManager(manager.SchedulerDependentManager):
             raise
 
         current_power_state = self._get_power_state(context, instance)
-        return self._instance_update(context, instance['uuid'],
-                                     power_state=current_power_state,
-                                     vm_state=vm_states.ACTIVE,
-                                     task_state=None,
-                                     expected_task_state=task_states.SPAWNING,
-                                     launched_at=timeutils.utcnow())
+        instance = self._instance_update(context, instance['uuid'],
+                                         power_state=current_power_state,
+                                         vm_state=vm_states.ACTIVE,
+                                         task_state=None,
+                                         expected_task_state=task_states.
+                                             SPAWNING,
+                                         launched_at=timeutils.utcnow())
+        if CONF.metadata_cache_warming:
+            self._warm_metadata_cache(context, instance, network_info)
+        return instance
+
+    def _warm_metadata_cache(self, context, instance, network_info):
+        """Ask the conductor to cache the metadata of a spawned instance
+        before the instance boots and requests it."""
+        addresses = [ip['address'] for ip in network_info.fixed_ips()]
+        if not addresses:
+            return
+        try:
+            self.conductor_api.metadata_cache_warm(context, addresses)
+        except Exception:
+            # The metadata API loads the metadata itself on a cache miss
+            LOG.exception(_('Failed to warm the metadata cache'),
+                          instance=instance)
 
     def _notify_about_instance_usage(self, context, instance, event_suffix,
                                      network_info=None, system_metadata=None,
@@ -2956,26 +2985,36 @@ class ComputeManager(manager.SchedulerDependentManager):
                 return
 
             refreshed = timeutils.utcnow()
+            uuids = list(set(bw_ctr['uuid'] for bw_ctr in bw_counters))
+            usages = {}
+            prev_usages = {}
+            if uuids:
+                for usage in self.conductor_api.bw_usage_get_by_uuids(
+                        context, uuids, start_time):
+                    usages[(usage['uuid'], usage['mac'])] = usage
+                missing = set(bw_ctr['uuid'] for bw_ctr in bw_counters
+                              if (bw_ctr['uuid'], bw_ctr['mac_address'])
+                              not in usages)
+                if missing:
+                    for usage in self.conductor_api.bw_usage_get_by_uuids(
+                            context, list(missing), prev_time):
+                        prev_usages[(usage['uuid'], usage['mac'])] = usage
+
+            updates = []
             for bw_ctr in bw_counters:
-                # Allow switching of greenthreads between queries.
-                greenthread.sleep(0)
                 bw_in = 0
                 bw_out = 0
                 last_ctr_in = None
                 last_ctr_out = None
-                usage = self.conductor_api.bw_usage_get(context,
-                                                        bw_ctr['uuid'],
-                                                        start_time,
-                                                        bw_ctr['mac_address'])
+                key = (bw_ctr['uuid'], bw_ctr['mac_address'])
+                usage = usages.get(key)
                 if usage:
                     bw_in = usage['bw_in']
                     bw_out = usage['bw_out']
                     last_ctr_in = usage['last_ctr_in']
                     last_ctr_out = usage['last_ctr_out']
                 else:
-                    usage = self.conductor_api.bw_usage_get(
-                        context, bw_ctr['uuid'], prev_time,
-                        bw_ctr['mac_address'])
+                    usage = prev_usages.get(key)
                     if usage:
                         last_ctr_in = usage['last_ctr_in']
                         last_ctr_out = usage['last_ctr_out']
@@ -2994,15 +3033,16 @@ class ComputeManager(manager.SchedulerDependentManager):
                     else:
                         bw_out += (bw_ctr['bw_out'] - last_ctr_out)
 
-                self.conductor_api.bw_usage_update(context,
-                                                   bw_ctr['uuid'],
-                                                   bw_ctr['mac_address'],
-                                                   start_time,
-                                                   bw_in,
-                                                   bw_out,
-                                                   bw_ctr['bw_in'],
-                                                   bw_ctr['bw_out'],
-                                                   last_refreshed=refreshed)
+                updates.append({'uuid': bw_ctr['uuid'],
+                                'mac': bw_ctr['mac_address'],
+                                'bw_in': bw_in,
+                                'bw_out': bw_out,
+                                'last_ctr_in': bw_ctr['bw_in'],
+                                'last_ctr_out': bw_ctr['bw_out']})
+
+            self.conductor_api.bw_usage_update_bulk(context, start_time,
+                                                    updates,
+                                                    last_refreshed=refreshed)
 
     def _get_host_volume_bdms(self, context, host):
         """Return all block device mappings on a compute host"""
@@ -3084,7 +3124,7 @@ class ComputeManager(manager.SchedulerDependentManager):
                 capability['host_ip'] = CONF.my_ip
             self.update_service_capabilities(capabilities)
 
-    @manager.periodic_task(ticks_between_runs=10)
+    @manager.periodic_task(spacing='sync_power_state_interval')
     def _sync_power_states(self, context):
         """Align power states between the database and the hypervisor.
 
@@ -3106,24 +3146,48 @@ class ComputeManager(manager.SchedulerDependentManager):
             LOG.warn(_("Found %(num_db_instances)s in the database and "
                        "%(num_vm_instances)s on the hypervisor.") % locals())
 
+        # Ask the hypervisor for every power state at once if the driver
+        # supports it, rather than making a get_info() call per instance.
+        try:
+            all_power_states = self.driver.get_all_power_states()
+        except NotImplementedError:
+            all_power_states = None
+
+        vm_power_states = {}
         for db_instance in db_instances:
-            db_power_state = db_instance['power_state']
             if db_instance['task_state'] is not None:
                 LOG.info(_("During sync_power_state the instance has a "
                            "pending task. Skip."), instance=db_instance)
                 continue
             # No pending tasks. Now try to figure out the real vm_power_state.
-            try:
-                vm_instance = self.driver.get_info(db_instance)
-                vm_power_state = vm_instance['state']
-            except exception.InstanceNotFound:
-                vm_power_state = power_state.SHUTDOWN
-            # Note(maoy): the above get_info call might take a long time,
-            # for example, because of a broken libvirt driver.
-            # We re-query the DB to get the latest instance info to minimize
-            # (not eliminate) race condition.
-            u = self.conductor_api.instance_get_by_uuid(context,
-                                                        db_instance['uuid'])
+            if all_power_states is not None:
+                vm_power_state = all_power_states.get(db_instance['name'],
+                                                      power_state.SHUTDOWN)
+            else:
+                try:
+                    vm_instance = self.driver.get_info(db_instance)
+                    vm_power_state = vm_instance['state']
+                except exception.InstanceNotFound:
+                    vm_power_state = power_state.SHUTDOWN
+            vm_power_states[db_instance['uuid']] = vm_power_state
+
+        if not vm_power_states:
+            return
+
+        # Note(maoy): the above driver calls might take a long time,
+        # for example, because of a broken libvirt driver.
+        # We re-query the DB to get the latest instance info to minimize
+        # (not eliminate) race condition.  All the instances are fetched
+        # with a single call rather than one call per instance.
+        refreshed = self.conductor_api.instance_get_all_by_uuids(
+            context, vm_power_states.keys())
+        refreshed = dict((u['uuid'], u) for u in refreshed)
+
+        for db_instance in db_instances:
+            vm_power_state = vm_power_states.get(db_instance['uuid'])
+            u = refreshed.get(db_instance['uuid'])
+            if vm_power_state is None or u is None:
+                continue
             db_power_state = u["power_state"]
             vm_state = u['vm_state']
             if self.host != u['host']:
@@ -3240,7 +3304,7 @@ class ComputeManager(manager.SchedulerDependentManager):
                 LOG.info(_('Reclaiming deleted instance'), instance=instance)
                 self._delete_instance(context, instance, bdms)
 
-    @manager.periodic_task
+    @manager.periodic_task(spacing='update_resources_interval')
     def update_available_resource(self, context):
         """See driver.get_available_resource()
 
@@ -3378,8 +3442,7 @@ class ComputeManager(manager.SchedulerDependentManager):
                                     aggregate, host,
                                     isinstance(e, exception.AggregateError))
 
-    @manager.periodic_task(
-        ticks_between_runs=CONF.image_cache_manager_interval)
+    @manager.periodic_task(spacing='image_cache_manager_interval')
     def _run_image_cache_manager_pass(self, context):
         """Run a single pass of the image cache manager."""
 
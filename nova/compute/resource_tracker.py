@@ -489,8 +489,9 @@ class ResourceTracker(object):
         """
         self.tracked_instances.clear()
 
-        # purge old stats
+        # purge old stats, keeping the ones reported by the virt driver
         self.stats.clear()
+        self.stats.update(resources.get('stats', {}))
 
         # set some intiial values, reserve room for host/hypervisor:
         resources['local_gb_used'] = CONF.reserved_host_disk_mb / 1024
@@ -78,6 +78,16 @@ class LocalAPI(object):
     def instance_get_all_by_host(self, context, host):
         return self._manager.instance_get_all_by_host(context, host)
 
+    def instance_get_all_by_uuids(self, context, instance_uuids):
+        return self._manager.instance_get_all_by_uuids(context,
+                                                       instance_uuids)
+
+    def instance_get_all_by_filters(self, context, filters,
+                                    sort_key='created_at', sort_dir='desc',
+                                    limit=None, columns_to_join=None):
+        return self._manager.instance_get_all_by_filters(
+            context, filters, sort_key, sort_dir, limit, columns_to_join)
+
     def migration_get(self, context, migration_id):
         return self._manager.migration_get(context, migration_id)
 
@@ -115,6 +125,15 @@ class LocalAPI(object):
                                              last_ctr_in, last_ctr_out,
                                              last_refreshed)
 
+    def bw_usage_get_by_uuids(self, context, uuids, start_period):
+        return self._manager.bw_usage_get_by_uuids(context, uuids,
+                                                   start_period)
+
+    def bw_usage_update_bulk(self, context, start_period, usages,
+                             last_refreshed=None):
+        return self._manager.bw_usage_update_bulk(context, start_period,
+                                                  usages, last_refreshed)
+
     def get_backdoor_port(self, context, host):
         raise exc.InvalidRequest
 
@@ -132,6 +151,12 @@ class LocalAPI(object):
         return self._manager.agent_build_get_by_triple(context, hypervisor,
                                                        os, architecture)
 
+    def compute_node_get_by_host(self, context, host):
+        return self._manager.compute_node_get_by_host(context, host)
+
+    def metadata_cache_warm(self, context, addresses):
+        return self._manager.metadata_cache_warm(context, addresses)
+
 
 class API(object):
     """Conductor API that does updates via RPC to the ConductorManager"""
@@ -151,6 +176,16 @@ class API(object):
     def instance_get_all_by_host(self, context, host):
         return self.conductor_rpcapi.instance_get_all_by_host(context, host)
 
+    def instance_get_all_by_uuids(self, context, instance_uuids):
+        return self.conductor_rpcapi.instance_get_all_by_uuids(
+            context, instance_uuids)
+
+    def instance_get_all_by_filters(self, context, filters,
+                                    sort_key='created_at', sort_dir='desc',
+                                    limit=None, columns_to_join=None):
+        return self.conductor_rpcapi.instance_get_all_by_filters(
+            context, filters, sort_key, sort_dir, limit, columns_to_join)
+
     def migration_get(self, context, migration_id):
         return self.conductor_rpcapi.migration_get(context, migration_id)
 
@@ -192,6 +227,15 @@ class API(object):
             bw_in, bw_out, last_ctr_in, last_ctr_out,
             last_refreshed)
 
+    def bw_usage_get_by_uuids(self, context, uuids, start_period):
+        return self.conductor_rpcapi.bw_usage_get_by_uuids(context, uuids,
+                                                           start_period)
+
+    def bw_usage_update_bulk(self, context, start_period, usages,
+                             last_refreshed=None):
+        return self.conductor_rpcapi.bw_usage_update_bulk(
+            context, start_period, usages, last_refreshed)
+
     #NOTE(mtreinish): This doesn't work on multiple conductors without any
     # topic calculation in conductor_rpcapi. So the host param isn't used
     # currently.
@@ -214,3 +258,9 @@ class API(object):
                                                                hypervisor,
                                                                os,
                                                                architecture)
+
+    def compute_node_get_by_host(self, context, host):
+        return self.conductor_rpcapi.compute_node_get_by_host(context, host)
+
+    def metadata_cache_warm(self, context, addresses):
+        self.conductor_rpcapi.metadata_cache_warm(context, addresses)
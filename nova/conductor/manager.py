@@ -14,6 +14,7 @@
 
 """Handles database requests from other nova services"""
 
+from nova.api.metadata import handler as metadata_handler
 from nova import exception
 from nova import manager
 from nova import notifications
@@ -43,7 +44,7 @@ datetime_fields = ['launched_at', 'terminated_at']
 class ConductorManager(manager.SchedulerDependentManager):
     """Mission: TBD"""
 
-    RPC_API_VERSION = '1.10'
+    RPC_API_VERSION = '1.13'
 
     def __init__(self, *args, **kwargs):
         super(ConductorManager, self).__init__(service_name='conductor',
@@ -76,6 +77,18 @@ class ConductorManager(manager.SchedulerDependentManager):
         return jsonutils.to_primitive(
             self.db.instance_get_all_by_host(context.elevated(), host))
 
+    def instance_get_all_by_uuids(self, context, instance_uuids):
+        return jsonutils.to_primitive(
+            self.db.instance_get_all_by_uuids(context, instance_uuids))
+
+    def instance_get_all_by_filters(self, context, filters, sort_key,
+                                    sort_dir, limit=None,
+                                    columns_to_join=None):
+        return jsonutils.to_primitive(
+            self.db.instance_get_all_by_filters(
+                context, filters, sort_key, sort_dir, limit=limit,
+                columns_to_join=columns_to_join))
+
     @rpc_common.client_exceptions(exception.MigrationNotFound)
     def migration_get(self, context, migration_id):
         migration_ref = self.db.migration_get(context.elevated(),
@@ -128,6 +141,15 @@ class ConductorManager(manager.SchedulerDependentManager):
         usage = self.db.bw_usage_get(context, uuid, start_period, mac)
         return jsonutils.to_primitive(usage)
 
+    def bw_usage_get_by_uuids(self, context, uuids, start_period):
+        usages = self.db.bw_usage_get_by_uuids(context, uuids, start_period)
+        return jsonutils.to_primitive(usages)
+
+    def bw_usage_update_bulk(self, context, start_period, usages,
+                             last_refreshed=None):
+        self.db.bw_usage_update_bulk(context, start_period, usages,
+                                     last_refreshed)
+
     def get_backdoor_port(self, context):
         return self.backdoor_port
 
@@ -149,3 +171,11 @@ class ConductorManager(manager.SchedulerDependentManager):
         info = self.db.agent_build_get_by_triple(context, hypervisor, os,
                                                  architecture)
         return jsonutils.to_primitive(info)
+
+    def compute_node_get_by_host(self, context, host):
+        compute_node = self.db.compute_node_get_by_host(context.elevated(),
+                                                        host)
+        return jsonutils.to_primitive(compute_node)
+
+    def metadata_cache_warm(self, context, addresses):
+        metadata_handler.warm_cache(addresses)
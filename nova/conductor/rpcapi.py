@@ -39,6 +39,10 @@ class ConductorAPI(nova.openstack.common.rpc.proxy.RpcProxy):
           security_group_rule_get_by_security_group
     1.9 - Added provider_fw_rule_get_all
     1.10 - Added agent_build_get_by_triple
+    1.11 - Added instance_get_all_by_uuids, bw_usage_get_by_uuids and
+           bw_usage_update_bulk
+    1.12 - Added instance_get_all_by_filters and compute_node_get_by_host
+    1.13 - Added metadata_cache_warm
     """
 
     BASE_RPC_API_VERSION = '1.0'
@@ -64,6 +68,20 @@ class ConductorAPI(nova.openstack.common.rpc.proxy.RpcProxy):
         msg = self.make_msg('instance_get_all_by_host', host=host)
         return self.call(context, msg, version='1.2')
 
+    def instance_get_all_by_uuids(self, context, instance_uuids):
+        msg = self.make_msg('instance_get_all_by_uuids',
+                            instance_uuids=instance_uuids)
+        return self.call(context, msg, version='1.11')
+
+    def instance_get_all_by_filters(self, context, filters, sort_key,
+                                    sort_dir, limit=None,
+                                    columns_to_join=None):
+        msg = self.make_msg('instance_get_all_by_filters',
+                            filters=filters, sort_key=sort_key,
+                            sort_dir=sort_dir, limit=limit,
+                            columns_to_join=columns_to_join)
+        return self.call(context, msg, version='1.12')
+
     def migration_get(self, context, migration_id):
         msg = self.make_msg('migration_get', migration_id=migration_id)
         return self.call(context, msg, version='1.4')
@@ -115,6 +133,18 @@ class ConductorAPI(nova.openstack.common.rpc.proxy.RpcProxy):
                             last_refreshed=last_refreshed)
         return self.call(context, msg, version='1.5')
 
+    def bw_usage_get_by_uuids(self, context, uuids, start_period):
+        msg = self.make_msg('bw_usage_get_by_uuids', uuids=uuids,
+                            start_period=start_period)
+        return self.call(context, msg, version='1.11')
+
+    def bw_usage_update_bulk(self, context, start_period, usages,
+                             last_refreshed=None):
+        msg = self.make_msg('bw_usage_update_bulk',
+                            start_period=start_period, usages=usages,
+                            last_refreshed=last_refreshed)
+        return self.call(context, msg, version='1.11')
+
     def get_backdoor_port(self, context):
         msg = self.make_msg('get_backdoor_port')
         return self.call(context, msg, version='1.6')
@@ -140,3 +170,11 @@ class ConductorAPI(nova.openstack.common.rpc.proxy.RpcProxy):
                             hypervisor=hypervisor, os=os,
                             architecture=architecture)
         return self.call(context, msg, version='1.10')
+
+    def compute_node_get_by_host(self, context, host):
+        msg = self.make_msg('compute_node_get_by_host', host=host)
+        return self.call(context, msg, version='1.12')
+
+    def metadata_cache_warm(self, context, addresses):
+        msg = self.make_msg('metadata_cache_warm', addresses=addresses)
+        self.cast(context, msg, version='1.13')
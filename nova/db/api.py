@@ -180,9 +180,13 @@ def compute_node_get(context, compute_id):
     return IMPL.compute_node_get(context, compute_id)
 
 
-def compute_node_get_all(context):
-    """Get all computeNodes."""
-    return IMPL.compute_node_get_all(context)
+def compute_node_get_all(context, updated_since=None):
+    """Get all computeNodes.
+
+    If updated_since is given, only computeNodes created, updated or
+    deleted since then are returned, including deleted ones.
+    """
+    return IMPL.compute_node_get_all(context, updated_since=updated_since)
 
 
 def compute_node_search_by_hypervisor(context, hypervisor_match):
@@ -570,6 +574,14 @@ def instance_get_by_uuid(context, uuid):
     return IMPL.instance_get_by_uuid(context, uuid)
 
 
+def instance_get_all_by_uuids(context, uuids):
+    """Get all instances with the given uuids.
+
+    Uuids that do not match an instance are ignored.
+    """
+    return IMPL.instance_get_all_by_uuids(context, uuids)
+
+
 def instance_get(context, instance_id):
     """Get an instance or raise if it does not exist."""
     return IMPL.instance_get(context, instance_id)
@@ -581,11 +593,13 @@ def instance_get_all(context, columns_to_join=None):
 
 
 def instance_get_all_by_filters(context, filters, sort_key='created_at',
-                                sort_dir='desc', limit=None, marker=None):
+                                sort_dir='desc', limit=None, marker=None,
+                                columns_to_join=None):
     """Get all instances that match all filters."""
     return IMPL.instance_get_all_by_filters(context, filters, sort_key,
                                             sort_dir, limit=limit,
-                                            marker=marker)
+                                            marker=marker,
+                                            columns_to_join=columns_to_join)
 
 
 def instance_get_active_by_window(context, begin, end=None, project_id=None,
@@ -615,6 +629,16 @@ def instance_get_all_by_project(context, project_id):
     return IMPL.instance_get_all_by_project(context, project_id)
 
 
+def instance_get_all_by_fixed_ip_addresses(context, addresses):
+    """Get the instances with the given fixed ip addresses, for metadata.
+
+    Returns a dict mapping each address that was found to a tuple of the
+    instance, with everything InstanceMetadata needs loaded, and the
+    availability zone of the instance's host, in a single query.
+    """
+    return IMPL.instance_get_all_by_fixed_ip_addresses(context, addresses)
+
+
 def instance_get_all_by_host(context, host):
     """Get all instances belonging to a host."""
     return IMPL.instance_get_all_by_host(context, host)
@@ -994,9 +1018,9 @@ def quota_destroy_all_by_project(context, project_id):
     return IMPL.quota_destroy_all_by_project(context, project_id)
 
 
-def reservation_expire(context):
-    """Roll back any expired reservations."""
-    return IMPL.reservation_expire(context)
+def reservation_expire(context, batch_size=None):
+    """Roll back any expired reservations, batch_size at a time."""
+    return IMPL.reservation_expire(context, batch_size=batch_size)
 
 
 ###################
@@ -1416,6 +1440,15 @@ def bw_usage_update(context, uuid, mac, start_period, bw_in, bw_out,
             bw_out, last_ctr_in, last_ctr_out, last_refreshed=last_refreshed)
 
 
+def bw_usage_update_bulk(context, start_period, usages, last_refreshed=None):
+    """Update cached bandwidth usage for several instance networks in one
+    transaction.  usages is a list of dicts with uuid, mac, bw_in, bw_out,
+    last_ctr_in and last_ctr_out keys.  Creates new records if needed.
+    """
+    return IMPL.bw_usage_update_bulk(context, start_period, usages,
+                                     last_refreshed=last_refreshed)
+
+
 ####################
 
 
@@ -33,6 +33,7 @@ from sqlalchemy.orm import joinedload_all
 from sqlalchemy.sql.expression import asc
 from sqlalchemy.sql.expression import desc
 from sqlalchemy.sql.expression import literal_column
+from sqlalchemy.sql.expression import select
 from sqlalchemy.sql import func
 
 from nova import block_device
@@ -457,10 +458,19 @@ def _compute_node_get(context, compute_id, session=None):
 
 
 @require_admin_context
-def compute_node_get_all(context):
-    return model_query(context, models.ComputeNode).\
+def compute_node_get_all(context, updated_since=None):
+    if updated_since is None:
+        return model_query(context, models.ComputeNode).\
+                options(joinedload('service')).\
+                options(joinedload('stats')).\
+                all()
+
+    return model_query(context, models.ComputeNode, read_deleted="yes").\
             options(joinedload('service')).\
             options(joinedload('stats')).\
+            filter(or_(models.ComputeNode.created_at >= updated_since,
+                       models.ComputeNode.updated_at >= updated_since,
+                       models.ComputeNode.deleted_at >= updated_since)).\
             all()
 
 
@@ -536,6 +546,9 @@ def _update_stats(context, new_stats, compute_id, session, prune_stats=False):
 def compute_node_update(context, compute_id, values, prune_stats=False):
     """Updates the ComputeNode record with the most recent data"""
     stats = values.pop('stats', {})
+    # NOTE: Always move updated_at, even if only stats changed, so that
+    # compute_node_get_all(updated_since=...) sees this update.
+    values['updated_at'] = timeutils.utcnow()
 
     session = get_session()
     with session.begin(subtransactions=True):
@@ -551,6 +564,7 @@ def compute_node_get_by_host(context, host):
             join('service').\
             filter(models.Service.host == host).\
             filter_by(deleted=False).\
+            options(joinedload('stats')).\
             first()
     return result
 
@@ -1523,6 +1537,34 @@ def _build_instance_get(context, session=None):
             options(joinedload('system_metadata'))
 
 
+@require_admin_context
+def instance_get_all_by_fixed_ip_addresses(context, addresses):
+    if not addresses:
+        return {}
+
+    # Any service on the instance's host gives its availability zone
+    availability_zone = select([func.min(models.Service.availability_zone)]).\
+            where(and_(models.Service.host == models.Instance.host,
+                       models.Service.deleted == False)).\
+            as_scalar()
+    rows = model_query(context, models.Instance, models.FixedIp.address,
+                       availability_zone, read_deleted="no").\
+            join((models.FixedIp,
+                  models.FixedIp.instance_uuid == models.Instance.uuid)).\
+            filter(models.FixedIp.address.in_(addresses)).\
+            filter(models.FixedIp.deleted == False).\
+            options(joinedload('security_groups')).\
+            options(joinedload('info_cache')).\
+            options(joinedload('metadata')).\
+            options(joinedload('instance_type')).\
+            options(joinedload('system_metadata')).\
+            options(joinedload('block_device_mapping')).\
+            all()
+
+    return dict((address, (instance, availability_zone))
+                for instance, address, availability_zone in rows)
+
+
 @require_context
 def instance_get_all(context, columns_to_join=None):
     if columns_to_join is None:
@@ -1542,7 +1584,8 @@ def instance_get_all(context, columns_to_join=None):
 
 @require_context
 def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
-                                limit=None, marker=None, session=None):
+                                limit=None, marker=None, columns_to_join=None,
+                                session=None):
     """Return instances that match all filters.  Deleted instances
     will be returned by default, unless there's a filter that says
     otherwise"""
@@ -1552,12 +1595,13 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
     if not session:
         session = get_session()
 
-    query_prefix = session.query(models.Instance).\
-            options(joinedload('info_cache')).\
-            options(joinedload('security_groups')).\
-            options(joinedload('system_metadata')).\
-            options(joinedload('metadata')).\
-            options(joinedload('instance_type')).\
+    if columns_to_join is None:
+        columns_to_join = ['info_cache', 'security_groups',
+                           'system_metadata', 'metadata', 'instance_type']
+    query_prefix = session.query(models.Instance)
+    for column in columns_to_join:
+        query_prefix = query_prefix.options(joinedload(column))
+    query_prefix = query_prefix.\
             order_by(sort_fn[sort_dir](getattr(models.Instance, sort_key)))
 
     # Make a copy of the filters dictionary to use going forward, as we'll
@@ -1602,10 +1646,19 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
 
     # paginate query
     if marker is not None:
-        try:
-            marker = _instance_get_by_uuid(context, marker, session=session)
-        except exception.InstanceNotFound:
-            raise exception.MarkerNotFound(marker)
+        # NOTE: The marker is looked up regardless of deletion.  It may
+        # be a deleted instance when deleted instances are listed, or the
+        # last instance of a page that was deleted before the next page
+        # was asked for, as happens when compute API get_all_iter() reads
+        # a long listing in chunks.  Deleted instances are still filtered
+        # out of the results unless they were asked for.
+        marker_uuid = marker
+        marker = model_query(context, models.Instance, session=session,
+                             project_only=True, read_deleted="yes").\
+                        filter_by(uuid=marker_uuid).\
+                        first()
+        if not marker:
+            raise exception.MarkerNotFound(marker_uuid)
     query_prefix = paginate_query(query_prefix, models.Instance, limit,
                            [sort_key, 'created_at', 'id'],
                            marker=marker,
@@ -1615,6 +1668,114 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
     return instances
 
 
+_REGEXP_OP_MAP = {
+    'postgresql': '~',
+    'mysql': 'REGEXP',
+    'oracle': 'REGEXP_LIKE',
+    'sqlite': 'REGEXP'
+}
+
+# Databases where LIKE is as case sensitive as the regexp operator, so
+# literal regexps can be turned into LIKE patterns.
+_REGEXP_LIKE_DBS = ('postgresql', 'mysql')
+
+_REGEXP_SPECIAL_CHARS = '.^$*+?{}[]|()'
+
+# { sql_connection : (db_string, regexp op) }
+_regexp_op_cache = {}
+
+
+def _get_regexp_op():
+    """Return the database name and its regexp operator, which falls
+    back to LIKE for unknown databases."""
+    connection = CONF.sql_connection
+    try:
+        return _regexp_op_cache[connection]
+    except KeyError:
+        db_string = connection.split(':')[0].split('+')[0]
+        result = (db_string, _REGEXP_OP_MAP.get(db_string, 'LIKE'))
+        _regexp_op_cache[connection] = result
+        return result
+
+
+def _parse_literal_regexp(value):
+    """Split a regexp that only matches a literal string into
+    (anchored_start, literal, anchored_end).  Returns None if the regexp
+    uses anything other than literal characters, escaped punctuation and
+    the ^ and $ anchors."""
+    anchored_start = value.startswith('^')
+    if anchored_start:
+        value = value[1:]
+    anchored_end = False
+    literal = []
+    index = 0
+    while index < len(value):
+        char = value[index]
+        if char == '\\':
+            index += 1
+            if index == len(value) or value[index].isalnum():
+                return None
+            literal.append(value[index])
+        elif char == '$' and index == len(value) - 1:
+            anchored_end = True
+        elif char in _REGEXP_SPECIAL_CHARS:
+            return None
+        else:
+            literal.append(char)
+        index += 1
+    return anchored_start, ''.join(literal), anchored_end
+
+
+def _escape_like(literal):
+    return literal.replace('\\', '\\\\').replace('%', '\\%').\
+            replace('_', '\\_')
+
+
+def regex_filter_plan(model, filters):
+    """Work out how regex_filter() will apply each filter.
+
+    Returns a dict mapping each filter name that is a column of the model
+    to a tuple of (kind, value), where kind is one of:
+
+    'exact': value is compared with =
+    'prefix', 'suffix' or 'substring': value is a LIKE pattern
+    'regexp': value is matched with the database regexp operator
+
+    Regexps that only match a literal string are turned into 'exact' or
+    LIKE predicates, which can use indexes and avoid REGEXP full scans.
+    """
+    db_string, db_regexp_op = _get_regexp_op()
+    plan = {}
+    for filter_name, filter_value in filters.iteritems():
+        try:
+            column_attr = getattr(model, filter_name)
+        except AttributeError:
+            continue
+        if 'property' == type(column_attr).__name__:
+            continue
+        value = str(filter_value)
+        parsed = None
+        if db_regexp_op != 'LIKE':
+            parsed = _parse_literal_regexp(value)
+        if parsed is None:
+            plan[filter_name] = ('regexp', value)
+            continue
+
+        anchored_start, literal, anchored_end = parsed
+        if anchored_start and anchored_end:
+            plan[filter_name] = ('exact', literal)
+        elif db_string not in _REGEXP_LIKE_DBS or not literal:
+            plan[filter_name] = ('regexp', value)
+        elif anchored_start:
+            plan[filter_name] = ('prefix', '%s%%' % _escape_like(literal))
+        elif anchored_end:
+            plan[filter_name] = ('suffix', '%%%s' % _escape_like(literal))
+        else:
+            plan[filter_name] = ('substring',
+                                 '%%%s%%' % _escape_like(literal))
+    return plan
+
+
 def regex_filter(query, model, filters):
     """Applies regular expression filtering to a query.
 
@@ -1625,23 +1786,21 @@ def regex_filter(query, model, filters):
     :param filters: dictionary of filters with regex values
     """
 
-    regexp_op_map = {
-        'postgresql': '~',
-        'mysql': 'REGEXP',
-        'oracle': 'REGEXP_LIKE',
-        'sqlite': 'REGEXP'
-    }
-    db_string = CONF.sql_connection.split(':')[0].split('+')[0]
-    db_regexp_op = regexp_op_map.get(db_string, 'LIKE')
-    for filter_name in filters.iterkeys():
-        try:
-            column_attr = getattr(model, filter_name)
-        except AttributeError:
-            continue
-        if 'property' == type(column_attr).__name__:
-            continue
-        query = query.filter(column_attr.op(db_regexp_op)(
-                                    str(filters[filter_name])))
+    db_string, db_regexp_op = _get_regexp_op()
+    fallbacks = []
+    plan = regex_filter_plan(model, filters)
+    for filter_name, (kind, value) in plan.iteritems():
+        column_attr = getattr(model, filter_name)
+        if kind == 'exact':
+            query = query.filter(column_attr == value)
+        elif kind == 'regexp':
+            fallbacks.append(filter_name)
+            query = query.filter(column_attr.op(db_regexp_op)(value))
+        else:
+            query = query.filter(column_attr.like(value, escape='\\'))
+    if fallbacks:
+        LOG.debug(_("Filters using %(db_regexp_op)s: %(fallbacks)s"),
+                  locals())
     return query
 
 
@@ -1696,6 +1855,15 @@ def _instance_get_all_query(context, project_only=False):
                    options(joinedload('instance_type'))
 
 
+@require_context
+def instance_get_all_by_uuids(context, uuids):
+    if not uuids:
+        return []
+    return _build_instance_get(context).\
+                filter(models.Instance.uuid.in_(uuids)).\
+                all()
+
+
 @require_admin_context
 def instance_get_all_by_host(context, host):
     return _instance_get_all_query(context).filter_by(host=host).all()
@@ -2765,39 +2933,123 @@ def _quota_reservations(session, context, reservations):
                    all()
 
 
-@require_context
-def reservation_commit(context, reservations):
+def _quota_reservations_delete(session, context, reservation_ids):
+    """Soft delete the given reservations with a single UPDATE."""
+    model_query(context, models.Reservation, session=session,
+                read_deleted="no").\
+            filter(models.Reservation.id.in_(reservation_ids)).\
+            update({'deleted': True,
+                    'deleted_at': timeutils.utcnow(),
+                    'updated_at': literal_column('updated_at')},
+                   synchronize_session=False)
+
+
+def _reservations_release(context, reservations, commit):
     session = get_session()
     with session.begin():
         usages = _get_quota_usages(context, session)
 
+        # Sum the deltas per usage row, so each usage is updated once
+        # however many of its reservations are released.
+        in_use = collections.defaultdict(int)
+        reserved = collections.defaultdict(int)
+        reservation_ids = []
         for reservation in _quota_reservations(session, context, reservations):
-            usage = usages[reservation.resource]
             if reservation.delta >= 0:
-                usage.reserved -= reservation.delta
-            usage.in_use += reservation.delta
+                reserved[reservation.resource] += reservation.delta
+            if commit:
+                in_use[reservation.resource] += reservation.delta
+            reservation_ids.append(reservation.id)
 
-            reservation.delete(session=session)
+        if not reservation_ids:
+            return
 
-        for usage in usages.values():
+        for resource in set(in_use.keys()) | set(reserved.keys()):
+            usage = usages[resource]
+            usage.reserved -= reserved[resource]
+            usage.in_use += in_use[resource]
             usage.save(session=session)
 
+        _quota_reservations_delete(session, context, reservation_ids)
+
+
+@require_context
+def reservation_commit(context, reservations):
+    _reservations_release(context, reservations, commit=True)
+
 
 @require_context
 def reservation_rollback(context, reservations):
+    _reservations_release(context, reservations, commit=False)
+
+
+def _reservation_expire_batch(context, batch_size):
+    """Roll back up to batch_size expired reservations in one
+    transaction.  Returns the number of expired reservations found.
+    """
+    current_time = timeutils.utcnow()
+    query = model_query(context, models.Reservation.id,
+                        models.Reservation.usage_id, read_deleted="no").\
+                    filter(models.Reservation.expire < current_time).\
+                    order_by(asc(models.Reservation.expire))
+    if batch_size:
+        query = query.limit(batch_size)
+    candidates = query.all()
+    if not candidates:
+        return 0
+
     session = get_session()
     with session.begin():
-        usages = _get_quota_usages(context, session)
+        # Lock the usages before the reservations, like quota_reserve()
+        # does, then re-read the reservations in case they were
+        # committed or rolled back since they were found.
+        usage_ids = sorted(set(usage_id for _id, usage_id in candidates))
+        model_query(context, models.QuotaUsage.id, session=session,
+                    read_deleted="no").\
+                filter(models.QuotaUsage.id.in_(usage_ids)).\
+                order_by(asc(models.QuotaUsage.id)).\
+                with_lockmode('update').\
+                all()
+        rows = model_query(context, models.Reservation.id,
+                           models.Reservation.usage_id,
+                           models.Reservation.delta, session=session,
+                           read_deleted="no").\
+                       filter(models.Reservation.id.in_(
+                            [reservation_id
+                             for reservation_id, _usage_id in candidates])).\
+                       with_lockmode('update').\
+                       all()
 
-        for reservation in _quota_reservations(session, context, reservations):
-            usage = usages[reservation.resource]
-            if reservation.delta >= 0:
-                usage.reserved -= reservation.delta
+        reserved = collections.defaultdict(int)
+        for _id, usage_id, delta in rows:
+            if delta >= 0:
+                reserved[usage_id] += delta
+        for usage_id, delta in reserved.iteritems():
+            model_query(context, models.QuotaUsage, session=session,
+                        read_deleted="no").\
+                    filter_by(id=usage_id).\
+                    update({'reserved': models.QuotaUsage.reserved - delta,
+                            'updated_at': timeutils.utcnow()},
+                           synchronize_session=False)
 
-            reservation.delete(session=session)
+        if rows:
+            _quota_reservations_delete(session, context,
+                                       [row[0] for row in rows])
 
-        for usage in usages.values():
-            usage.save(session=session)
+    return len(candidates)
+
+
+@require_admin_context
+def reservation_expire(context, batch_size=None):
+    """Roll back expired reservations, batch_size at a time, each batch
+    in its own transaction so that no locks are held for long.  A
+    batch_size of None or less than 1 expires them all in one batch.
+    """
+    if batch_size is None or batch_size < 1:
+        _reservation_expire_batch(context, None)
+        return
+    while _reservation_expire_batch(context, batch_size) == batch_size:
+        pass
 
 
 @require_admin_context
@@ -2829,25 +3081,6 @@ def quota_destroy_all_by_project(context, project_id):
             reservation_ref.delete(session=session)
 
 
-@require_admin_context
-def reservation_expire(context):
-    session = get_session()
-    with session.begin():
-        current_time = timeutils.utcnow()
-        results = model_query(context, models.Reservation, session=session,
-                              read_deleted="no").\
-                          filter(models.Reservation.expire < current_time).\
-                          all()
-
-        if results:
-            for reservation in results:
-                if reservation.delta >= 0:
-                    reservation.usage.reserved -= reservation.delta
-                    reservation.usage.save(session=session)
-
-                reservation.delete(session=session)
-
-
 ###################
 
 
@@ -4081,6 +4314,39 @@ def bw_usage_update(context, uuid, mac, start_period, bw_in, bw_out,
         bwusage.save(session=session)
 
 
+@require_context
+def bw_usage_update_bulk(context, start_period, usages, last_refreshed=None):
+    if not usages:
+        return
+    if last_refreshed is None:
+        last_refreshed = timeutils.utcnow()
+
+    session = get_session()
+    with session.begin():
+        uuids = set(usage['uuid'] for usage in usages)
+        rows = model_query(context, models.BandwidthUsage,
+                           session=session, read_deleted="yes").\
+                       filter(models.BandwidthUsage.uuid.in_(uuids)).\
+                       filter_by(start_period=start_period).\
+                       all()
+        existing = dict(((row.uuid, row.mac), row) for row in rows)
+
+        for usage in usages:
+            bwusage = existing.get((usage['uuid'], usage['mac']))
+            if bwusage is None:
+                bwusage = models.BandwidthUsage()
+                bwusage.start_period = start_period
+                bwusage.uuid = usage['uuid']
+                bwusage.mac = usage['mac']
+                existing[(usage['uuid'], usage['mac'])] = bwusage
+            bwusage.last_refreshed = last_refreshed
+            bwusage.bw_in = usage['bw_in']
+            bwusage.bw_out = usage['bw_out']
+            bwusage.last_ctr_in = usage['last_ctr_in']
+            bwusage.last_ctr_out = usage['last_ctr_out']
+            session.add(bwusage)
+
+
 ####################
 
 
@@ -442,6 +442,8 @@ class Reservation(BASE, NovaBase):
     """Represents a resource reservation for quotas."""
 
     __tablename__ = 'reservations'
+    __table_args__ = (schema.Index('reservations_deleted_expire_idx',
+                                   'deleted', 'expire'), )
     id = Column(Integer, primary_key=True)
     uuid = Column(String(36), nullable=False)
 
@@ -19,14 +19,20 @@
 
 from __future__ import absolute_import
 
+import collections
 import copy
+import httplib
 import itertools
+import os
 import random
 import sys
 import time
 import urlparse
 
+import eventlet
+from eventlet import queue
 import glanceclient
+from glanceclient.common import http as glanceclient_http
 import glanceclient.exc
 
 from nova import exception
@@ -48,6 +54,17 @@ glance_opts = [
     cfg.IntOpt('glance_num_retries',
                default=0,
                help='Number retries when downloading an image from glance'),
+    cfg.IntOpt('glance_download_workers',
+               default=1,
+               help='Number of connections used to download an image to a '
+                    'file from glance, each fetching a different range of '
+                    'the image.  Ranges are spread over '
+                    'glance_api_servers.  1 downloads the image in a '
+                    'single request'),
+    cfg.IntOpt('glance_download_range_size',
+               default=64 * 1024 * 1024,
+               help='Size in bytes of the ranges of images downloaded by '
+                    'each of the glance_download_workers'),
 ]
 
 LOG = logging.getLogger(__name__)
@@ -86,6 +103,20 @@ def _create_glance_client(context, host, port, use_ssl, version=1):
     return glanceclient.Client(str(version), endpoint, **params)
 
 
+def _create_glance_connection(host, port, use_ssl):
+    """Instantiate an httplib connection to a glance server, with the SSL
+    settings of the clients _create_glance_client() creates.
+    """
+    if use_ssl:
+        scheme = 'https'
+    else:
+        scheme = 'http'
+    endpoint = '%s://%s:%s' % (scheme, host, port)
+    http_client = glanceclient_http.HTTPClient(
+        endpoint, insecure=CONF.glance_api_insecure)
+    return http_client.get_connection()
+
+
 def get_api_servers():
     """
     Shuffle a list of CONF.glance_api_servers and return an iterator
@@ -230,8 +261,27 @@ class GlanceImageService(object):
 
         return getattr(image_meta, 'direct_url', None)
 
-    def download(self, context, image_id, data):
-        """Calls out to Glance for metadata and data and writes data."""
+    def download(self, context, image_id, data=None, dst_path=None,
+                 image_meta=None):
+        """Calls out to Glance for metadata and data and writes data.
+
+        If dst_path is given, the image is written to that file in ranges
+        downloaded in parallel if CONF.glance_download_workers is more
+        than 1 and glance serves ranges, and True is returned.  Otherwise
+        it is downloaded in a single request and written to data, or to
+        dst_path if data is None.  image_meta is what show() returns for
+        the image, if the caller already has it.
+        """
+        if dst_path is not None:
+            if (CONF.glance_download_workers > 1 and
+                self._download_ranges(context, image_id, dst_path,
+                                      image_meta)):
+                return True
+            if data is None:
+                with open(dst_path, 'wb') as data:
+                    self.download(context, image_id, data)
+                return False
+
         try:
             image_chunks = self._client.call(context, 1, 'data', image_id)
         except Exception:
@@ -240,6 +290,179 @@ class GlanceImageService(object):
         for chunk in image_chunks:
             data.write(chunk)
 
+    def _range_servers(self):
+        """Return an iterator over the glance servers to get ranges from,
+        as (host, port, use_ssl).
+        """
+        if self._client.client is not None:
+            return itertools.repeat((self._client.host, self._client.port,
+                                     self._client.use_ssl))
+        return get_api_servers()
+
+    def _get_range(self, context, server, image_id, start, end):
+        """Request bytes start to end (included) of an image.  Returns the
+        connection and the response, which is read by the caller.
+        """
+        host, port, use_ssl = server
+        try:
+            conn = _create_glance_connection(host, port, use_ssl)
+        except glanceclient.exc.InvalidEndpoint as e:
+            raise exception.GlanceConnectionFailed(host=host, port=port,
+                                                   reason=str(e))
+        headers = {'Range': 'bytes=%d-%d' % (start, end)}
+        if CONF.auth_strategy == 'keystone':
+            headers['X-Auth-Token'] = context.auth_token
+        try:
+            conn.request('GET', '/v1/images/%s' % image_id, headers=headers)
+            return conn, conn.getresponse()
+        except (httplib.HTTPException, IOError) as e:
+            conn.close()
+            raise exception.GlanceConnectionFailed(host=host, port=port,
+                                                   reason=str(e))
+
+    def _download_range(self, context, server, image_id, start, end, fd):
+        """Write bytes start to end (included) of an image at the same
+        offset of the file fd.
+        """
+        conn, response = self._get_range(context, server, image_id,
+                                         start, end)
+        host, port, _use_ssl = server
+        try:
+            if response.status != httplib.PARTIAL_CONTENT:
+                status = response.status
+                raise exception.GlanceConnectionFailed(host=host, port=port,
+                    reason=_('status %(status)s for a range of image '
+                             '%(image_id)s') % locals())
+            os.lseek(fd, start, os.SEEK_SET)
+            remaining = end - start + 1
+            while remaining:
+                chunk = response.read(min(remaining, 65536))
+                if not chunk:
+                    raise exception.GlanceConnectionFailed(host=host,
+                        port=port,
+                        reason=_('range of image %s ended early') % image_id)
+                remaining -= len(chunk)
+                while chunk:
+                    chunk = chunk[os.write(fd, chunk):]
+        finally:
+            conn.close()
+
+    def _serves_ranges(self, context, servers, image_id):
+        """Check that glance serves ranges of an image, asking the next
+        server again on a connection error, according to
+        CONF.glance_num_retries.
+        """
+        num_attempts = 1 + CONF.glance_num_retries
+        for attempt in xrange(1, num_attempts + 1):
+            server = servers.next()
+            try:
+                conn, response = self._get_range(context, server, image_id,
+                                                 0, 0)
+            except exception.GlanceConnectionFailed as e:
+                host, port, _use_ssl = server
+                extra = "retrying"
+                error_msg = _("Error requesting a range of image "
+                              "%(image_id)s from glance server "
+                              "'%(host)s:%(port)s', %(extra)s: %(e)s")
+                if attempt == num_attempts:
+                    extra = 'done trying'
+                    LOG.warn(error_msg, locals())
+                    return False
+                LOG.warn(error_msg, locals())
+                time.sleep(1)
+                continue
+            conn.close()
+            return response.status == httplib.PARTIAL_CONTENT
+
+    def _download_ranges(self, context, image_id, dst_path, image_meta=None):
+        """Download an image to dst_path in ranges of
+        CONF.glance_download_range_size, CONF.glance_download_workers at
+        a time.  A range that fails is retried on the next server,
+        according to CONF.glance_num_retries.
+
+        Returns False, without writing dst_path, if glance does not serve
+        ranges of the image.
+        """
+        if image_meta is None:
+            image_meta = self.show(context, image_id)
+        size = image_meta.get('size')
+        if not size:
+            return False
+        servers = self._range_servers()
+
+        # Check that glance serves ranges before starting the workers
+        if not self._serves_ranges(context, servers, image_id):
+            LOG.debug(_('Not downloading ranges of image %s, downloading '
+                        'it in a single request'), image_id)
+            return False
+
+        range_size = CONF.glance_download_range_size
+        ranges = collections.deque((start, min(start + range_size, size) - 1)
+                                   for start in xrange(0, size, range_size))
+        # Ranges are written in place, in a sparse file of the image size
+        with open(dst_path, 'wb') as image_file:
+            image_file.truncate(size)
+
+        num_attempts = 1 + CONF.glance_num_retries
+
+        def download_range(server, start, end, fd):
+            for attempt in xrange(1, num_attempts + 1):
+                try:
+                    self._download_range(context, server, image_id,
+                                         start, end, fd)
+                    return server
+                except (exception.GlanceConnectionFailed,
+                        httplib.HTTPException, IOError) as e:
+                    host, port, _use_ssl = server
+                    extra = "retrying"
+                    error_msg = _("Error downloading bytes %(start)d to "
+                                  "%(end)d of image %(image_id)s from glance "
+                                  "server '%(host)s:%(port)s', %(extra)s: "
+                                  "%(e)s")
+                    if attempt == num_attempts:
+                        extra = 'done trying'
+                        LOG.error(error_msg, locals())
+                        raise
+                    LOG.warn(error_msg, locals())
+                    # Consecutive servers differ unless there is only one
+                    failed_server = server
+                    server = servers.next()
+                    if server == failed_server:
+                        server = servers.next()
+                    time.sleep(1)
+
+        # None from each worker that completes, or the exc_info of the
+        # error it stopped on
+        results = queue.LightQueue()
+
+        def worker(server):
+            fd = os.open(dst_path, os.O_WRONLY)
+            try:
+                while ranges:
+                    start, end = ranges.popleft()
+                    # Keep the server the range was downloaded from
+                    server = download_range(server, start, end, fd)
+            except Exception:
+                results.put(sys.exc_info())
+            else:
+                results.put(None)
+            finally:
+                os.close(fd)
+
+        workers = min(CONF.glance_download_workers, len(ranges))
+        pool = eventlet.GreenPool(workers)
+        threads = [pool.spawn(worker, servers.next())
+                   for i in xrange(workers)]
+        for i in xrange(workers):
+            exc_info = results.get()
+            if exc_info is not None:
+                # The caller removes dst_path, so the other workers must
+                # not write to it any more
+                for thread in threads:
+                    thread.kill()
+                raise exc_info[0], exc_info[1], exc_info[2]
+        return True
+
     def create(self, context, image_meta, data=None):
         """Store the image data and return the new image object."""
         sent_service_image_meta = self._translate_to_glance(image_meta)
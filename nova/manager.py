@@ -53,6 +53,9 @@ This module provides Manager, a base class for managers.
 
 """
 
+import datetime
+import random
+
 import eventlet
 
 from nova.db import base
@@ -60,10 +63,28 @@ from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
 from nova.openstack.common.plugin import pluginmanager
 from nova.openstack.common.rpc import dispatcher as rpc_dispatcher
+from nova.openstack.common import timeutils
 from nova.scheduler import rpcapi as scheduler_rpcapi
+from nova import utils
 from nova import version
 
+periodic_opts = [
+    cfg.FloatOpt('periodic_task_jitter',
+                 default=1.0,
+                 help='Fraction of its spacing by which the first run of '
+                      'a periodic task with a spacing is randomly delayed, '
+                      'so that hosts started together do not all run the '
+                      'task at the same time.  0 disables the jitter.'),
+    cfg.IntOpt('periodic_task_budget',
+               default=0,
+               help='Seconds a single pass of the periodic task scheduler '
+                    'may spend running tasks.  Due tasks that do not fit '
+                    'are run first on the next pass.  At least one task '
+                    'runs per pass.  0 means unlimited.'),
+    ]
+
 CONF = cfg.CONF
+CONF.register_opts(periodic_opts)
 CONF.import_opt('host', 'nova.config')
 LOG = logging.getLogger(__name__)
 
@@ -78,10 +99,18 @@ def periodic_task(*args, **kwargs):
 
         2. With arguments, @periodic_task(ticks_between_runs=N), this will be
            run on every N ticks of the periodic scheduler.
+
+        3. With arguments, @periodic_task(spacing=N), this will be run on
+           the first tick at least N seconds after its previous run.  The
+           first run is delayed by a random fraction of N, see
+           CONF.periodic_task_jitter.  N may be the name of an option
+           holding the spacing, which is then read when the task is
+           scheduled rather than when the module is imported.
     """
     def decorator(f):
         f._periodic_task = True
         f._ticks_between_runs = kwargs.pop('ticks_between_runs', 0)
+        f._periodic_spacing = kwargs.pop('spacing', 0)
         return f
 
     # NOTE(sirp): The `if` is necessary to allow the decorator to be used with
@@ -142,6 +171,11 @@ class Manager(base.Base):
         self.host = host
         self.load_plugins()
         self.backdoor_port = None
+        # { task name : time of the next run }, for tasks with a spacing
+        self._periodic_next_run = {}
+        # { task name : time the last run started }
+        self._periodic_last_run = {}
+        self._periodic_stats = {}
         super(Manager, self).__init__(db_driver)
 
     def load_plugins(self):
@@ -156,31 +190,117 @@ class Manager(base.Base):
         '''
         return rpc_dispatcher.RpcDispatcher([self])
 
+    @staticmethod
+    def _periodic_task_spacing(task):
+        spacing = task._periodic_spacing
+        if isinstance(spacing, basestring):
+            spacing = CONF[spacing]
+        return spacing
+
+    def _periodic_task_due(self, task_name, task, now):
+        """Return True if the task should run on this tick."""
+        spacing = self._periodic_task_spacing(task)
+        if spacing > 0:
+            next_run = self._periodic_next_run.get(task_name)
+            if next_run is None:
+                jitter = min(max(CONF.periodic_task_jitter, 0.0), 1.0)
+                delay = random.uniform(0, spacing * jitter)
+                next_run = now + datetime.timedelta(seconds=delay)
+                self._periodic_next_run[task_name] = next_run
+            return now >= next_run
+
+        ticks_to_skip = self._ticks_to_skip[task_name]
+        if ticks_to_skip > 0:
+            full_task_name = '.'.join([self.__class__.__name__, task_name])
+            LOG.debug(_("Skipping %(full_task_name)s, %(ticks_to_skip)s"
+                        " ticks left until next run"), locals())
+            self._ticks_to_skip[task_name] -= 1
+            return False
+        return True
+
+    def _periodic_task_stats(self, task_name):
+        return self._periodic_stats.setdefault(task_name,
+                dict(runs=0, errors=0, deferrals=0, overruns=0,
+                     last_time=0.0, max_time=0.0, total_time=0.0))
+
+    def _periodic_task_ran(self, task_name, task, started, elapsed, error):
+        """Reschedule a task and record how long its run took."""
+        spacing = self._periodic_task_spacing(task)
+        if spacing > 0:
+            self._periodic_next_run[task_name] = started + datetime.timedelta(
+                seconds=spacing)
+        else:
+            self._ticks_to_skip[task_name] = task._ticks_between_runs
+        self._periodic_last_run[task_name] = started
+
+        stats = self._periodic_task_stats(task_name)
+        stats['runs'] += 1
+        if error:
+            stats['errors'] += 1
+        stats['last_time'] = elapsed
+        stats['max_time'] = max(stats['max_time'], elapsed)
+        stats['total_time'] += elapsed
+
+        limit = spacing or CONF.periodic_task_budget
+        if limit and elapsed > limit:
+            stats['overruns'] += 1
+            full_task_name = '.'.join([self.__class__.__name__, task_name])
+            LOG.warn(_("Periodic task %(full_task_name)s took %(elapsed).2f "
+                       "seconds, more than its %(limit)s second limit"),
+                     locals())
+
+    def periodic_task_stats(self):
+        """Return the run counts and durations, in seconds, of the periodic
+        tasks that have run, keyed by task name."""
+        return dict((name, stats.copy())
+                    for name, stats in self._periodic_stats.iteritems())
+
     def periodic_tasks(self, context, raise_on_error=False):
         """Tasks to be run at a periodic interval."""
+        tick_start = timeutils.utcnow()
+        due = []
         for task_name, task in self._periodic_tasks:
+            if self._periodic_task_due(task_name, task, tick_start):
+                due.append((task_name, task))
+
+        # Tasks that have waited longest since their last run go first,
+        # so tasks deferred because of the budget are not starved.
+        epoch = datetime.datetime.min
+        due.sort(key=lambda item: self._periodic_last_run.get(item[0], epoch))
+
+        budget = CONF.periodic_task_budget
+        for index, (task_name, task) in enumerate(due):
             full_task_name = '.'.join([self.__class__.__name__, task_name])
 
-            ticks_to_skip = self._ticks_to_skip[task_name]
-            if ticks_to_skip > 0:
-                LOG.debug(_("Skipping %(full_task_name)s, %(ticks_to_skip)s"
-                            " ticks left until next run"), locals())
-                self._ticks_to_skip[task_name] -= 1
-                continue
+            started = timeutils.utcnow()
+            spent = utils.total_seconds(started - tick_start)
+            if index and budget and spent >= budget:
+                for name, _task in due[index:]:
+                    self._periodic_task_stats(name)['deferrals'] += 1
+                deferred = len(due) - index
+                LOG.info(_("Periodic task budget of %(budget)s seconds "
+                           "used, deferring %(deferred)s tasks to the next "
+                           "run"), locals())
+                break
 
-            self._ticks_to_skip[task_name] = task._ticks_between_runs
             LOG.debug(_("Running periodic task %(full_task_name)s"), locals())
 
+            error = False
             try:
                 task(self, context)
-                # NOTE(tiantian): After finished a task, allow manager to
-                # do other work (report_state, processing AMPQ request etc.)
-                eventlet.sleep(0)
             except Exception as e:
+                error = True
                 if raise_on_error:
                     raise
                 LOG.exception(_("Error during %(full_task_name)s: %(e)s"),
                               locals())
+            finally:
+                elapsed = utils.total_seconds(timeutils.utcnow() - started)
+                self._periodic_task_ran(task_name, task, started, elapsed,
+                                        error)
+            # NOTE(tiantian): After finished a task, allow manager to
+            # do other work (report_state, processing AMPQ request etc.)
+            eventlet.sleep(0)
 
     def init_host(self):
         """Hook to do additional manager initialization when one requests
@@ -31,6 +31,7 @@ from nova.openstack.common import fileutils
 from nova.openstack.common import importutils
 from nova.openstack.common import lockutils
 from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
 from nova import utils
 
 
@@ -90,6 +91,17 @@ linux_net_opts = [
     cfg.IntOpt('metadata_port',
                default=8775,
                help='the port for the metadata api port'),
+    cfg.BoolOpt('iptables_incremental_apply',
+                default=False,
+                help='Only restore the iptables chains owned by this '
+                     'binary that changed since the last apply, using '
+                     'iptables-restore --noflush, instead of saving and '
+                     'restoring whole tables on every change'),
+    cfg.IntOpt('iptables_full_apply_interval',
+               default=300,
+               help='With iptables_incremental_apply, seconds after which '
+                    'the next apply saves and restores whole tables again, '
+                    'repairing rules changed outside of nova'),
     ]
 
 CONF = cfg.CONF
@@ -154,6 +166,8 @@ class IptablesTable(object):
         self.chains = set()
         self.unwrapped_chains = set()
         self.remove_chains = set()
+        # (name, wrap) of the chains changed since the last apply
+        self.dirty_chains = set()
 
     def add_chain(self, name, wrap=True):
         """Adds a named chain to the table.
@@ -171,6 +185,7 @@ class IptablesTable(object):
             self.chains.add(name)
         else:
             self.unwrapped_chains.add(name)
+        self.dirty_chains.add((name, wrap))
 
     def remove_chain(self, name, wrap=True):
         """Remove named chain.
@@ -196,6 +211,7 @@ class IptablesTable(object):
         if not wrap:
             self.remove_chains.add(name)
         chain_set.remove(name)
+        self.dirty_chains.add((name, wrap))
         if not wrap:
             self.remove_rules += filter(lambda r: r.chain == name, self.rules)
         self.rules = filter(lambda r: r.chain != name, self.rules)
@@ -205,9 +221,11 @@ class IptablesTable(object):
         else:
             jump_snippet = '-j %s' % (name,)
 
+        jump_rules = filter(lambda r: jump_snippet in r.rule, self.rules)
         if not wrap:
-            self.remove_rules += filter(lambda r: jump_snippet in r.rule,
-                                        self.rules)
+            self.remove_rules += jump_rules
+        for rule in jump_rules:
+            self.dirty_chains.add((rule.chain, rule.wrap))
         self.rules = filter(lambda r: jump_snippet not in r.rule, self.rules)
 
     def add_rule(self, chain, rule, wrap=True, top=False):
@@ -228,6 +246,7 @@ class IptablesTable(object):
             rule = ' '.join(map(self._wrap_target_chain, rule.split(' ')))
 
         self.rules.append(IptablesRule(chain, rule, wrap, top))
+        self.dirty_chains.add((chain, wrap))
 
     def _wrap_target_chain(self, s):
         if s.startswith('$'):
@@ -244,6 +263,7 @@ class IptablesTable(object):
         """
         try:
             self.rules.remove(IptablesRule(chain, rule, wrap, top))
+            self.dirty_chains.add((chain, wrap))
             if not wrap:
                 self.remove_rules.append(IptablesRule(chain, rule, wrap, top))
         except ValueError:
@@ -258,6 +278,31 @@ class IptablesTable(object):
                               if rule.chain == chain and rule.wrap == wrap]
         for rule in chained_rules:
             self.rules.remove(rule)
+        self.dirty_chains.add((chain, wrap))
+
+    def wrapped_chain_rules(self, names):
+        """Return {chain name: rule lines} for the named wrapped chains,
+        in the order an apply puts them in the chain.
+        """
+        top = {}
+        bottom = {}
+        for rule in self.rules:
+            if rule.wrap and rule.chain in names:
+                chain_rules = top if rule.top else bottom
+                chain_rules.setdefault(rule.chain, []).append(str(rule))
+
+        result = {}
+        for name in names:
+            # Like _modify_rules, let the last of duplicate rules win
+            seen = set()
+            lines = []
+            for line in reversed(top.get(name, []) + bottom.get(name, [])):
+                if line not in seen:
+                    seen.add(line)
+                    lines.append(line)
+            lines.reverse()
+            result[name] = lines
+        return result
 
 
 class IptablesManager(object):
@@ -295,6 +340,11 @@ class IptablesManager(object):
 
         self.iptables_apply_deferred = False
 
+        # { (command, table name) : { wrapped chain : rule lines } } as
+        # last applied, used by incremental applies
+        self._applied = {}
+        self._last_full_apply = None
+
         # Add a nova-filter-top chain. It's intended to be shared
         # among the various nova components. It sits at the very top
         # of FORWARD and OUTPUT.
@@ -365,13 +415,25 @@ class IptablesManager(object):
         same component of Nova, and replace them with our current set of
         rules. This happens atomically, thanks to iptables-restore.
 
+        With CONF.iptables_incremental_apply, only the changed chains
+        owned by this component are restored, unless shared chains
+        changed or a full apply is due.
+
         """
         s = [('iptables', self.ipv4)]
         if CONF.use_ipv6:
             s += [('ip6tables', self.ipv6)]
 
+        now = timeutils.utcnow_ts()
+        incremental = (CONF.iptables_incremental_apply and
+                       self._last_full_apply is not None and
+                       now - self._last_full_apply <
+                           CONF.iptables_full_apply_interval)
         for cmd, tables in s:
             for table in tables:
+                if incremental and self._apply_chains(cmd, table,
+                                                      tables[table]):
+                    continue
                 current_table, _err = self.execute('%s-save' % (cmd,), '-c',
                                                    '-t', '%s' % (table,),
                                                    run_as_root=True,
@@ -382,8 +444,68 @@ class IptablesManager(object):
                 self.execute('%s-restore' % (cmd,), '-c', run_as_root=True,
                              process_input='\n'.join(new_filter),
                              attempts=5)
+                if CONF.iptables_incremental_apply:
+                    self._applied[(cmd, table)] = \
+                        tables[table].wrapped_chain_rules(
+                            tables[table].chains)
+                tables[table].dirty_chains.clear()
+
+        if not incremental:
+            self._last_full_apply = now
         LOG.debug(_("IPTablesManager.apply completed with success"))
 
+    def _apply_chains(self, cmd, table_name, table):
+        """Restore only the changed wrapped chains of a table.
+
+        Declaring an existing user defined chain in iptables-restore
+        --noflush flushes it, so each changed chain is replaced by its
+        current rules, without saving the table first.  Returns False,
+        leaving the table to a full apply, if shared (unwrapped) chains
+        changed or the table was never applied in full.
+        """
+        applied = self._applied.get((cmd, table_name))
+        if applied is None or table.remove_chains or table.remove_rules:
+            return False
+        for name, wrap in table.dirty_chains:
+            if not wrap:
+                return False
+
+        dirty = set(name for name, wrap in table.dirty_chains)
+        chain_rules = table.wrapped_chain_rules(dirty & table.chains)
+        declarations = []
+        rules = []
+        deletions = []
+        for name in sorted(dirty):
+            wrapped_name = '%s-%s' % (binary_name, name)
+            if name not in table.chains:
+                if name in applied:
+                    deletions += ['-F %s' % (wrapped_name,),
+                                  '-X %s' % (wrapped_name,)]
+                continue
+            if applied.get(name) == chain_rules[name]:
+                continue
+            declarations.append(':%s - [0:0]' % (wrapped_name,))
+            rules += chain_rules[name]
+
+        if declarations or deletions:
+            lines = (['*%s' % (table_name,)] + declarations + rules +
+                     deletions + ['COMMIT', ''])
+            self.execute('%s-restore' % (cmd,), '-c', '--noflush',
+                         run_as_root=True, process_input='\n'.join(lines),
+                         attempts=5)
+            LOG.debug(_("Restored %(count)d changed chains of %(cmd)s "
+                        "table %(table_name)s"),
+                      {'count': len(declarations) + len(deletions) / 2,
+                       'cmd': cmd, 'table_name': table_name})
+
+        for name in dirty:
+            if name in table.chains:
+                applied[name] = chain_rules[name]
+            else:
+                applied.pop(name, None)
+        table.dirty_chains.clear()
+        return True
+
     def _modify_rules(self, current_lines, table, binary=None):
         unwrapped_chains = table.unwrapped_chains
         chains = table.chains
@@ -392,8 +514,8 @@ class IptablesManager(object):
         remove_rules = table.remove_rules
 
         # Remove any trace of our rules
-        new_filter = filter(lambda line: binary_name not in line,
-                            current_lines)
+        new_filter = [line for line in current_lines
+                      if binary_name not in line]
 
         seen_chains = False
         rules_index = 0
@@ -405,6 +527,14 @@ class IptablesManager(object):
                 if not rule.startswith(':'):
                     break
 
+        # Index the current rules by their text without the
+        # [packet:byte] counts, so the rules with top == True can find
+        # their duplicates without scanning every line.
+        current_rules = {}
+        for index, line in enumerate(new_filter):
+            current_rules.setdefault(_strip_counters(line), []).append(index)
+
+        dropped = set()
         our_rules = []
         bot_rules = []
         for rule in rules:
@@ -418,31 +548,23 @@ class IptablesManager(object):
                 # [packet:byte] counts and replace it with [0:0], so let's
                 # go look for a duplicate, and over-ride our table rule if
                 # found.
-
-                # ignore [packet:byte] counts at beginning of line
-                if rule_str.startswith('['):
-                    rule_str = rule_str.split(']', 1)[1]
-                dup_filter = filter(lambda s: rule_str.strip() in s.strip(),
-                                    new_filter)
-
-                new_filter = filter(lambda s:
-                                    rule_str.strip() not in s.strip(),
-                                    new_filter)
-                # if no duplicates, use original rule
-                if dup_filter:
+                dups = current_rules.pop(_strip_counters(rule_str), None)
+                if dups:
+                    dropped.update(dups)
                     # grab the last entry, if there is one
-                    dup = dup_filter[-1]
-                    rule_str = str(dup)
-                else:
-                    rule_str = str(rule)
-                rule_str.strip()
-
-                our_rules += [rule_str]
+                    rule_str = new_filter[dups[-1]]
+                our_rules.append(rule_str)
             else:
-                bot_rules += [rule_str]
+                bot_rules.append(rule_str)
 
         our_rules += bot_rules
 
+        if dropped:
+            rules_index -= len([index for index in dropped
+                                if index < rules_index])
+            new_filter = [line for index, line in enumerate(new_filter)
+                          if index not in dropped]
+
         new_filter[rules_index:rules_index] = our_rules
 
         new_filter[rules_index:rules_index] = [':%s - [0:0]' % (name,)
@@ -451,62 +573,54 @@ class IptablesManager(object):
                                                (binary_name, name,)
                                                for name in chains]
 
-        seen_lines = set()
+        # { rule without counts : number of copies still to remove }
+        remove_counts = {}
+        for rule in remove_rules:
+            rule_str = _strip_counters(str(rule))
+            remove_counts[rule_str] = remove_counts.get(rule_str, 0) + 1
 
-        def _weed_out_duplicates(line):
-            # ignore [packet:byte] counts at beginning of lines
-            if line.startswith('['):
-                line = line.split(']', 1)[1]
-            line = line.strip()
-            if line in seen_lines:
-                return False
-            else:
-                seen_lines.add(line)
-                return True
+        # We filter duplicates, letting the *last* occurrence take
+        # precendence.  We also filter out anything in the "remove"
+        # lists.
+        seen_lines = set()
+        kept = []
+        for line in reversed(new_filter):
+            stripped = _strip_counters(line)
+            if stripped in seen_lines:
+                continue
+            seen_lines.add(stripped)
 
-        def _weed_out_removes(line):
             # We need to find exact matches here
             if line.startswith(':'):
                 # it's a chain, for example, ":nova-billing - [0:0]"
                 # strip off everything except the chain name
-                line = line.split(':')[1]
-                line = line.split('- [')[0]
-                line = line.strip()
-                for chain in remove_chains:
-                    if chain == line:
-                        remove_chains.remove(chain)
-                        return False
+                chain = line.split(':')[1].split('- [')[0].strip()
+                if chain in remove_chains:
+                    remove_chains.remove(chain)
+                    continue
             elif line.startswith('['):
                 # it's a rule
-                # ignore [packet:byte] counts at beginning of lines
-                line = line.split(']', 1)[1]
-                line = line.strip()
-                for rule in remove_rules:
-                    # ignore [packet:byte] counts at beginning of rules
-                    rule_str = str(rule)
-                    rule_str = rule_str.split(' ', 1)[1]
-                    rule_str = rule_str.strip()
-                    if rule_str == line:
-                        remove_rules.remove(rule)
-                        return False
+                if remove_counts.get(stripped):
+                    remove_counts[stripped] -= 1
+                    continue
 
             # Leave it alone
-            return True
-
-        # We filter duplicates, letting the *last* occurrence take
-        # precendence.  We also filter out anything in the "remove"
-        # lists.
-        new_filter.reverse()
-        new_filter = filter(_weed_out_duplicates, new_filter)
-        new_filter = filter(_weed_out_removes, new_filter)
-        new_filter.reverse()
+            kept.append(line)
+        kept.reverse()
 
         # flush lists, just in case we didn't find something
         remove_chains.clear()
-        for rule in remove_rules:
-            remove_rules.remove(rule)
+        del remove_rules[:]
+
+        return kept
+
 
-        return new_filter
+def _strip_counters(line):
+    """Return an iptables-save line without its leading [packet:byte]
+    counts and surrounding whitespace."""
+    if line.startswith('['):
+        line = line.split(']', 1)[1]
+    return line.strip()
 
 
 # NOTE(jkoelker) This is just a nice little stub point since mocking
@@ -39,6 +39,29 @@ rpc_opts = [
     cfg.IntOpt('rpc_conn_pool_size',
                default=30,
                help='Size of RPC connection pool'),
+    cfg.BoolOpt('rpc_conn_pool_adaptive',
+                default=False,
+                help='Grow the RPC connection pool beyond rpc_conn_pool_size '
+                     'while callers keep waiting for connections, and close '
+                     'idle connections above that size again'),
+    cfg.IntOpt('rpc_conn_pool_max_size',
+               default=120,
+               help='Maximum size of an adaptive RPC connection pool'),
+    cfg.IntOpt('rpc_conn_pool_grow_threshold',
+               default=5,
+               help='Number of consecutive checkouts that find no free '
+                    'connection before an adaptive RPC connection pool '
+                    'grows'),
+    cfg.IntOpt('rpc_conn_pool_idle_timeout',
+               default=300,
+               help='Seconds a connection above rpc_conn_pool_size may be '
+                    'idle before an adaptive RPC connection pool closes it'),
+    cfg.BoolOpt('amqp_rpc_single_reply_queue',
+                default=False,
+                help='Receive the replies to all calls made by a process on '
+                     'a single reply queue, instead of declaring a queue for '
+                     'each call.  All services must understand the _reply_q '
+                     'message key before this is enabled.'),
     cfg.IntOpt('rpc_response_timeout',
                default=60,
                help='Seconds to wait for a response from call or multicall'),
@@ -25,12 +25,15 @@ Specifically, this includes impl_kombu and impl_qpid.  impl_carrot also uses
 AMQP, but is deprecated and predates this code.
 """
 
+import bisect
 import inspect
 import sys
+import time
 import uuid
 
 from eventlet import greenpool
 from eventlet import pools
+from eventlet import queue
 from eventlet import semaphore
 
 from nova.openstack.common import cfg
@@ -45,25 +48,130 @@ LOG = logging.getLogger(__name__)
 
 
 class Pool(pools.Pool):
-    """Class that implements a Pool of Connections."""
+    """Class that implements a Pool of Connections.
+
+    The pool keeps statistics about its use in self.stats.  If
+    rpc_conn_pool_adaptive is set, the pool grows up to
+    rpc_conn_pool_max_size while checkouts keep finding no free
+    connection, and closes connections above rpc_conn_pool_size once
+    they have been idle for rpc_conn_pool_idle_timeout seconds.
+    """
+
+    # Upper bounds, in seconds, of the checkout wait histogram buckets.
+    # The last bucket counts all longer waits.
+    wait_buckets = (0.001, 0.01, 0.1, 1.0, 10.0)
+
     def __init__(self, conf, connection_cls, *args, **kwargs):
         self.connection_cls = connection_cls
         self.conf = conf
         kwargs.setdefault("max_size", self.conf.rpc_conn_pool_size)
         kwargs.setdefault("order_as_stack", True)
         super(Pool, self).__init__(*args, **kwargs)
+        self.reply_proxy = None
+        self.base_size = self.max_size
+        self.adaptive = self.conf.rpc_conn_pool_adaptive
+        self._contended = 0
+        # { connection : time it was returned to the pool }
+        self._idle_since = {}
+        self.stats = dict(checkouts=0,
+                          waits=0,
+                          creates=0,
+                          destroys=0,
+                          grows=0,
+                          in_use=0,
+                          in_use_high_water=0,
+                          wait_histogram=[0] * (len(self.wait_buckets) + 1))
 
-    # TODO(comstud): Timeout connections not used in a while
     def create(self):
         LOG.debug(_('Pool creating new connection'))
-        return self.connection_cls(self.conf)
+        connection = self.connection_cls(self.conf)
+        self.stats['creates'] += 1
+        return connection
+
+    def _destroy(self, connection):
+        self._idle_since.pop(connection, None)
+        self.stats['destroys'] += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _grow(self):
+        max_size = min(self.max_size * 2, self.conf.rpc_conn_pool_max_size)
+        if max_size > self.max_size:
+            LOG.debug(_('Growing connection pool from %(old)d to %(new)d '
+                        'connections'), {'old': self.max_size,
+                                         'new': max_size})
+            self.resize(max_size)
+            self.stats['grows'] += 1
+        self._contended = 0
+
+    def _close_idle(self):
+        """Close the connections that have been idle for longest, while
+        the pool is bigger than rpc_conn_pool_size.
+        """
+        expired = time.time() - self.conf.rpc_conn_pool_idle_timeout
+        closed = False
+        # With order_as_stack, the least recently used connection is
+        # at the end of free_items.
+        while (self.current_size > self.base_size and self.free_items and
+               self._idle_since.get(self.free_items[-1], 0) < expired):
+            self.current_size -= 1
+            self._destroy(self.free_items.pop())
+            closed = True
+        if closed:
+            self.max_size = max(self.base_size, self.current_size)
+
+    def get(self):
+        contended = not self.free_items and self.current_size >= self.max_size
+        if self.adaptive:
+            if contended:
+                self._contended += 1
+                if self._contended >= self.conf.rpc_conn_pool_grow_threshold:
+                    self._grow()
+            else:
+                self._contended = 0
+
+        start = time.time()
+        connection = super(Pool, self).get()
+        waited = time.time() - start
+        self._idle_since.pop(connection, None)
+
+        stats = self.stats
+        stats['checkouts'] += 1
+        if contended:
+            stats['waits'] += 1
+        stats['wait_histogram'][bisect.bisect_left(self.wait_buckets,
+                                                   waited)] += 1
+        stats['in_use'] = self.current_size - len(self.free_items)
+        stats['in_use_high_water'] = max(stats['in_use_high_water'],
+                                         stats['in_use'])
+        return connection
+
+    def put(self, connection):
+        if self.current_size > self.max_size:
+            # pools.Pool drops connections it has no room for without
+            # closing them.
+            self.current_size -= 1
+            self._destroy(connection)
+        else:
+            self._idle_since[connection] = time.time()
+            super(Pool, self).put(connection)
+            if self.adaptive:
+                self._close_idle()
+        self.stats['in_use'] = self.current_size - len(self.free_items)
 
     def empty(self):
         while self.free_items:
-            self.get().close()
+            self.current_size -= 1
+            self._destroy(self.free_items.popleft())
+        if self.reply_proxy:
+            self.reply_proxy.close()
+            self.reply_proxy = None
 
 
 _pool_create_sem = semaphore.Semaphore()
+_reply_proxy_create_sem = semaphore.Semaphore()
 
 
 def get_connection_pool(conf, connection_cls):
@@ -149,10 +257,47 @@ class ConnectionContext(rpc_common.Connection):
             raise rpc_common.InvalidRPCConnectionReuse()
 
 
+class ReplyProxy(ConnectionContext):
+    """A connection consuming the replies to all calls made by this
+    process from a single queue, and handing each reply to the
+    MulticallWaiter waiting for its msg_id.
+    """
+
+    def __init__(self, conf, connection_pool):
+        # { msg_id : MulticallWaiter }
+        self._call_waiters = {}
+        self._reply_q = 'reply_' + uuid.uuid4().hex
+        super(ReplyProxy, self).__init__(conf, connection_pool, pooled=False)
+        self.declare_direct_consumer(self._reply_q, self._process_data)
+        self.consume_in_thread()
+
+    def _process_data(self, message_data):
+        msg_id = message_data.pop('_msg_id', None)
+        waiter = self._call_waiters.get(msg_id)
+        if not waiter:
+            LOG.warn(_('No calling threads waiting for msg_id %(msg_id)s, '
+                       'message: %(data)s'), {'msg_id': msg_id,
+                                              'data': message_data})
+        else:
+            waiter.put(message_data)
+
+    def add_call_waiter(self, waiter, msg_id):
+        self._call_waiters[msg_id] = waiter
+
+    def del_call_waiter(self, msg_id):
+        self._call_waiters.pop(msg_id, None)
+
+    def get_reply_q(self):
+        return self._reply_q
+
+
 def msg_reply(conf, msg_id, connection_pool, reply=None, failure=None,
-              ending=False, log_failure=True):
+              ending=False, log_failure=True, reply_q=None):
     """Sends a reply or an error on the channel signified by msg_id.
 
+    If reply_q is given, the reply is sent to that shared reply queue
+    with msg_id in the message instead.
+
     Failure should be a sys.exc_info() tuple.
 
     """
@@ -169,13 +314,18 @@ def msg_reply(conf, msg_id, connection_pool, reply=None, failure=None,
                    'failure': failure}
         if ending:
             msg['ending'] = True
-        conn.direct_send(msg_id, msg)
+        if reply_q:
+            msg['_msg_id'] = msg_id
+            conn.direct_send(reply_q, msg)
+        else:
+            conn.direct_send(msg_id, msg)
 
 
 class RpcContext(rpc_common.CommonRpcContext):
     """Context that supports replying to a rpc.call"""
     def __init__(self, **kwargs):
         self.msg_id = kwargs.pop('msg_id', None)
+        self.reply_q = kwargs.pop('reply_q', None)
         self.conf = kwargs.pop('conf')
         super(RpcContext, self).__init__(**kwargs)
 
@@ -183,13 +333,14 @@ class RpcContext(rpc_common.CommonRpcContext):
         values = self.to_dict()
         values['conf'] = self.conf
         values['msg_id'] = self.msg_id
+        values['reply_q'] = self.reply_q
         return self.__class__(**values)
 
     def reply(self, reply=None, failure=None, ending=False,
               connection_pool=None, log_failure=True):
         if self.msg_id:
             msg_reply(self.conf, self.msg_id, connection_pool, reply, failure,
-                      ending, log_failure)
+                      ending, log_failure, self.reply_q)
             if ending:
                 self.msg_id = None
 
@@ -205,6 +356,7 @@ def unpack_context(conf, msg):
             value = msg.pop(key)
             context_dict[key[9:]] = value
     context_dict['msg_id'] = msg.pop('_msg_id', None)
+    context_dict['reply_q'] = msg.pop('_reply_q', None)
     context_dict['conf'] = conf
     ctx = RpcContext.from_dict(context_dict)
     rpc_common._safe_log(LOG.debug, _('unpacked context: %s'), ctx.to_dict())
@@ -296,10 +448,25 @@ class ProxyCallback(object):
 
 
 class MulticallWaiter(object):
-    def __init__(self, conf, connection, timeout):
+    """Iterates over the replies to a call.
+
+    The replies are either consumed from a queue for this call on
+    connection, or, if reply_proxy is given, handed to put() by the
+    ReplyProxy consuming the shared reply queue.
+    """
+
+    def __init__(self, conf, connection, timeout, msg_id=None,
+                 reply_proxy=None):
         self._connection = connection
-        self._iterator = connection.iterconsume(timeout=timeout or
-                                                conf.rpc_response_timeout)
+        self._timeout = timeout or conf.rpc_response_timeout
+        self._reply_proxy = reply_proxy
+        self._msg_id = msg_id
+        if reply_proxy:
+            self._dataqueue = queue.LightQueue()
+            self._iterator = self._iterqueue()
+            reply_proxy.add_call_waiter(self, msg_id)
+        else:
+            self._iterator = connection.iterconsume(timeout=self._timeout)
         self._result = None
         self._done = False
         self._got_ending = False
@@ -311,7 +478,24 @@ class MulticallWaiter(object):
         self._done = True
         self._iterator.close()
         self._iterator = None
-        self._connection.close()
+        if self._reply_proxy:
+            self._reply_proxy.del_call_waiter(self._msg_id)
+        else:
+            self._connection.close()
+
+    def put(self, data):
+        """The ReplyProxy will call this with each reply."""
+        self._dataqueue.put(data)
+
+    def _iterqueue(self):
+        while True:
+            try:
+                data = self._dataqueue.get(timeout=self._timeout)
+            except queue.Empty:
+                LOG.error(_('Timed out waiting for RPC response'))
+                raise rpc_common.Timeout()
+            self(data)
+            yield
 
     def __call__(self, data):
         """The consume() callback will call this.  Store the result."""
@@ -362,10 +546,27 @@ def multicall(conf, context, topic, msg, timeout, connection_pool):
     LOG.debug(_('MSG_ID is %s') % (msg_id))
     pack_context(msg, context)
 
-    conn = ConnectionContext(conf, connection_pool)
-    wait_msg = MulticallWaiter(conf, conn, timeout)
-    conn.declare_direct_consumer(msg_id, wait_msg)
-    conn.topic_send(topic, msg)
+    if not conf.amqp_rpc_single_reply_queue:
+        conn = ConnectionContext(conf, connection_pool)
+        wait_msg = MulticallWaiter(conf, conn, timeout)
+        conn.declare_direct_consumer(msg_id, wait_msg)
+        conn.topic_send(topic, msg)
+        return wait_msg
+
+    with _reply_proxy_create_sem:
+        if not connection_pool.reply_proxy:
+            connection_pool.reply_proxy = ReplyProxy(conf, connection_pool)
+    reply_proxy = connection_pool.reply_proxy
+    msg.update({'_reply_q': reply_proxy.get_reply_q()})
+    wait_msg = MulticallWaiter(conf, reply_proxy, timeout, msg_id=msg_id,
+                               reply_proxy=reply_proxy)
+    try:
+        with ConnectionContext(conf, connection_pool) as conn:
+            conn.topic_send(topic, msg)
+    except Exception:
+        # Nothing will reply to a call that was not sent
+        with excutils.save_and_reraise_exception():
+            wait_msg.done()
     return wait_msg
 
 
@@ -24,6 +24,7 @@ from nova import db
 from nova import exception
 from nova.openstack.common import cfg
 from nova.openstack.common import importutils
+from nova.openstack.common import lockutils
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 
@@ -67,6 +68,10 @@ quota_opts = [
     cfg.IntOpt('reservation_expire',
                default=86400,
                help='number of seconds until a reservation expires'),
+    cfg.IntOpt('reservation_expire_batch_size',
+               default=500,
+               help='number of expired reservations to roll back in each '
+                    'transaction'),
     cfg.IntOpt('until_refresh',
                default=0,
                help='count of reservations until usage is refreshed'),
@@ -76,6 +81,15 @@ quota_opts = [
     cfg.StrOpt('quota_driver',
                default='nova.quota.DbQuotaDriver',
                help='default driver to use for quota checks'),
+    cfg.IntOpt('quota_cache_ttl',
+               default=60,
+               help='number of seconds nova.quota.CachedDbQuotaDriver '
+                    'keeps project and quota class limits before '
+                    'reading them from the database again'),
+    cfg.IntOpt('quota_cache_size',
+               default=1000,
+               help='number of project and quota class pairs '
+                    'nova.quota.CachedDbQuotaDriver keeps the limits of'),
     ]
 
 CONF = cfg.CONF
@@ -399,7 +413,155 @@ class DbQuotaDriver(object):
         :param context: The request context, for access checks.
         """
 
-        db.reservation_expire(context)
+        db.reservation_expire(context,
+                              batch_size=CONF.reservation_expire_batch_size)
+
+    def invalidate(self, project_id=None, quota_class=None):
+        """
+        Drop cached limits after they were changed.  This driver does
+        not cache limits.
+        """
+
+        pass
+
+
+class CachedDbQuotaDriver(DbQuotaDriver):
+    """
+    Driver which caches project and quota class limits in memory for
+    --quota_cache_ttl seconds.  Usages and reservations are always
+    read and written through the database, so reserve() and commit()
+    only cost the quota_reserve() and reservation_commit()
+    transactions.  Changes to a project's limits made through another
+    process may take up to --quota_cache_ttl seconds to be enforced.
+    The limits of at most --quota_cache_size project and quota class
+    pairs are kept.
+    """
+
+    def __init__(self):
+        # { (project_id, quota_class) : (expires, project_quotas,
+        #                                 class_quotas) }
+        self._limits = {}
+        self.cache_stats = dict(hits=0, misses=0)
+
+    def _get_limits(self, context, project_id, quota_class):
+        """Return the project and quota class limits, as returned by
+        quota_get_all_by_project() and quota_class_get_all_by_name(),
+        from the cache if they have not expired.
+        """
+
+        key = (project_id, quota_class)
+        cached = self._get_cached_limits(key)
+        if cached is not None:
+            return cached
+
+        # Requests that miss at the same time wait for the first one to
+        # read the limits instead of all reading them.
+        @lockutils.synchronized('quota-limits-%s-%s' % key, 'nova-')
+        def read_limits():
+            cached = self._get_cached_limits(key)
+            if cached is not None:
+                return cached
+
+            self.cache_stats['misses'] += 1
+            project_quotas = db.quota_get_all_by_project(context, project_id)
+            if quota_class:
+                class_quotas = db.quota_class_get_all_by_name(context,
+                                                              quota_class)
+            else:
+                class_quotas = {}
+            now = timeutils.utcnow()
+            self._make_room(now)
+            expires = now + datetime.timedelta(seconds=CONF.quota_cache_ttl)
+            self._limits[key] = (expires, project_quotas, class_quotas)
+            return project_quotas, class_quotas
+
+        return read_limits()
+
+    def _make_room(self, now):
+        """Drop cached limits until there is room for one more entry:
+        the expired ones, then those that expire first.
+        """
+        if len(self._limits) < CONF.quota_cache_size:
+            return
+        for key, cached in self._limits.items():
+            if cached[0] <= now:
+                del self._limits[key]
+        excess = len(self._limits) - max(CONF.quota_cache_size - 1, 0)
+        if excess > 0:
+            by_expiry = sorted(self._limits.items(),
+                               key=lambda item: item[1][0])
+            for key, _cached in by_expiry[:excess]:
+                del self._limits[key]
+
+    def _get_cached_limits(self, key):
+        cached = self._limits.get(key)
+        if cached is not None and cached[0] > timeutils.utcnow():
+            self.cache_stats['hits'] += 1
+            return cached[1], cached[2]
+
+    def invalidate(self, project_id=None, quota_class=None):
+        """
+        Drop cached limits so that they are read from the database
+        the next time they are needed.
+
+        :param project_id: Only drop the limits of this project.
+        :param quota_class: Only drop the limits read with this quota
+                            class.  If both project_id and quota_class
+                            are None, all cached limits are dropped.
+        """
+
+        if project_id is None and quota_class is None:
+            self._limits.clear()
+            return
+        for key in self._limits.keys():
+            if ((project_id is not None and key[0] == project_id) or
+                    (quota_class is not None and key[1] == quota_class)):
+                del self._limits[key]
+
+    def get_project_quotas(self, context, resources, project_id,
+                           quota_class=None, defaults=True,
+                           usages=True):
+        """
+        Given a list of resources, retrieve the quotas for the given
+        project.  Limits come from the cache; if usages are requested
+        they, and the limits, are read from the database.
+        """
+
+        if usages:
+            return super(CachedDbQuotaDriver, self).get_project_quotas(
+                    context, resources, project_id, quota_class=quota_class,
+                    defaults=defaults, usages=usages)
+
+        if project_id == context.project_id:
+            quota_class = context.quota_class
+        project_quotas, class_quotas = self._get_limits(context, project_id,
+                                                        quota_class)
+
+        quotas = {}
+        for resource in resources.values():
+            # Omit default/quota class values
+            if not defaults and resource.name not in project_quotas:
+                continue
+
+            quotas[resource.name] = dict(
+                limit=project_quotas.get(resource.name, class_quotas.get(
+                        resource.name, resource.default)),
+                )
+
+        return quotas
+
+    def destroy_all_by_project(self, context, project_id):
+        """
+        Destroy all quotas, usages, and reservations associated with a
+        project.
+
+        :param context: The request context, for access checks.
+        :param project_id: The ID of the project being deleted.
+        """
+
+        super(CachedDbQuotaDriver, self).destroy_all_by_project(context,
+                                                                project_id)
+        self.invalidate(project_id)
 
 
 class BaseResource(object):
@@ -795,6 +957,20 @@ class QuotaEngine(object):
 
         self._driver.expire(context)
 
+    def invalidate(self, project_id=None, quota_class=None):
+        """
+        Drop the limits the driver cached after they were changed, so
+        the new limits are enforced at once.
+
+        :param project_id: The ID of the project whose limits changed.
+        :param quota_class: The name of the quota class whose limits
+                            changed.  If both are None, all cached
+                            limits are dropped.
+        """
+
+        self._driver.invalidate(project_id=project_id,
+                                quota_class=quota_class)
+
     @property
     def resources(self):
         return sorted(self._resources.keys())
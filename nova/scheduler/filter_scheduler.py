@@ -19,6 +19,8 @@ You can customize this scheduler by specifying your own Host Filters and
 Weighing Functions.
 """
 
+import heapq
+
 from nova import exception
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
@@ -26,7 +28,17 @@ from nova.openstack.common.notifier import api as notifier
 from nova.scheduler import driver
 from nova.scheduler import scheduler_options
 
+filter_scheduler_opts = [
+    cfg.BoolOpt('scheduler_batch_placement',
+                default=False,
+                help='Filter and weigh all hosts only once when placing '
+                     'multiple instances in a single request, re-evaluating '
+                     'just the host chosen for each instance.  Requires '
+                     'weighers that weigh each host independently.'),
+    ]
+
 CONF = cfg.CONF
+CONF.register_opts(filter_scheduler_opts)
 LOG = logging.getLogger(__name__)
 
 
@@ -255,11 +267,15 @@ class FilterScheduler(driver.Scheduler):
         # are being scanned in a filter or weighing function.
         hosts = self.host_manager.get_all_host_states(elevated)
 
-        selected_hosts = []
         if instance_uuids:
             num_instances = len(instance_uuids)
         else:
             num_instances = request_spec.get('num_instances', 1)
+        if CONF.scheduler_batch_placement and num_instances > 1:
+            return self._schedule_batch(hosts, filter_properties,
+                    instance_properties, num_instances)
+
+        selected_hosts = []
         for num in xrange(num_instances):
             # Filter local hosts based on requirements ...
             hosts = self.host_manager.get_filtered_hosts(hosts,
@@ -271,7 +287,7 @@ class FilterScheduler(driver.Scheduler):
             LOG.debug(_("Filtered %(hosts)s") % locals())
 
             weighed_hosts = self.host_manager.get_weighed_hosts(hosts,
-                    filter_properties)
+                    filter_properties, limit=1)
             best_host = weighed_hosts[0]
             LOG.debug(_("Choosing host %(best_host)s") % locals())
             selected_hosts.append(best_host)
@@ -279,3 +295,52 @@ class FilterScheduler(driver.Scheduler):
             # will change for the next instance.
             best_host.obj.consume_from_instance(instance_properties)
         return selected_hosts
+
+    def _schedule_batch(self, hosts, filter_properties, instance_properties,
+                        num_instances):
+        """Returns a list of hosts for num_instances identical instances,
+        like _schedule() does, but without filtering and weighing every
+        host again for each instance.
+
+        Hosts are filtered and weighed once and kept in a heap.  Placing
+        an instance only changes the resources of the host it was placed
+        on, so only that host is filtered and weighed again before it is
+        pushed back.
+        """
+        hosts = self.host_manager.get_filtered_hosts(hosts,
+                filter_properties)
+        if not hosts:
+            return []
+
+        LOG.debug(_("Filtered %(hosts)s") % locals())
+
+        # Break ties on the filtered order, the same way the stable sort
+        # in get_weighed_hosts() does.
+        host_order = dict((id(host), index)
+                          for index, host in enumerate(hosts))
+        # Only the num_instances best hosts can be chosen: until then,
+        # one of them is left untouched, ahead of all the other hosts.
+        weighed_hosts = self.host_manager.get_weighed_hosts(hosts,
+                filter_properties, limit=num_instances)
+        heap = [(-weighed_host.weight, host_order[id(weighed_host.obj)],
+                 weighed_host) for weighed_host in weighed_hosts]
+        heapq.heapify(heap)
+
+        selected_hosts = []
+        for num in xrange(num_instances):
+            if not heap:
+                # Can't get any more locally.
+                break
+            _weight, index, best_host = heapq.heappop(heap)
+            LOG.debug(_("Choosing host %(best_host)s") % locals())
+            selected_hosts.append(best_host)
+            best_host.obj.consume_from_instance(instance_properties)
+
+            if not self.host_manager.get_filtered_hosts([best_host.obj],
+                    filter_properties):
+                continue
+            reweighed_host = self.host_manager.get_weighed_hosts(
+                    [best_host.obj], filter_properties)[0]
+            heapq.heappush(heap,
+                           (-reweighed_host.weight, index, reweighed_host))
+        return selected_hosts
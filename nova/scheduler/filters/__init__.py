@@ -18,13 +18,30 @@ Scheduler host filters
 """
 
 from nova import filters
+from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
+from nova.scheduler import host_table
+
+host_filter_opts = [
+    cfg.BoolOpt('scheduler_host_table_filters',
+                default=False,
+                help='Evaluate filters that support it on arrays of host '
+                     'attributes instead of one host at a time.  Requires '
+                     'numpy.'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(host_filter_opts)
 
 LOG = logging.getLogger(__name__)
 
 
 class BaseHostFilter(filters.BaseFilter):
     """Base class for host filters."""
+
+    # Set to True in subclasses that implement host_table_passes()
+    host_table_filter = False
+
     def _filter_one(self, obj, filter_properties):
         """Return True if the object passes the filter, otherwise False."""
         return self.host_passes(obj, filter_properties)
@@ -35,11 +52,44 @@ class BaseHostFilter(filters.BaseFilter):
         """
         raise NotImplementedError()
 
+    def host_table_passes(self, table, filter_properties):
+        """Return a boolean array that is True for each host in the
+        HostTable that passes the filter.  This must give the same result
+        as host_passes(), including any changes to host_state.limits.
+        Override this in a subclass that sets host_table_filter.
+        """
+        raise NotImplementedError()
+
 
 class HostFilterHandler(filters.BaseFilterHandler):
     def __init__(self):
         super(HostFilterHandler, self).__init__(BaseHostFilter)
 
+    def get_filtered_objects(self, filter_classes, objs,
+            filter_properties):
+        if not (CONF.scheduler_host_table_filters and
+                host_table.is_available()):
+            return super(HostFilterHandler, self).get_filtered_objects(
+                    filter_classes, objs, filter_properties)
+
+        table = host_table.HostTable(objs)
+        for filter_cls in filter_classes:
+            if not len(table):
+                break
+            filter_obj = filter_cls()
+            if filter_obj.host_table_filter:
+                passes = filter_obj.host_table_passes(table,
+                                                      filter_properties)
+                LOG.debug(_("%(filter)s passed %(passed)d of %(total)d "
+                            "hosts"), {'filter': filter_cls.__name__,
+                                       'passed': passes.sum(),
+                                       'total': len(table)})
+                table = table.subset(passes)
+            else:
+                table = host_table.HostTable(filter_obj.filter_all(
+                        table.host_states, filter_properties))
+        return table.host_states
+
 
 def all_filters():
     """Return a list of filter classes found in this directory.
@@ -33,6 +33,8 @@ CONF.register_opt(cpu_allocation_ratio_opt)
 class CoreFilter(filters.BaseHostFilter):
     """CoreFilter filters based on CPU core utilization."""
 
+    host_table_filter = True
+
     def host_passes(self, host_state, filter_properties):
         """Return True if host has sufficient CPU cores."""
         instance_type = filter_properties.get('instance_type')
@@ -53,3 +55,21 @@ class CoreFilter(filters.BaseHostFilter):
             host_state.limits['vcpu'] = vcpus_total
 
         return (vcpus_total - host_state.vcpus_used) >= instance_vcpus
+
+    def host_table_passes(self, table, filter_properties):
+        """Return True for hosts with sufficient CPU cores."""
+        instance_type = filter_properties.get('instance_type')
+        if not instance_type:
+            return table.ones()
+
+        # Fail safe on hosts that do not report VCPUs, as above
+        unknown = table.column('vcpus_total') == 0
+        if unknown.any():
+            LOG.warning(_("VCPUs not set; assuming CPU collection broken"))
+
+        instance_vcpus = instance_type['vcpus']
+        vcpus_total = table.column('vcpus_total') * CONF.cpu_allocation_ratio
+        table.set_limits(~unknown & (vcpus_total > 0), 'vcpu', vcpus_total)
+
+        free_vcpus = vcpus_total - table.column('vcpus_used')
+        return unknown | (free_vcpus >= instance_vcpus)
@@ -29,6 +29,8 @@ CONF.register_opt(disk_allocation_ratio_opt)
 class DiskFilter(filters.BaseHostFilter):
     """Disk Filter with over subscription flag"""
 
+    host_table_filter = True
+
     def host_passes(self, host_state, filter_properties):
         """Filter based on disk usage"""
         instance_type = filter_properties.get('instance_type')
@@ -51,3 +53,19 @@ class DiskFilter(filters.BaseHostFilter):
         disk_gb_limit = disk_mb_limit / 1024
         host_state.limits['disk_gb'] = disk_gb_limit
         return True
+
+    def host_table_passes(self, table, filter_properties):
+        """Filter based on disk usage"""
+        instance_type = filter_properties.get('instance_type')
+        requested_disk = 1024 * (instance_type['root_gb'] +
+                                 instance_type['ephemeral_gb'])
+
+        free_disk_mb = table.column('free_disk_mb')
+        total_usable_disk_mb = table.column('total_usable_disk_gb') * 1024
+
+        disk_mb_limit = total_usable_disk_mb * CONF.disk_allocation_ratio
+        used_disk_mb = total_usable_disk_mb - free_disk_mb
+        passes = (disk_mb_limit - used_disk_mb) >= requested_disk
+
+        table.set_limits(passes, 'disk_gb', disk_mb_limit / 1024)
+        return passes
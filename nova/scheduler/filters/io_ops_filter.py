@@ -30,6 +30,8 @@ CONF.register_opt(max_io_ops_per_host_opt)
 class IoOpsFilter(filters.BaseHostFilter):
     """Filter out hosts with too many concurrent I/O operations"""
 
+    host_table_filter = True
+
     def host_passes(self, host_state, filter_properties):
         """Use information about current vm and task states collected from
         compute node statistics to decide whether to filter.
@@ -41,3 +43,6 @@ class IoOpsFilter(filters.BaseHostFilter):
             LOG.debug(_("%(host_state)s fails I/O ops check: Max IOs per host "
                         "is set to %(max_io_ops)s"), locals())
         return passes
+
+    def host_table_passes(self, table, filter_properties):
+        return table.column('num_io_ops') < CONF.max_io_ops_per_host
@@ -30,6 +30,8 @@ CONF.register_opt(max_instances_per_host_opt)
 class NumInstancesFilter(filters.BaseHostFilter):
     """Filter out hosts with too many instances"""
 
+    host_table_filter = True
+
     def host_passes(self, host_state, filter_properties):
         num_instances = host_state.num_instances
         max_instances = CONF.max_instances_per_host
@@ -39,3 +41,6 @@ class NumInstancesFilter(filters.BaseHostFilter):
                         "instances per host is set to %(max_instances)s"),
                         locals())
         return passes
+
+    def host_table_passes(self, table, filter_properties):
+        return table.column('num_instances') < CONF.max_instances_per_host
@@ -31,6 +31,8 @@ CONF.register_opt(ram_allocation_ratio_opt)
 class RamFilter(filters.BaseHostFilter):
     """Ram Filter with over subscription flag"""
 
+    host_table_filter = True
+
     def host_passes(self, host_state, filter_properties):
         """Only return hosts with sufficient available RAM."""
         instance_type = filter_properties.get('instance_type')
@@ -50,3 +52,17 @@ class RamFilter(filters.BaseHostFilter):
         # save oversubscription limit for compute node to test against:
         host_state.limits['memory_mb'] = memory_mb_limit
         return True
+
+    def host_table_passes(self, table, filter_properties):
+        """Only return hosts with sufficient available RAM."""
+        instance_type = filter_properties.get('instance_type')
+        requested_ram = instance_type['memory_mb']
+        free_ram_mb = table.column('free_ram_mb')
+        total_usable_ram_mb = table.column('total_usable_ram_mb')
+
+        memory_mb_limit = total_usable_ram_mb * CONF.ram_allocation_ratio
+        used_ram_mb = total_usable_ram_mb - free_ram_mb
+        passes = (memory_mb_limit - used_ram_mb) >= requested_ram
+
+        table.set_limits(passes, 'memory_mb', memory_mb_limit)
+        return passes
@@ -17,6 +17,8 @@
 Manage hosts in the current zone.
 """
 
+import datetime
+import time
 import UserDict
 
 from nova.compute import task_states
@@ -50,10 +52,25 @@ host_manager_opts = [
     cfg.ListOpt('scheduler_weight_classes',
                 default=['nova.scheduler.weights.all_weighers'],
                 help='Which weight class names to use for weighing hosts'),
+    cfg.BoolOpt('scheduler_host_state_cache',
+                default=False,
+                help='Only pull compute node records that changed since the '
+                     'last refresh when building host states, instead of '
+                     'reading every compute node on each request'),
+    cfg.IntOpt('scheduler_host_state_full_resync_interval',
+               default=600,
+               help='Interval in seconds between full resyncs of the '
+                    'scheduler host state cache'),
+    cfg.IntOpt('scheduler_host_state_cache_skew',
+               default=5,
+               help='Number of seconds to overlap incremental host state '
+                    'refreshes by, to tolerate clock skew between the '
+                    'compute nodes and the scheduler'),
     ]
 
 CONF = cfg.CONF
 CONF.register_opts(host_manager_opts)
+CONF.import_opt('compute_topic', 'nova.config')
 
 LOG = logging.getLogger(__name__)
 
@@ -264,6 +281,13 @@ class HostManager(object):
         self.weight_handler = weights.HostWeightHandler()
         self.weight_classes = self.weight_handler.get_matching_classes(
                 CONF.scheduler_weight_classes)
+        # { compute_node_id : (host, hypervisor_hostname) }
+        self.compute_node_keys = {}
+        self.last_full_resync = None
+        self.last_refresh = None
+        self.host_state_cache_stats = dict(full_resyncs=0,
+                incremental_refreshes=0, hits=0, misses=0,
+                last_refresh_time=0.0, total_refresh_time=0.0)
 
     def _choose_host_filters(self, filter_cls_names):
         """Since the caller may specify which filters to use we need
@@ -336,10 +360,12 @@ class HostManager(object):
         return self.filter_handler.get_filtered_objects(filter_classes,
                 hosts, filter_properties)
 
-    def get_weighed_hosts(self, hosts, weight_properties):
-        """Weigh the hosts"""
+    def get_weighed_hosts(self, hosts, weight_properties, limit=None):
+        """Weigh the hosts, and return the limit best ones if limit is
+        given.
+        """
         return self.weight_handler.get_weighed_objects(self.weight_classes,
-                hosts, weight_properties)
+                hosts, weight_properties, limit)
 
     def update_service_capabilities(self, service_name, host, capabilities):
         """Update the per-service capabilities based on this notification."""
@@ -357,32 +383,116 @@ class HostManager(object):
         capab_copy["timestamp"] = timeutils.utcnow()  # Reported time
         self.service_states[state_key] = capab_copy
 
-    def get_all_host_states(self, context):
-        """Returns a list of HostStates that represents all the hosts
-        the HostManager knows about. Also, each of the consumable resources
-        in HostState are pre-populated and adjusted based on data in the db.
-        """
-
-        # Get resource usage across the available compute nodes:
+    def _update_host_state(self, compute, service):
+        """Create or update the HostState for a compute node record."""
+        host = service['host']
+        node = compute.get('hypervisor_hostname')
+        state_key = (host, node)
+        capabilities = self.service_states.get(state_key, None)
+        host_state = self.host_state_map.get(state_key)
+        if host_state:
+            host_state.update_capabilities(capabilities,
+                                           dict(service.iteritems()))
+        else:
+            host_state = self.host_state_cls(host, node,
+                    capabilities=capabilities,
+                    service=dict(service.iteritems()))
+            self.host_state_map[state_key] = host_state
+        host_state.update_from_compute_node(compute)
+        self.compute_node_keys[compute['id']] = state_key
+        return state_key
+
+    def _remove_host_state(self, compute_id):
+        state_key = self.compute_node_keys.pop(compute_id, None)
+        if state_key is not None:
+            self.host_state_map.pop(state_key, None)
+
+    def _host_state_cache_expired(self):
+        if not CONF.scheduler_host_state_cache:
+            return True
+        if self.last_full_resync is None or self.last_refresh is None:
+            return True
+        interval = CONF.scheduler_host_state_full_resync_interval
+        return timeutils.is_older_than(self.last_full_resync, interval)
+
+    def _full_resync(self, context):
+        """Rebuild every HostState from all compute node records."""
+        seen = set()
         compute_nodes = db.compute_node_get_all(context)
         for compute in compute_nodes:
             service = compute['service']
             if not service:
                 LOG.warn(_("No service for compute ID %s") % compute['id'])
                 continue
-            host = service['host']
-            node = compute.get('hypervisor_hostname')
-            state_key = (host, node)
-            capabilities = self.service_states.get(state_key, None)
-            host_state = self.host_state_map.get(state_key)
-            if host_state:
-                host_state.update_capabilities(capabilities,
-                                               dict(service.iteritems()))
-            else:
-                host_state = self.host_state_cls(host, node,
-                        capabilities=capabilities,
-                        service=dict(service.iteritems()))
-                self.host_state_map[state_key] = host_state
-            host_state.update_from_compute_node(compute)
+            seen.add(self._update_host_state(compute, service))
+        # Drop compute nodes that have gone away since the last resync.
+        for compute_id, state_key in self.compute_node_keys.items():
+            if state_key not in seen:
+                self._remove_host_state(compute_id)
+        self.host_state_cache_stats['full_resyncs'] += 1
+        self.host_state_cache_stats['misses'] += len(seen)
+
+    def _incremental_refresh(self, context, updated_since):
+        """Only update HostStates whose compute node records changed."""
+        # NOTE: Services heartbeat far more often than compute nodes
+        # report, and ComputeFilter needs their current updated_at, so
+        # the (narrow) services table is always read in full.
+        services = dict((service['id'], service)
+                        for service in db.service_get_all(context)
+                        if service['topic'] == CONF.compute_topic)
+        changed = set()
+        compute_nodes = db.compute_node_get_all(context,
+                                                updated_since=updated_since)
+        for compute in compute_nodes:
+            if compute.get('deleted'):
+                self._remove_host_state(compute['id'])
+                continue
+            service = services.get(compute.get('service_id'))
+            if service is None:
+                service = compute['service']
+            if not service:
+                LOG.warn(_("No service for compute ID %s") % compute['id'])
+                continue
+            changed.add(self._update_host_state(compute, service))
+
+        for state_key, host_state in self.host_state_map.iteritems():
+            if state_key in changed:
+                continue
+            service = services.get(host_state.service.get('id'))
+            if service is not None:
+                host_state.update_capabilities(
+                        self.service_states.get(state_key, None),
+                        dict(service.iteritems()))
+        stats = self.host_state_cache_stats
+        stats['incremental_refreshes'] += 1
+        stats['misses'] += len(changed)
+        stats['hits'] += len(self.host_state_map) - len(changed)
+
+    def get_all_host_states(self, context):
+        """Returns a list of HostStates that represents all the hosts
+        the HostManager knows about. Also, each of the consumable resources
+        in HostState are pre-populated and adjusted based on data in the db.
+
+        When scheduler_host_state_cache is enabled, only compute nodes
+        updated since the previous call are read back from the db, with a
+        full resync every scheduler_host_state_full_resync_interval seconds.
+        """
+        now = timeutils.utcnow()
+        start = time.time()
+        if self._host_state_cache_expired():
+            self._full_resync(context)
+            self.last_full_resync = now
+        else:
+            skew = datetime.timedelta(
+                    seconds=CONF.scheduler_host_state_cache_skew)
+            self._incremental_refresh(context, self.last_refresh - skew)
+        self.last_refresh = now
+
+        elapsed = time.time() - start
+        stats = self.host_state_cache_stats
+        stats['last_refresh_time'] = elapsed
+        stats['total_refresh_time'] += elapsed
+        LOG.debug(_("Host state refresh took %(elapsed).3f seconds: "
+                    "%(stats)s"), locals())
 
         return self.host_state_map.itervalues()
@@ -0,0 +1,109 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Struct-of-arrays view of HostStates.
+
+Numeric filters and weighers can be evaluated on whole columns of a
+HostTable at once instead of calling into Python once per host.  This
+needs numpy, which is optional; check is_available() before use.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def is_available():
+    """Return True if numpy could be imported."""
+    return numpy is not None
+
+
+class HostTable(object):
+    """A list of HostStates with their attributes available as arrays.
+
+    Columns are read from the HostStates the first time they are asked
+    for and are cached, so a HostTable must not outlive a single filter
+    or weighing pass: HostStates change as resources are consumed.
+    """
+
+    def __init__(self, host_states, columns=None):
+        self.host_states = list(host_states)
+        self._columns = columns or {}
+
+    def __len__(self):
+        return len(self.host_states)
+
+    def column(self, name):
+        """Return an array of the 'name' attribute of every host.  Hosts
+        where the attribute is None get 0.
+        """
+        values = self._columns.get(name)
+        if values is None:
+            values = numpy.array([getattr(host_state, name) or 0
+                                  for host_state in self.host_states],
+                                 dtype=numpy.float64)
+            self._columns[name] = values
+        return values
+
+    def ones(self):
+        """Return a boolean array that is True for every host."""
+        return numpy.ones(len(self.host_states), dtype=bool)
+
+    def zeros(self):
+        """Return an array of 0.0 for every host."""
+        return numpy.zeros(len(self.host_states), dtype=numpy.float64)
+
+    def sorted_indexes(self, values, limit=None):
+        """Return host indexes ordered by values, highest first.  Hosts
+        with equal values keep their order, like sorted() does.
+
+        If limit is given, only the indexes of the limit first hosts are
+        returned, and only those hosts are sorted.
+        """
+        if (limit is None or limit >= len(values) or
+                not hasattr(numpy, 'argpartition')):
+            # numpy.argpartition is new in numpy 1.8
+            return numpy.argsort(-values, kind='mergesort')[:limit]
+        if limit <= 0:
+            return numpy.array([], dtype=int)
+        # The limit-th highest value, found without sorting
+        threshold = values[numpy.argpartition(-values, limit - 1)[limit - 1]]
+        above = numpy.flatnonzero(values > threshold)
+        # Break ties on host order, as the stable sort does
+        equal = numpy.flatnonzero(values == threshold)[:limit - len(above)]
+        indexes = numpy.concatenate((above, equal))
+        return indexes[numpy.argsort(-values[indexes], kind='mergesort')]
+
+    def subset(self, mask):
+        """Return a HostTable with only the hosts where mask is True."""
+        indexes = numpy.flatnonzero(mask)
+        host_states = [self.host_states[index] for index in indexes]
+        columns = dict((name, values[indexes])
+                       for name, values in self._columns.iteritems())
+        return HostTable(host_states, columns)
+
+    def set_limits(self, mask, key, limits):
+        """Set host_state.limits[key] for each host where mask is True.
+
+        limits is either an array with a value for each host or a scalar.
+        """
+        scalar = numpy.isscalar(limits)
+        for index in numpy.flatnonzero(mask):
+            limit = limits if scalar else limits[index]
+            self.host_states[index].limits[key] = float(limit)
@@ -20,11 +20,20 @@ Scheduler host weights
 
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
+from nova.scheduler import host_table
 from nova.scheduler.weights import least_cost
 from nova import weights
 
+host_weight_opts = [
+    cfg.BoolOpt('scheduler_host_table_weighers',
+                default=False,
+                help='Weigh all hosts at once on arrays of host attributes '
+                     'for weighers that support it.  Requires numpy.'),
+    ]
+
 LOG = logging.getLogger(__name__)
 CONF = cfg.CONF
+CONF.register_opts(host_weight_opts)
 
 
 class WeighedHost(weights.WeighedObject):
@@ -40,7 +49,23 @@ class WeighedHost(weights.WeighedObject):
 
 class BaseHostWeigher(weights.BaseWeigher):
     """Base class for host weights."""
-    pass
+
+    # Set to True in subclasses that implement _weigh_host_table()
+    host_table_weigher = False
+
+    def _weigh_host_table(self, table, weight_properties):
+        """Override in a subclass to return an array with a weight for
+        each host in the HostTable, like _weigh_object() does for one.
+        """
+        raise NotImplementedError()
+
+    def weigh_host_table(self, table, weights, weight_properties):
+        """Add the weights for all hosts in the HostTable to the weights
+        array.  Override in a subclass if you need to manipulate weights
+        the way weigh_objects() can.
+        """
+        weights += (self._weight_multiplier() *
+                    self._weigh_host_table(table, weight_properties))
 
 
 class HostWeightHandler(weights.BaseWeightHandler):
@@ -49,6 +74,35 @@ class HostWeightHandler(weights.BaseWeightHandler):
     def __init__(self):
         super(HostWeightHandler, self).__init__(BaseHostWeigher)
 
+    def get_weighed_objects(self, weigher_classes, obj_list,
+            weighing_properties, limit=None):
+        if not (CONF.scheduler_host_table_weighers and
+                host_table.is_available()):
+            return super(HostWeightHandler, self).get_weighed_objects(
+                    weigher_classes, obj_list, weighing_properties, limit)
+
+        if not obj_list:
+            return []
+
+        table = host_table.HostTable(obj_list)
+        weights = table.zeros()
+        for weigher_cls in weigher_classes:
+            weigher = weigher_cls()
+            if weigher.host_table_weigher:
+                weigher.weigh_host_table(table, weights, weighing_properties)
+                continue
+            # Weigh hosts one at a time, starting from the weights so far
+            weighed_objs = [self.object_class(host_state, weight)
+                            for host_state, weight in
+                            zip(table.host_states, weights)]
+            weigher.weigh_objects(weighed_objs, weighing_properties)
+            for index, weighed_obj in enumerate(weighed_objs):
+                weights[index] = weighed_obj.weight
+
+        return [self.object_class(table.host_states[index],
+                                  float(weights[index]))
+                for index in table.sorted_indexes(weights, limit)]
+
 
 def all_weighers():
     """Return a list of weight plugin classes found in this directory."""
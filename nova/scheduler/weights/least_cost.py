@@ -56,6 +56,13 @@ def noop_cost_fn(host_state, weight_properties):
     return 1
 
 
+def _noop_cost_table_fn(table, weight_properties):
+    return table.ones()
+
+
+noop_cost_fn.host_table_fn = _noop_cost_table_fn
+
+
 def compute_fill_first_cost_fn(host_state, weight_properties):
     """Higher weights win, so we should return a lower weight
     when there's more free ram available.
@@ -67,6 +74,13 @@ def compute_fill_first_cost_fn(host_state, weight_properties):
     return -host_state.free_ram_mb
 
 
+def _compute_fill_first_cost_table_fn(table, weight_properties):
+    return -table.column('free_ram_mb')
+
+
+compute_fill_first_cost_fn.host_table_fn = _compute_fill_first_cost_table_fn
+
+
 def _get_cost_functions():
     """Returns a list of tuples containing weights and cost functions to
     use for weighing hosts
@@ -117,9 +131,19 @@ def get_least_cost_weighers():
     from nova.scheduler import weights
 
     class _LeastCostWeigher(weights.BaseHostWeigher):
+        # Cost functions can provide a host_table_fn attribute that
+        # computes their cost for a whole HostTable.
+        host_table_weigher = all(hasattr(fn, 'host_table_fn')
+                                 for weight, fn in cost_functions)
+
         def weigh_objects(self, weighted_hosts, weight_properties):
             for host in weighted_hosts:
                 host.weight = sum(weight * fn(host.obj, weight_properties)
                             for weight, fn in cost_functions)
 
+        def weigh_host_table(self, table, weights, weight_properties):
+            weights[:] = sum(weight * fn.host_table_fn(table,
+                                                       weight_properties)
+                             for weight, fn in cost_functions)
+
     return [_LeastCostWeigher]
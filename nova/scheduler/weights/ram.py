@@ -36,6 +36,8 @@ CONF.register_opts(ram_weight_opts)
 
 
 class RAMWeigher(weights.BaseHostWeigher):
+    host_table_weigher = True
+
     def _weight_multiplier(self):
         """Override the weight multiplier."""
         return CONF.ram_weight_multiplier
@@ -43,3 +45,6 @@ class RAMWeigher(weights.BaseHostWeigher):
     def _weigh_object(self, host_state, weight_properties):
         """Higher weights win.  We want spreading to be the default."""
         return host_state.free_ram_mb
+
+    def _weigh_host_table(self, table, weight_properties):
+        return table.column('free_ram_mb')
@@ -24,6 +24,7 @@ import functools
 import os
 import string
 import tempfile
+import types
 
 import fixtures
 
@@ -93,6 +94,10 @@ def get_instances_with_cached_ips(orig_func, *args, **kwargs):
     if isinstance(instances, list):
         for instance in instances:
             instance['info_cache'] = {'network_info': get_fake_cache()}
+    elif isinstance(instances, types.GeneratorType):
+        instances = list(instances)
+        for instance in instances:
+            instance['info_cache'] = {'network_info': get_fake_cache()}
     else:
         instances['info_cache'] = {'network_info': get_fake_cache()}
     return instances
@@ -738,7 +743,7 @@ class CloudTestCase(test.TestCase):
         """Makes sure describe_instances works and filters results."""
         self.flags(use_ipv6=True)
 
-        self._stub_instance_get_with_fixed_ips('get_all')
+        self._stub_instance_get_with_fixed_ips('get_all_iter')
         self._stub_instance_get_with_fixed_ips('get')
 
         image_uuid = 'cedef40a-ed67-4d10-800e-17455edce175'
@@ -790,7 +795,7 @@ class CloudTestCase(test.TestCase):
         """Makes sure describe_instances works and is sorted as expected."""
         self.flags(use_ipv6=True)
 
-        self._stub_instance_get_with_fixed_ips('get_all')
+        self._stub_instance_get_with_fixed_ips('get_all_iter')
         self._stub_instance_get_with_fixed_ips('get')
 
         image_uuid = 'cedef40a-ed67-4d10-800e-17455edce175'
@@ -876,7 +881,7 @@ class CloudTestCase(test.TestCase):
         """Makes sure describe_instances w/ no ipv6 works."""
         self.flags(use_ipv6=False)
 
-        self._stub_instance_get_with_fixed_ips('get_all')
+        self._stub_instance_get_with_fixed_ips('get_all_iter')
         self._stub_instance_get_with_fixed_ips('get')
 
         image_uuid = 'cedef40a-ed67-4d10-800e-17455edce175'
@@ -923,6 +928,26 @@ class CloudTestCase(test.TestCase):
         self.assertEqual(result1[0]['instanceId'],
                          ec2utils.id_to_ec2_inst_id(inst2['uuid']))
 
+    def test_describe_instances_not_found_while_reading(self):
+        image_uuid = 'cedef40a-ed67-4d10-800e-17455edce175'
+        inst1 = db.instance_create(self.context, {'reservation_id': 'a',
+                                                  'image_ref': image_uuid,
+                                                  'instance_type_id': 1,
+                                                  'host': 'host1',
+                                                  'vm_state': 'active'})
+
+        def fake_get_all_iter(compute_self, context, **kwargs):
+            yield compute_self.get(context, inst1['uuid'])
+            raise exception.NotFound()
+
+        self.stubs.Set(compute_api.API, 'get_all_iter', fake_get_all_iter)
+        result = self.cloud.describe_instances(self.context)
+        self.assertEqual(len(result['reservationSet']), 1)
+        result1 = result['reservationSet'][0]['instancesSet']
+        self.assertEqual(result1[0]['instanceId'],
+                         ec2utils.id_to_ec2_inst_id(inst1['uuid']))
+        db.instance_destroy(self.context, inst1['uuid'])
+
     def test_describe_instances_with_image_deleted(self):
         image_uuid = 'aebef54a-ed67-4d10-912f-14455edce176'
         args1 = {'reservation_id': 'a',
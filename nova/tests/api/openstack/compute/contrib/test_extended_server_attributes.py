@@ -52,7 +52,7 @@ class ExtendedServerAttributesTest(test.TestCase):
         super(ExtendedServerAttributesTest, self).setUp()
         fakes.stub_out_nw_api(self.stubs)
         self.stubs.Set(compute.api.API, 'get', fake_compute_get)
-        self.stubs.Set(compute.api.API, 'get_all', fake_compute_get_all)
+        self.stubs.Set(compute.api.API, 'get_all_iter', fake_compute_get_all)
         self.stubs.Set(db, 'compute_node_get_by_host', fake_cn_get)
         self.flags(
             osapi_compute_extension=[
@@ -50,7 +50,7 @@ class ExtendedStatusTest(test.TestCase):
         super(ExtendedStatusTest, self).setUp()
         fakes.stub_out_nw_api(self.stubs)
         self.stubs.Set(compute.api.API, 'get', fake_compute_get)
-        self.stubs.Set(compute.api.API, 'get_all', fake_compute_get_all)
+        self.stubs.Set(compute.api.API, 'get_all_iter', fake_compute_get_all)
         self.flags(
             osapi_compute_extension=[
                 'nova.api.openstack.compute.contrib.select_extensions'],
@@ -20,6 +20,7 @@ import webob
 
 from nova.api.openstack.compute.contrib import quotas
 from nova.api.openstack import wsgi
+from nova import quota
 from nova import test
 from nova.tests.api.openstack import fakes
 
@@ -121,6 +122,19 @@ class QuotaSetsTest(test.TestCase):
 
         self.assertEqual(res_dict, body)
 
+    def test_quotas_update_invalidates_cached_limits(self):
+        self.stubs.Set(quota.QUOTAS, '_driver', quota.CachedDbQuotaDriver())
+        req = fakes.HTTPRequest.blank('/v2/fake4/os-quota-sets/update_me',
+                                      use_admin_context=True)
+        self.assertEqual(
+            self.controller.show(req, 'update_me')['quota_set']['cores'], 20)
+
+        body = {'quota_set': {'cores': 50}}
+        self.controller.update(req, 'update_me', body)
+
+        self.assertEqual(
+            self.controller.show(req, 'update_me')['quota_set']['cores'], 50)
+
     def test_quotas_update_as_user(self):
         body = {'quota_set': {'instances': 50, 'cores': 50,
                               'ram': 51200, 'floating_ips': 10,
@@ -1307,7 +1307,7 @@ class SecurityGroupsOutputTest(test.TestCase):
         super(SecurityGroupsOutputTest, self).setUp()
         fakes.stub_out_nw_api(self.stubs)
         self.stubs.Set(compute.api.API, 'get', fake_compute_get)
-        self.stubs.Set(compute.api.API, 'get_all', fake_compute_get_all)
+        self.stubs.Set(compute.api.API, 'get_all_iter', fake_compute_get_all)
         self.stubs.Set(compute.api.API, 'create', fake_compute_create)
         self.flags(
             osapi_compute_extension=[
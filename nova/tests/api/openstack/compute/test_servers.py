@@ -678,6 +678,23 @@ class ServersControllerTest(test.TestCase):
         self.assertRaises(webob.exc.HTTPBadRequest,
                           self.controller.index, req)
 
+    def test_get_server_details_reads_instances_by_chunk(self):
+        self.flags(instance_list_chunk_size=2)
+        chunks = []
+
+        def fake_get_instance_faults(compute_self, context, instances):
+            chunks.append([instance['uuid'] for instance in instances])
+            return {}
+
+        self.stubs.Set(compute_api.API, 'get_instance_faults',
+                       fake_get_instance_faults)
+        req = fakes.HTTPRequest.blank('/v2/fake/servers/detail')
+        servers = self.controller.detail(req)['servers']
+
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(sum(chunks, []), [s['id'] for s in servers])
+        self.assertEqual(len(req.get_db_instances()), 5)
+
     def test_get_servers_with_bad_option(self):
         server_uuid = str(uuid.uuid4())
 
@@ -686,7 +703,7 @@ class ServersControllerTest(test.TestCase):
                          limit=None, marker=None):
             return [fakes.stub_instance(100, uuid=server_uuid)]
 
-        self.stubs.Set(compute_api.API, 'get_all', fake_get_all)
+        self.stubs.Set(compute_api.API, 'get_all_iter', fake_get_all)
 
         req = fakes.HTTPRequest.blank('/v2/fake/servers?unknownoption=whee')
         servers = self.controller.index(req)['servers']
@@ -705,7 +722,7 @@ class ServersControllerTest(test.TestCase):
             self.assertEqual(search_opts['image'], '12345')
             return [fakes.stub_instance(100, uuid=server_uuid)]
 
-        self.stubs.Set(compute_api.API, 'get_all', fake_get_all)
+        self.stubs.Set(compute_api.API, 'get_all_iter', fake_get_all)
 
         req = fakes.HTTPRequest.blank('/v2/fake/servers?image=12345')
         servers = self.controller.index(req)['servers']
@@ -803,7 +820,7 @@ class ServersControllerTest(test.TestCase):
             self.assertEqual(search_opts['flavor'], '12345')
             return [fakes.stub_instance(100, uuid=server_uuid)]
 
-        self.stubs.Set(compute_api.API, 'get_all', fake_get_all)
+        self.stubs.Set(compute_api.API, 'get_all_iter', fake_get_all)
 
         req = fakes.HTTPRequest.blank('/v2/fake/servers?flavor=12345')
         servers = self.controller.index(req)['servers']
@@ -822,7 +839,7 @@ class ServersControllerTest(test.TestCase):
             self.assertEqual(search_opts['vm_state'], vm_states.ACTIVE)
             return [fakes.stub_instance(100, uuid=server_uuid)]
 
-        self.stubs.Set(compute_api.API, 'get_all', fake_get_all)
+        self.stubs.Set(compute_api.API, 'get_all_iter', fake_get_all)
 
         req = fakes.HTTPRequest.blank('/v2/fake/servers?status=active')
         servers = self.controller.index(req)['servers']
@@ -854,7 +871,7 @@ class ServersControllerTest(test.TestCase):
 
             return [fakes.stub_instance(100, uuid=server_uuid)]
 
-        self.stubs.Set(compute_api.API, 'get_all', fake_get_all)
+        self.stubs.Set(compute_api.API, 'get_all_iter', fake_get_all)
 
         req = fakes.HTTPRequest.blank('/v2/fake/servers?status=deleted',
                                       use_admin_context=True)
@@ -874,7 +891,7 @@ class ServersControllerTest(test.TestCase):
             self.assertEqual(search_opts['name'], 'whee.*')
             return [fakes.stub_instance(100, uuid=server_uuid)]
 
-        self.stubs.Set(compute_api.API, 'get_all', fake_get_all)
+        self.stubs.Set(compute_api.API, 'get_all_iter', fake_get_all)
 
         req = fakes.HTTPRequest.blank('/v2/fake/servers?name=whee.*')
         servers = self.controller.index(req)['servers']
@@ -896,7 +913,7 @@ class ServersControllerTest(test.TestCase):
             self.assertTrue('deleted' not in search_opts)
             return [fakes.stub_instance(100, uuid=server_uuid)]
 
-        self.stubs.Set(compute_api.API, 'get_all', fake_get_all)
+        self.stubs.Set(compute_api.API, 'get_all_iter', fake_get_all)
 
         params = 'changes-since=2011-01-24T17:08:01Z'
         req = fakes.HTTPRequest.blank('/v2/fake/servers?%s' % params)
@@ -930,7 +947,7 @@ class ServersControllerTest(test.TestCase):
             self.assertFalse('unknown_option' in search_opts)
             return [fakes.stub_instance(100, uuid=server_uuid)]
 
-        self.stubs.Set(compute_api.API, 'get_all', fake_get_all)
+        self.stubs.Set(compute_api.API, 'get_all_iter', fake_get_all)
 
         query_str = "name=foo&ip=10.*&status=active&unknown_option=meow"
         req = fakes.HTTPRequest.blank('/v2/fake/servers?%s' % query_str)
@@ -959,7 +976,7 @@ class ServersControllerTest(test.TestCase):
             self.assertTrue('unknown_option' in search_opts)
             return [fakes.stub_instance(100, uuid=server_uuid)]
 
-        self.stubs.Set(compute_api.API, 'get_all', fake_get_all)
+        self.stubs.Set(compute_api.API, 'get_all_iter', fake_get_all)
 
         query_str = "name=foo&ip=10.*&status=active&unknown_option=meow"
         req = fakes.HTTPRequest.blank('/v2/fake/servers?%s' % query_str,
@@ -983,7 +1000,7 @@ class ServersControllerTest(test.TestCase):
             self.assertEqual(search_opts['ip'], '10\..*')
             return [fakes.stub_instance(100, uuid=server_uuid)]
 
-        self.stubs.Set(compute_api.API, 'get_all', fake_get_all)
+        self.stubs.Set(compute_api.API, 'get_all_iter', fake_get_all)
 
         req = fakes.HTTPRequest.blank('/v2/fake/servers?ip=10\..*',
                                       use_admin_context=True)
@@ -1006,7 +1023,7 @@ class ServersControllerTest(test.TestCase):
             self.assertEqual(search_opts['ip6'], 'ffff.*')
             return [fakes.stub_instance(100, uuid=server_uuid)]
 
-        self.stubs.Set(compute_api.API, 'get_all', fake_get_all)
+        self.stubs.Set(compute_api.API, 'get_all_iter', fake_get_all)
 
         req = fakes.HTTPRequest.blank('/v2/fake/servers?ip6=ffff.*',
                                       use_admin_context=True)
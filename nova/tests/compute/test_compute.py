@@ -654,6 +654,43 @@ class ComputeTestCase(BaseTestCase):
         LOG.info(_("After terminating instances: %s"), instances)
         self.assertEqual(len(instances), 0)
 
+    def test_run_instance_warms_metadata_cache(self):
+        self.flags(metadata_cache_warming=True)
+        warmed = []
+
+        def fake_metadata_cache_warm(context, addresses):
+            warmed.append(addresses)
+
+        nw_info = fake_network.fake_get_instance_nw_info(self.stubs, 1, 1,
+                                                         spectacular=True)
+        self.stubs.Set(self.compute, '_allocate_network',
+                       lambda *args, **kwargs: nw_info)
+        self.stubs.Set(self.compute.conductor_api, 'metadata_cache_warm',
+                       fake_metadata_cache_warm)
+        instance = jsonutils.to_primitive(self._create_fake_instance())
+        self.compute.run_instance(self.context, instance=instance)
+
+        self.assertEqual(warmed,
+                         [[ip['address'] for ip in nw_info.fixed_ips()]])
+
+    def test_run_instance_ignores_metadata_cache_warm_errors(self):
+        self.flags(metadata_cache_warming=True)
+
+        def fake_metadata_cache_warm(context, addresses):
+            raise test.TestingException()
+
+        nw_info = fake_network.fake_get_instance_nw_info(self.stubs, 1, 1,
+                                                         spectacular=True)
+        self.stubs.Set(self.compute, '_allocate_network',
+                       lambda *args, **kwargs: nw_info)
+        self.stubs.Set(self.compute.conductor_api, 'metadata_cache_warm',
+                       fake_metadata_cache_warm)
+        instance = jsonutils.to_primitive(self._create_fake_instance())
+        self.compute.run_instance(self.context, instance=instance)
+
+        instance = db.instance_get_by_uuid(self.context, instance['uuid'])
+        self.assertEqual(instance['vm_state'], vm_states.ACTIVE)
+
     def test_run_terminate_with_vol_attached(self):
         """Make sure it is possible to  run and terminate instance with volume
         attached
@@ -2548,6 +2585,119 @@ class ComputeTestCase(BaseTestCase):
         self.assertEqual(len(instances), 1)
         self.assertEqual(task_states.POWERING_OFF, instances[0]['task_state'])
 
+    def test_sync_power_states_single_refresh(self):
+        instances = [jsonutils.to_primitive(self._create_fake_instance())
+                     for i in xrange(3)]
+        for instance in instances:
+            self.compute.run_instance(self.context, instance=instance)
+
+        calls = []
+        orig_get_all = self.compute.conductor_api.instance_get_all_by_uuids
+
+        def fake_get_all(context, instance_uuids):
+            calls.append(instance_uuids)
+            return orig_get_all(context, instance_uuids)
+
+        def fake_get_by_uuid(context, instance_uuid):
+            self.fail('instance_get_by_uuid should not be called')
+
+        self.stubs.Set(self.compute.conductor_api,
+                       'instance_get_all_by_uuids', fake_get_all)
+        self.stubs.Set(self.compute.conductor_api,
+                       'instance_get_by_uuid', fake_get_by_uuid)
+        self.compute.driver.test_remove_vm(instances[0]['name'])
+
+        self.compute._sync_power_states(context.get_admin_context())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(set(calls[0]),
+                         set(instance['uuid'] for instance in instances))
+        instance = db.instance_get_by_uuid(self.context, instances[0]['uuid'])
+        self.assertEqual(task_states.POWERING_OFF, instance['task_state'])
+        instance = db.instance_get_by_uuid(self.context, instances[1]['uuid'])
+        self.assertEqual(None, instance['task_state'])
+
+    def test_sync_power_states_bulk_driver_query(self):
+        instance = jsonutils.to_primitive(self._create_fake_instance())
+        self.compute.run_instance(self.context, instance=instance)
+
+        def fake_get_info(instance):
+            self.fail('get_info should not be called')
+
+        self.stubs.Set(self.compute.driver, 'get_info', fake_get_info)
+        self.stubs.Set(self.compute.driver, 'get_all_power_states',
+                       lambda: {instance['name']: power_state.PAUSED})
+
+        self.compute._sync_power_states(context.get_admin_context())
+
+        instance = db.instance_get_by_uuid(self.context, instance['uuid'])
+        self.assertEqual(power_state.PAUSED, instance['power_state'])
+
+    def test_sync_power_states_get_info_fallback(self):
+        instance = jsonutils.to_primitive(self._create_fake_instance())
+        self.compute.run_instance(self.context, instance=instance)
+
+        def fake_get_all_power_states():
+            raise NotImplementedError()
+
+        self.stubs.Set(self.compute.driver, 'get_all_power_states',
+                       fake_get_all_power_states)
+        self.stubs.Set(self.compute.driver, 'get_info',
+                       lambda instance: {'state': power_state.PAUSED})
+
+        self.compute._sync_power_states(context.get_admin_context())
+
+        instance = db.instance_get_by_uuid(self.context, instance['uuid'])
+        self.assertEqual(power_state.PAUSED, instance['power_state'])
+
+    def test_poll_bandwidth_usage_bulk(self):
+        self.flags(bandwidth_poll_interval=1)
+        ctxt = context.get_admin_context()
+        prev_time, start_time = utils.last_completed_audit_period()
+        db.bw_usage_update(ctxt, 'fake_uuid1', 'fake_mac1', start_time,
+                           100, 200, 1000, 2000)
+        db.bw_usage_update(ctxt, 'fake_uuid2', 'fake_mac2', prev_time,
+                           100, 200, 3000, 4000)
+        bw_counters = [{'uuid': 'fake_uuid1', 'mac_address': 'fake_mac1',
+                        'bw_in': 1010, 'bw_out': 2020},
+                       {'uuid': 'fake_uuid2', 'mac_address': 'fake_mac2',
+                        'bw_in': 3030, 'bw_out': 4040},
+                       {'uuid': 'fake_uuid3', 'mac_address': 'fake_mac3',
+                        'bw_in': 5050, 'bw_out': 6060}]
+        self.stubs.Set(self.compute.driver, 'get_all_bw_counters',
+                       lambda instances: bw_counters)
+
+        calls = []
+        conductor_api = self.compute.conductor_api
+
+        def count_calls(name):
+            orig = getattr(conductor_api, name)
+
+            def wrapper(*args, **kwargs):
+                calls.append(name)
+                return orig(*args, **kwargs)
+            self.stubs.Set(conductor_api, name, wrapper)
+
+        for name in ('bw_usage_get', 'bw_usage_update',
+                     'bw_usage_get_by_uuids', 'bw_usage_update_bulk'):
+            count_calls(name)
+
+        self.compute._last_bw_usage_poll = 0
+        self.compute._poll_bandwidth_usage(ctxt)
+
+        self.assertEqual(calls, ['bw_usage_get_by_uuids',
+                                 'bw_usage_get_by_uuids',
+                                 'bw_usage_update_bulk'])
+        usages = db.bw_usage_get_by_uuids(ctxt,
+                ['fake_uuid1', 'fake_uuid2', 'fake_uuid3'], start_time)
+        usages = dict((usage['uuid'], usage) for usage in usages)
+        self.assertEqual(usages['fake_uuid1']['bw_in'], 110)
+        self.assertEqual(usages['fake_uuid1']['bw_out'], 220)
+        self.assertEqual(usages['fake_uuid2']['bw_in'], 30)
+        self.assertEqual(usages['fake_uuid2']['bw_out'], 40)
+        self.assertEqual(usages['fake_uuid3']['bw_in'], 0)
+        self.assertEqual(usages['fake_uuid3']['last_ctr_out'], 6060)
+
     def test_add_instance_fault(self):
         exc_info = None
         instance_uuid = str(uuid.uuid4())
@@ -4402,6 +4552,44 @@ class ComputeAPITestCase(BaseTestCase):
         db.instance_destroy(c, instance2['uuid'])
         db.instance_destroy(c, instance3['uuid'])
 
+    def test_get_all_in_chunks(self):
+        """Test that instances are read from the db a chunk at a time"""
+        self.flags(instance_list_chunk_size=2)
+        c = context.get_admin_context()
+        created = [self._create_fake_instance({'image_ref': '1234'})
+                   for x in xrange(5)]
+
+        calls = []
+        orig_get_all = db.instance_get_all_by_filters
+
+        def fake_get_all(*args, **kwargs):
+            result = orig_get_all(*args, **kwargs)
+            calls.append((kwargs['limit'], len(result)))
+            return result
+
+        self.stubs.Set(db, 'instance_get_all_by_filters', fake_get_all)
+
+        instances = self.compute_api.get_all(c, search_opts={'image': '1234'},
+                                             sort_dir='asc')
+        self.assertEqual([instance['uuid'] for instance in created],
+                         [instance['uuid'] for instance in instances])
+        self.assertEqual([(2, 2), (2, 2), (2, 1)], calls)
+
+        calls[:] = []
+        instances = self.compute_api.get_all(c, search_opts={'image': '1234'},
+                                             sort_dir='asc', limit=4)
+        self.assertEqual(4, len(instances))
+        self.assertEqual([(2, 2), (2, 2)], calls)
+
+        calls[:] = []
+        instances = self.compute_api.get_all_iter(c,
+                search_opts={'image': '1234'}, columns_to_join=[])
+        self.assertEqual(len(calls), 0)
+        self.assertEqual(5, len(list(instances)))
+
+        for instance in created:
+            db.instance_destroy(c, instance['uuid'])
+
     def test_get_all_by_flavor(self):
         """Test searching instances by image"""
 
@@ -416,6 +416,19 @@ class TrackerTestCase(BaseTrackerTestCase):
         self.assertFalse(self.tracker.disabled)
         self.assertEqual(0, self.tracker.compute_node['current_workload'])
 
+    def test_driver_stats(self):
+        get_available_resource = self.tracker.driver.get_available_resource
+
+        def fake_get_available_resource(nodename):
+            resources = get_available_resource(nodename)
+            resources['stats'] = {'driver_stat': 'value'}
+            return resources
+
+        self.stubs.Set(self.tracker.driver, 'get_available_resource',
+                       fake_get_available_resource)
+        self.tracker.update_available_resource(self.context)
+        self.assertEqual(self.tracker.stats['driver_stat'], 'value')
+
 
 class InstanceClaimTestCase(BaseTrackerTestCase):
 
@@ -16,6 +16,7 @@
 
 import mox
 
+from nova.api.metadata import handler as metadata_handler
 from nova.compute import instance_types
 from nova.compute import vm_states
 from nova import conductor
@@ -198,6 +199,29 @@ class _BaseTestCase(object):
         result = self.conductor.bw_usage_update(*update_args)
         self.assertEqual(result, 'foo')
 
+    def test_instance_get_all_by_uuids(self):
+        orig_instance = self._create_fake_instance()
+        instances = self.conductor.instance_get_all_by_uuids(
+            self.context, [orig_instance['uuid']])
+        self.assertEqual(len(instances), 1)
+        self.assertEqual(orig_instance['name'], instances[0]['name'])
+
+    def test_bw_usage_get_by_uuids(self):
+        self.mox.StubOutWithMock(db, 'bw_usage_get_by_uuids')
+        db.bw_usage_get_by_uuids(self.context, ['uuid'], 0).AndReturn(['foo'])
+        self.mox.ReplayAll()
+        result = self.conductor.bw_usage_get_by_uuids(self.context, ['uuid'],
+                                                      0)
+        self.assertEqual(result, ['foo'])
+
+    def test_bw_usage_update_bulk(self):
+        usages = [{'uuid': 'uuid', 'mac': 'mac', 'bw_in': 10, 'bw_out': 20,
+                   'last_ctr_in': 5, 'last_ctr_out': 10}]
+        self.mox.StubOutWithMock(db, 'bw_usage_update_bulk')
+        db.bw_usage_update_bulk(self.context, 0, usages, None)
+        self.mox.ReplayAll()
+        self.conductor.bw_usage_update_bulk(self.context, 0, usages)
+
     def test_get_backdoor_port(self):
         backdoor_port = 59697
 
@@ -262,6 +286,33 @@ class _BaseTestCase(object):
                                                           'fake-arch')
         self.assertEqual(result, 'it worked')
 
+    def test_instance_get_all_by_filters(self):
+        filters = {'image_ref': 'fake-image'}
+        self.mox.StubOutWithMock(db, 'instance_get_all_by_filters')
+        db.instance_get_all_by_filters(self.context, filters, 'created_at',
+                                       'desc', limit=10,
+                                       columns_to_join=[]).AndReturn('fake')
+        self.mox.ReplayAll()
+        result = self.conductor.instance_get_all_by_filters(
+            self.context, filters, 'created_at', 'desc', limit=10,
+            columns_to_join=[])
+        self.assertEqual(result, 'fake')
+
+    def test_compute_node_get_by_host(self):
+        self.mox.StubOutWithMock(db, 'compute_node_get_by_host')
+        db.compute_node_get_by_host(mox.IgnoreArg(),
+                                    'fake-host').AndReturn('fake')
+        self.mox.ReplayAll()
+        result = self.conductor.compute_node_get_by_host(self.context,
+                                                         'fake-host')
+        self.assertEqual(result, 'fake')
+
+    def test_metadata_cache_warm(self):
+        self.mox.StubOutWithMock(metadata_handler, 'warm_cache')
+        metadata_handler.warm_cache(['10.0.0.2'])
+        self.mox.ReplayAll()
+        self.conductor.metadata_cache_warm(self.context, ['10.0.0.2'])
+
 
 class ConductorTestCase(_BaseTestCase, test.TestCase):
     """Conductor Manager Tests"""
@@ -408,16 +408,17 @@ def unset_stub_network_methods(stubs):
 
 def stub_compute_with_ips(stubs):
     orig_get = compute_api.API.get
-    orig_get_all = compute_api.API.get_all
+    orig_get_all_iter = compute_api.API.get_all_iter
 
     def fake_get(*args, **kwargs):
         return _get_instances_with_cached_ips(orig_get, *args, **kwargs)
 
-    def fake_get_all(*args, **kwargs):
-        return _get_instances_with_cached_ips(orig_get_all, *args, **kwargs)
+    def fake_get_all_iter(*args, **kwargs):
+        return _get_instances_with_cached_ips(orig_get_all_iter,
+                                              *args, **kwargs)
 
     stubs.Set(compute_api.API, 'get', fake_get)
-    stubs.Set(compute_api.API, 'get_all', fake_get_all)
+    stubs.Set(compute_api.API, 'get_all_iter', fake_get_all_iter)
 
 
 def _get_fake_cache():
@@ -448,7 +449,8 @@ def _get_instances_with_cached_ips(orig_func, *args, **kwargs):
     entries
     """
     instances = orig_func(*args, **kwargs)
-    if isinstance(instances, list):
+    if not isinstance(instances, dict):
+        instances = list(instances)
         for instance in instances:
             instance['info_cache'] = {'network_info': _get_fake_cache()}
     else:
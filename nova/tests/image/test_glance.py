@@ -17,9 +17,14 @@
 
 
 import datetime
+import hashlib
+import itertools
+import os
 import random
 import time
 
+import eventlet
+from glanceclient.common import http as glanceclient_http
 import glanceclient.exc
 
 from nova import context
@@ -29,6 +34,9 @@ from nova import test
 from nova.tests.api.openstack import fakes
 from nova.tests.glance import stubs as glance_stubs
 from nova.tests import matchers
+from nova import utils
+from nova.virt import images
+from nova import wsgi
 
 
 class NullWriter(object):
@@ -703,3 +711,203 @@ class TestGlanceClientWrapper(test.TestCase):
 
         client2.call(ctxt, 1, 'get', 'meow')
         self.assertEqual(info['num_calls'], 2)
+
+
+class TestGlanceRangeDownload(test.TestCase):
+    """Downloads images in ranges from a local stand-in for glance."""
+
+    # Seconds the server waits between chunks of a response
+    chunk_delay = 0
+    chunk_size = 64 * 1024
+
+    def setUp(self):
+        super(TestGlanceRangeDownload, self).setUp()
+        self.data = os.urandom(10123)
+        self.serve_ranges = True
+        self.requests = []
+        # Ranges answered with a 503, and how many times
+        self.failing_ranges = {}
+        self.server = wsgi.Server('fake-glance', self._app, host='127.0.0.1')
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.stubs.Set(glance.time, 'sleep', lambda seconds: None)
+        self.flags(glance_api_servers=['127.0.0.1:%d' % self.server.port],
+                   glance_download_workers=4,
+                   glance_download_range_size=1000)
+        self.context = context.RequestContext('fake', 'fake')
+        self.service = glance.GlanceImageService(glance.GlanceClientWrapper())
+        self.shown = []
+
+        def fake_show(context, image_id):
+            self.shown.append(image_id)
+            return {'size': len(self.data),
+                    'checksum': hashlib.md5(self.data).hexdigest()}
+
+        self.stubs.Set(self.service, 'show', fake_show)
+
+    def _app(self, environ, start_response):
+        range_header = environ.get('HTTP_RANGE')
+        self.requests.append(range_header)
+        if self.failing_ranges.get(range_header):
+            self.failing_ranges[range_header] -= 1
+            start_response('503 Service Unavailable', [])
+            return ['']
+        if range_header and self.serve_ranges:
+            start, end = range_header.split('=')[1].split('-')
+            body = self.data[int(start):int(end) + 1]
+            status = '206 Partial Content'
+        else:
+            body = self.data
+            status = '200 OK'
+        start_response(status, [('Content-Length', str(len(body)))])
+        return self._chunks(body)
+
+    def _chunks(self, body):
+        for offset in xrange(0, len(body), self.chunk_size):
+            if self.chunk_delay:
+                eventlet.sleep(self.chunk_delay)
+            yield body[offset:offset + self.chunk_size]
+
+    def test_download_ranges(self):
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image')
+            self.service.download(self.context, 'fake-image', dst_path=path)
+            with open(path) as image_file:
+                self.assertEqual(image_file.read(), self.data)
+        # A request for the first byte, then one for each range
+        self.assertEqual(len(self.requests), 12)
+        self.assertEqual(self.requests[0], 'bytes=0-0')
+        self.assertTrue('bytes=10000-10122' in self.requests)
+
+    def test_download_without_ranges(self):
+        self.serve_ranges = False
+
+        def fake_call(context, version, method, image_id):
+            self.assertEqual(method, 'data')
+            return [self.data]
+
+        self.stubs.Set(self.service._client, 'call', fake_call)
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image')
+            self.service.download(self.context, 'fake-image', dst_path=path)
+            with open(path) as image_file:
+                self.assertEqual(image_file.read(), self.data)
+        self.assertEqual(self.requests, ['bytes=0-0'])
+
+    def test_download_without_range_check(self):
+        self.flags(glance_num_retries=1)
+        checks = []
+
+        def fake_get_range(context, server, image_id, start, end):
+            checks.append((start, end))
+            raise exception.GlanceConnectionFailed(host='fake', port=1,
+                                                   reason='fake')
+
+        def fake_call(context, version, method, image_id):
+            return [self.data]
+
+        self.stubs.Set(self.service, '_get_range', fake_get_range)
+        self.stubs.Set(self.service._client, 'call', fake_call)
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image')
+            self.service.download(self.context, 'fake-image', dst_path=path)
+            with open(path) as image_file:
+                self.assertEqual(image_file.read(), self.data)
+        self.assertEqual(checks, [(0, 0), (0, 0)])
+
+    def test_range_connection_ssl_settings(self):
+        self.flags(glance_api_insecure=True)
+        conn = glance._create_glance_connection('fake-glance', 9292, True)
+        self.assertTrue(isinstance(conn,
+                                   glanceclient_http.VerifiedHTTPSConnection))
+        self.assertTrue(conn.insecure)
+
+    def _fetch(self):
+        self.stubs.Set(glance, 'get_remote_image_service',
+                       lambda context, image_href: (self.service,
+                                                    'fake-image'))
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image')
+            sha1 = images.fetch(self.context, 'fake-image', path,
+                                'fake', 'fake')
+            with open(path) as image_file:
+                self.assertEqual(image_file.read(), self.data)
+        self.assertEqual(sha1, hashlib.sha1(self.data).hexdigest())
+        self.assertEqual(self.shown, ['fake-image'])
+
+    def test_fetch_ranges(self):
+        self._fetch()
+        self.assertEqual(len(self.requests), 12)
+
+    def test_fetch_without_ranges_hashes_while_downloading(self):
+        self.serve_ranges = False
+
+        def fake_call(context, version, method, image_id):
+            return [self.data]
+
+        self.stubs.Set(self.service._client, 'call', fake_call)
+        writers = []
+        writer_class = images._ChecksummingWriter
+
+        def fake_writer(image_file):
+            writers.append(image_file)
+            return writer_class(image_file)
+
+        self.stubs.Set(images, '_ChecksummingWriter', fake_writer)
+        self._fetch()
+        # The image was hashed as it was written, not read back
+        self.assertEqual(len(writers), 1)
+        self.assertNotEqual(writers[0], None)
+        self.assertEqual(self.requests, ['bytes=0-0'])
+
+    def test_download_range_retried_on_next_server(self):
+        self.flags(glance_num_retries=1)
+        broken_requests = []
+
+        def broken_app(environ, start_response):
+            broken_requests.append(environ.get('HTTP_RANGE'))
+            start_response('503 Service Unavailable', [])
+            return ['']
+
+        broken_server = wsgi.Server('broken-glance', broken_app,
+                                    host='127.0.0.1')
+        broken_server.start()
+        self.addCleanup(broken_server.stop)
+        servers = itertools.cycle([('127.0.0.1', self.server.port, False),
+                                   ('127.0.0.1', broken_server.port, False)])
+        self.stubs.Set(self.service, '_range_servers', lambda: servers)
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image')
+            self.service.download(self.context, 'fake-image', dst_path=path)
+            with open(path) as image_file:
+                self.assertEqual(image_file.read(), self.data)
+        # Workers started on the broken server moved to the working one
+        self.assertEqual(len(broken_requests), 2)
+        self.assertEqual(len(self.requests), 12)
+
+    def test_download_range_retries(self):
+        self.flags(glance_num_retries=2)
+        self.failing_ranges = {'bytes=3000-3999': 2}
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image')
+            self.service.download(self.context, 'fake-image', dst_path=path)
+            with open(path) as image_file:
+                self.assertEqual(image_file.read(), self.data)
+        self.assertEqual(self.requests.count('bytes=3000-3999'), 3)
+
+    def test_download_range_failure_stops_workers(self):
+        self.flags(glance_num_retries=1)
+        self.failing_ranges = {'bytes=3000-3999': 2}
+        # Ranges take 0.1s, so the other workers are still downloading
+        # when the failure is raised
+        self.chunk_size = 100
+        self.chunk_delay = 0.01
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image')
+            self.assertRaises(exception.GlanceConnectionFailed,
+                              self.service.download, self.context,
+                              'fake-image', dst_path=path)
+            requests = len(self.requests)
+            eventlet.sleep(0.2)
+        self.assertEqual(len(self.requests), requests)
+        self.assertTrue(requests < 12)
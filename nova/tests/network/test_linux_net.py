@@ -645,3 +645,82 @@ class LinuxNetworkTestCase(test.TestCase):
         self.mox.ReplayAll()
         manager.defer_apply_off()
         self.assertFalse(manager.iptables_apply_deferred)
+
+
+class IptablesManagerModifyRulesTestCase(test.TestCase):
+    def setUp(self):
+        super(IptablesManagerModifyRulesTestCase, self).setUp()
+        self.stubs.Set(linux_net, 'binary_name', 'test')
+        self.manager = linux_net.IptablesManager()
+
+    def _build_table(self, rules, top_rules, removed_rules):
+        """Add rules to the filter table, and return the lines of the
+        table as iptables-save would print them once they are applied,
+        with twice as many INPUT rules as are removed.
+        """
+        table = self.manager.ipv4['filter']
+        current_lines = ['*filter',
+                         ':INPUT ACCEPT [0:0]',
+                         ':FORWARD ACCEPT [0:0]',
+                         ':OUTPUT ACCEPT [0:0]',
+                         ':nova-filter-top - [0:0]',
+                         ':test-FORWARD - [0:0]']
+        for i in xrange(rules):
+            table.add_rule('FORWARD', '-s 10.0.%d.%d -j DROP' %
+                           (i >> 8, i & 255))
+            current_lines.append('[0:0] -A test-FORWARD -s 10.0.%d.%d '
+                                 '-j DROP' % (i >> 8, i & 255))
+        for i in xrange(top_rules):
+            rule = '-s 11.0.%d.%d -j ACCEPT' % (i >> 8, i & 255)
+            table.add_rule('nova-filter-top', rule, wrap=False, top=True)
+            current_lines.append('[5:6] -A nova-filter-top %s' % rule)
+        for i in xrange(removed_rules * 2):
+            rule = '-s 12.0.%d.%d -j ACCEPT' % (i >> 8, i & 255)
+            current_lines.append('[0:0] -A INPUT %s' % rule)
+            if i < removed_rules:
+                table.remove_rules.append(
+                    linux_net.IptablesRule('INPUT', rule, False, False))
+        current_lines.append('COMMIT')
+        return table, current_lines
+
+    def test_modify_rules_many_rules(self):
+        table, current_lines = self._build_table(500, 50, 50)
+
+        new_lines = self.manager._modify_rules(current_lines, table)
+
+        self.assertEqual(len(new_lines), len(set(new_lines)))
+        self.assertTrue('[0:0] -A test-FORWARD -s 10.0.1.243 -j DROP'
+                        in new_lines)
+        # Top rules keep their packet counts, removed rules are gone
+        self.assertEqual(len([line for line in new_lines
+                              if 'nova-filter-top -s 11.' in line]), 50)
+        self.assertTrue('[5:6] -A nova-filter-top -s 11.0.0.1 -j ACCEPT'
+                        in new_lines)
+        self.assertFalse('[0:0] -A INPUT -s 12.0.0.1 -j ACCEPT'
+                         in new_lines)
+        self.assertTrue('[0:0] -A INPUT -s 12.0.0.99 -j ACCEPT'
+                        in new_lines)
+        self.assertEqual(table.remove_rules, [])
+
+    def test_modify_rules_is_linear(self):
+        # Every line is looked up by its text without counters a bounded
+        # number of times; comparing the lines with each other would make
+        # this grow with the square of the table size.
+        calls = []
+        strip_counters = linux_net._strip_counters
+
+        def fake_strip_counters(line):
+            calls.append(line)
+            return strip_counters(line)
+
+        self.stubs.Set(linux_net, '_strip_counters', fake_strip_counters)
+        table, current_lines = self._build_table(4000, 1000, 1000)
+        operations = len(current_lines) + len(table.rules)
+
+        new_lines = self.manager._modify_rules(current_lines, table)
+
+        self.assertEqual(len([line for line in new_lines
+                              if 'INPUT -s 12.' in line]), 1000)
+        self.assertTrue(len(calls) <= 2 * operations,
+                        '%d lookups for %d lines and rules' %
+                        (len(calls), operations))
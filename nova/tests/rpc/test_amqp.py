@@ -0,0 +1,197 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the AMQP connection pool and reply queue."""
+
+import sys
+import time
+
+from nova import context
+from nova.openstack.common import cfg
+from nova.openstack.common.rpc import amqp
+from nova.openstack.common.rpc import common as rpc_common
+from nova import test
+
+CONF = cfg.CONF
+
+
+class FakeConnection(object):
+    """Connection delivering direct messages to the consumers declared
+    on any connection, and keeping the messages sent to topics.
+    """
+
+    # { queue : callback }
+    consumers = {}
+    # [ (topic, message) ]
+    sent = []
+
+    def __init__(self, conf, server_params=None):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def reset(self):
+        pass
+
+    def declare_direct_consumer(self, topic, callback):
+        self.consumers[topic] = callback
+
+    def consume_in_thread(self):
+        pass
+
+    def topic_send(self, topic, msg):
+        self.sent.append((topic, msg))
+
+    def direct_send(self, msg_id, msg):
+        self.consumers[msg_id](msg)
+
+
+class AmqpPoolTestCase(test.TestCase):
+    def setUp(self):
+        super(AmqpPoolTestCase, self).setUp()
+        self.flags(rpc_conn_pool_size=1,
+                   rpc_conn_pool_adaptive=True,
+                   rpc_conn_pool_max_size=4,
+                   rpc_conn_pool_grow_threshold=1,
+                   rpc_conn_pool_idle_timeout=60)
+        self.now = 1000.0
+        self.stubs.Set(time, 'time', lambda: self.now)
+        self.pool = amqp.Pool(CONF, FakeConnection)
+
+    def test_not_adaptive(self):
+        self.flags(rpc_conn_pool_adaptive=False)
+        pool = amqp.Pool(CONF, FakeConnection)
+        connection = pool.get()
+        pool.put(connection)
+        self.assertEqual(pool.max_size, 1)
+        self.assertEqual(pool.stats['checkouts'], 1)
+        self.assertEqual(pool.stats['creates'], 1)
+        self.assertEqual(pool.stats['grows'], 0)
+
+    def test_grows_when_exhausted(self):
+        connections = [self.pool.get() for i in xrange(3)]
+        self.assertEqual(self.pool.max_size, 4)
+        self.assertEqual(self.pool.stats['grows'], 2)
+        self.assertEqual(self.pool.stats['waits'], 2)
+        self.assertEqual(self.pool.stats['in_use_high_water'], 3)
+
+        # Returning connections does not undo the growth
+        for connection in connections:
+            self.pool.put(connection)
+        self.assertEqual(self.pool.max_size, 4)
+        self.assertEqual(self.pool.current_size, 3)
+        self.assertEqual(self.pool.stats['in_use'], 0)
+        self.assertEqual(self.pool.stats['destroys'], 0)
+
+    def test_grows_up_to_max_size(self):
+        for i in xrange(4):
+            self.pool.get()
+        self.assertEqual(self.pool.max_size, 4)
+        self.assertEqual(self.pool.stats['grows'], 2)
+
+    def test_closes_idle_connections(self):
+        connections = [self.pool.get() for i in xrange(3)]
+        for connection in connections:
+            self.pool.put(connection)
+
+        self.now += 61
+        self.pool.put(self.pool.get())
+        self.assertEqual(self.pool.current_size, 1)
+        self.assertEqual(self.pool.max_size, 1)
+        self.assertEqual(self.pool.stats['destroys'], 2)
+        self.assertEqual(len([c for c in connections if c.closed]), 2)
+
+
+class AmqpReplyQueueTestCase(test.TestCase):
+    def setUp(self):
+        super(AmqpReplyQueueTestCase, self).setUp()
+        self.flags(amqp_rpc_single_reply_queue=True)
+        self.stubs.Set(FakeConnection, 'consumers', {})
+        self.stubs.Set(FakeConnection, 'sent', [])
+        self.pool = amqp.Pool(CONF, FakeConnection)
+        self.context = context.get_admin_context()
+
+    def _call(self, method, timeout=None):
+        waiter = amqp.multicall(CONF, self.context, 'topic',
+                                {'method': method}, timeout, self.pool)
+        return waiter, FakeConnection.sent[-1][1]
+
+    def _reply(self, msg, *replies):
+        """Reply to msg the way the server consuming it does."""
+        ctxt = amqp.unpack_context(CONF, dict(msg))
+        for reply in replies:
+            ctxt.reply(reply, connection_pool=self.pool)
+        ctxt.reply(ending=True, connection_pool=self.pool)
+
+    def test_replies_routed_by_msg_id(self):
+        waiter1, msg1 = self._call('one')
+        waiter2, msg2 = self._call('two')
+        self.assertNotEqual(msg1['_msg_id'], msg2['_msg_id'])
+        self.assertEqual(msg1['_reply_q'], msg2['_reply_q'])
+        self.assertEqual(FakeConnection.consumers.keys(), [msg1['_reply_q']])
+
+        self._reply(msg2, 'two')
+        self._reply(msg1, 'one', 'more')
+        self.assertEqual(list(waiter1), ['one', 'more'])
+        self.assertEqual(list(waiter2), ['two'])
+        self.assertEqual(self.pool.reply_proxy._call_waiters, {})
+
+    def test_call(self):
+        self.stubs.Set(FakeConnection, 'topic_send',
+                       lambda conn, topic, msg: self._reply(msg, 'result'))
+        self.assertEqual(amqp.call(CONF, self.context, 'topic',
+                                   {'method': 'one'}, None, self.pool),
+                         'result')
+
+    def test_send_error(self):
+        def fake_topic_send(conn, topic, msg):
+            raise test.TestingException()
+
+        self.stubs.Set(FakeConnection, 'topic_send', fake_topic_send)
+        self.assertRaises(test.TestingException, amqp.multicall, CONF,
+                          self.context, 'topic', {'method': 'one'}, None,
+                          self.pool)
+        self.assertEqual(self.pool.reply_proxy._call_waiters, {})
+
+    def test_remote_error(self):
+        waiter, msg = self._call('one')
+        ctxt = amqp.unpack_context(CONF, dict(msg))
+        try:
+            raise test.TestingException()
+        except test.TestingException:
+            ctxt.reply(failure=sys.exc_info(), connection_pool=self.pool,
+                       log_failure=False)
+        self.assertRaises(rpc_common.RemoteError, list, waiter)
+        self.assertEqual(self.pool.reply_proxy._call_waiters, {})
+
+    def test_timeout(self):
+        waiter, msg = self._call('one', timeout=0.01)
+        self.assertRaises(rpc_common.Timeout, list, waiter)
+        self.assertEqual(self.pool.reply_proxy._call_waiters, {})
+
+    def test_late_reply(self):
+        warnings = []
+        self.stubs.Set(amqp.LOG, 'warn',
+                       lambda *args, **kwargs: warnings.append(args))
+        waiter, msg = self._call('one', timeout=0.01)
+        self.assertRaises(rpc_common.Timeout, list, waiter)
+
+        # The waiter is gone, the reply is dropped
+        self._reply(msg, 'late')
+        self.assertEqual(len(warnings), 2)
+        self.assertEqual(self.pool.reply_proxy._call_waiters, {})
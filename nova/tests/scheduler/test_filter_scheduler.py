@@ -26,6 +26,7 @@ from nova import db
 from nova import exception
 from nova.scheduler import driver
 from nova.scheduler import filter_scheduler
+from nova.scheduler.filters import ram_filter
 from nova.scheduler import host_manager
 from nova.scheduler import weights
 from nova.tests.scheduler import fakes
@@ -36,6 +37,16 @@ def fake_get_filtered_hosts(hosts, filter_properties):
     return list(hosts)
 
 
+class CountingRamFilter(ram_filter.RamFilter):
+    """RamFilter that counts how many hosts it was asked to check."""
+    calls = 0
+
+    def host_passes(self, host_state, filter_properties):
+        CountingRamFilter.calls += 1
+        return super(CountingRamFilter, self).host_passes(host_state,
+                filter_properties)
+
+
 class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
     """Test case for Filter Scheduler."""
 
@@ -145,7 +156,8 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
 
         self.next_weight = 1.0
 
-        def _fake_weigh_objects(_self, functions, hosts, options):
+        def _fake_weigh_objects(_self, functions, hosts, options,
+                                limit=None):
             self.next_weight += 2.0
             host_state = hosts[0]
             return [weights.WeighedHost(host_state, self.next_weight)]
@@ -339,3 +351,56 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
 
         self.assertEqual([('host', 'node')],
                          filter_properties['retry']['hosts'])
+
+    def _batch_host_states(self, num_hosts):
+        host_states = []
+        for x in xrange(num_hosts):
+            # A mix of host sizes, with some hosts of the same size so
+            # that ties have to be broken consistently.
+            ram = 1024 * (x % 7 + 1)
+            host_states.append(fakes.FakeHostState('host%s' % x,
+                    'node%s' % x, {'free_ram_mb': ram,
+                                   'total_usable_ram_mb': ram,
+                                   'free_disk_mb': 1024 * 1024,
+                                   'vcpus_total': 4}))
+        return host_states
+
+    def _schedule_batch_request(self, num_hosts, num_instances, batch):
+        self.flags(scheduler_batch_placement=batch,
+                   scheduler_default_filters=['CountingRamFilter'],
+                   ram_allocation_ratio=1.0)
+        sched = fakes.FakeFilterScheduler()
+        sched.host_manager.filter_classes = [CountingRamFilter]
+        host_states = self._batch_host_states(num_hosts)
+        self.stubs.Set(sched.host_manager, 'get_all_host_states',
+                       lambda context: iter(host_states))
+        fake_context = context.RequestContext('user', 'project',
+                is_admin=True)
+        instance_properties = {'project_id': 1, 'os_type': 'Linux',
+                               'root_gb': 1, 'ephemeral_gb': 0,
+                               'memory_mb': 512, 'vcpus': 1}
+        request_spec = {'num_instances': num_instances,
+                        'instance_type': instance_properties,
+                        'instance_properties': instance_properties}
+        CountingRamFilter.calls = 0
+        return sched._schedule(fake_context, request_spec, {})
+
+    def test_schedule_batch_matches_serial(self):
+        serial = self._schedule_batch_request(20, 200, False)
+        batch = self._schedule_batch_request(20, 200, True)
+
+        # 20 hosts with 77GB of ram between them fit 154 512MB instances
+        self.assertEqual(154, len(serial))
+        self.assertEqual([(h.obj.host, h.weight) for h in serial],
+                         [(h.obj.host, h.weight) for h in batch])
+
+    def test_schedule_batch_no_hosts(self):
+        self.assertEqual([], self._schedule_batch_request(0, 10, True))
+
+    def test_schedule_batch_host_checks(self):
+        # Serial placement checks every host for every instance, batch
+        # placement checks every host once plus one host per instance.
+        self._schedule_batch_request(50, 50, False)
+        self.assertEqual(50 * 50, CountingRamFilter.calls)
+        self._schedule_batch_request(50, 50, True)
+        self.assertEqual(50 + 50, CountingRamFilter.calls)
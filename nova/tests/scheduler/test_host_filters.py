@@ -26,6 +26,7 @@ from nova.openstack.common import jsonutils
 from nova.scheduler import filters
 from nova.scheduler.filters import extra_specs_ops
 from nova.scheduler.filters.trusted_filter import AttestationService
+from nova.scheduler import host_table
 from nova import servicegroup
 from nova import test
 from nova.tests.scheduler import fakes
@@ -1317,3 +1318,88 @@ class HostFiltersTestCase(test.TestCase):
                                    {'num_instances': 5})
         filter_properties = {}
         self.assertFalse(filt_cls.host_passes(host, filter_properties))
+
+
+class HostTableFiltersTestCase(test.TestCase):
+    """Test that host table filters match their per-host versions."""
+
+    def setUp(self):
+        super(HostTableFiltersTestCase, self).setUp()
+        if not host_table.is_available():
+            self.skipTest("Unable to test due to lack of numpy")
+        self.class_map = dict((cls.__name__, cls) for cls in
+                filters.HostFilterHandler().get_matching_classes(
+                        ['nova.scheduler.filters.all_filters']))
+
+    def _make_hosts(self):
+        hosts = []
+        for x in xrange(40):
+            hosts.append(fakes.FakeHostState('host%s' % x, 'node', {
+                    'free_ram_mb': 512 * (x % 5) - 1024,
+                    'total_usable_ram_mb': 2048,
+                    'free_disk_mb': 1024 * (x % 9),
+                    'total_usable_disk_gb': 10,
+                    'vcpus_total': x % 3 and 4 or None,
+                    'vcpus_used': x % 11,
+                    'num_instances': x % 7,
+                    'num_io_ops': x % 13}))
+        return hosts
+
+    def _test_filter(self, filter_name, filter_properties):
+        filt_cls = self.class_map[filter_name]
+        self.assertTrue(filt_cls.host_table_filter)
+
+        hosts = self._make_hosts()
+        expected = [filt_cls().host_passes(host, filter_properties)
+                    for host in hosts]
+        expected_limits = [host.limits for host in hosts]
+
+        hosts = self._make_hosts()
+        table = host_table.HostTable(hosts)
+        passes = filt_cls().host_table_passes(table, filter_properties)
+        self.assertEqual(expected, list(passes))
+        self.assertEqual(expected_limits, [host.limits for host in hosts])
+        # Make sure this is not a trivial check
+        self.assertTrue(any(expected))
+        self.assertFalse(all(expected))
+
+    def test_ram_filter(self):
+        self.flags(ram_allocation_ratio=1.5)
+        self._test_filter('RamFilter', {'instance_type': {'memory_mb': 512}})
+
+    def test_disk_filter(self):
+        self.flags(disk_allocation_ratio=1.0)
+        self._test_filter('DiskFilter',
+                {'instance_type': {'root_gb': 3, 'ephemeral_gb': 1}})
+
+    def test_core_filter(self):
+        self.flags(cpu_allocation_ratio=2)
+        self._test_filter('CoreFilter', {'instance_type': {'vcpus': 1}})
+
+    def test_num_instances_filter(self):
+        self.flags(max_instances_per_host=5)
+        self._test_filter('NumInstancesFilter', {})
+
+    def test_io_ops_filter(self):
+        self.flags(max_io_ops_per_host=8)
+        self._test_filter('IoOpsFilter', {})
+
+    def test_filter_handler(self):
+        self.flags(ram_allocation_ratio=1.5, max_io_ops_per_host=8)
+        filter_classes = [self.class_map['RamFilter'],
+                          self.class_map['AvailabilityZoneFilter'],
+                          self.class_map['IoOpsFilter']]
+        filter_properties = {'instance_type': {'memory_mb': 512},
+                             'request_spec': {'instance_properties': {}}}
+        handler = filters.HostFilterHandler()
+
+        self.flags(scheduler_host_table_filters=False)
+        expected = handler.get_filtered_objects(filter_classes,
+                self._make_hosts(), filter_properties)
+        self.flags(scheduler_host_table_filters=True)
+        result = handler.get_filtered_objects(filter_classes,
+                self._make_hosts(), filter_properties)
+
+        self.assertTrue(expected)
+        self.assertEqual([host.host for host in expected],
+                         [host.host for host in result])
@@ -15,8 +15,11 @@
 """
 Tests For HostManager
 """
+import datetime
 import sys
 
+import mox
+
 from nova.compute import task_states
 from nova.compute import vm_states
 from nova import db
@@ -268,6 +271,89 @@ class HostManagerTestCase(test.TestCase):
         self.assertEqual(host_states_map[('host4', 'node4')].free_disk_mb,
                          8388608)
 
+    def _setup_host_state_cache(self, context):
+        self.flags(scheduler_host_state_cache=True,
+                   scheduler_host_state_full_resync_interval=600,
+                   scheduler_host_state_cache_skew=5)
+        timeutils.set_time_override()
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        self.mox.StubOutWithMock(db, 'service_get_all')
+        self.mox.StubOutWithMock(host_manager.LOG, 'warn')
+        db.compute_node_get_all(context).AndReturn(fakes.COMPUTE_NODES)
+        host_manager.LOG.warn("No service for compute ID 5")
+
+    def test_get_all_host_states_incremental(self):
+        context = 'fake_context'
+        self._setup_host_state_cache(context)
+
+        first_refresh = timeutils.utcnow()
+        since = first_refresh - datetime.timedelta(seconds=5)
+        services = [dict(id=3, host='host3', topic='compute',
+                         disabled=True),
+                    dict(id=7, host='other', topic='network',
+                         disabled=False)]
+        changed = dict(fakes.COMPUTE_NODES[2], free_ram_mb=42,
+                       service_id=3, updated_at=first_refresh)
+        db.service_get_all(context).AndReturn(services)
+        db.compute_node_get_all(context,
+                updated_since=since).AndReturn([changed])
+
+        self.mox.ReplayAll()
+        self.host_manager.get_all_host_states(context)
+        timeutils.advance_time_seconds(60)
+        self.host_manager.get_all_host_states(context)
+        host_states_map = self.host_manager.host_state_map
+
+        self.assertEqual(len(host_states_map), 4)
+        self.assertEqual(host_states_map[('host3', 'node3')].free_ram_mb,
+                         42)
+        self.assertEqual(host_states_map[('host2', 'node2')].free_ram_mb,
+                         1024)
+        self.assertTrue(
+                host_states_map[('host3', 'node3')].service['disabled'])
+        stats = self.host_manager.host_state_cache_stats
+        self.assertEqual(stats['full_resyncs'], 1)
+        self.assertEqual(stats['incremental_refreshes'], 1)
+        self.assertEqual(stats['misses'], 5)
+        self.assertEqual(stats['hits'], 3)
+
+    def test_get_all_host_states_incremental_deleted(self):
+        context = 'fake_context'
+        self._setup_host_state_cache(context)
+
+        deleted = dict(fakes.COMPUTE_NODES[0], deleted=True, service=None)
+        db.service_get_all(context).AndReturn([])
+        db.compute_node_get_all(context,
+                updated_since=mox.IgnoreArg()).AndReturn([deleted])
+
+        self.mox.ReplayAll()
+        self.host_manager.get_all_host_states(context)
+        timeutils.advance_time_seconds(60)
+        self.host_manager.get_all_host_states(context)
+
+        host_states_map = self.host_manager.host_state_map
+        self.assertEqual(len(host_states_map), 3)
+        self.assertFalse(('host1', 'node1') in host_states_map)
+
+    def test_get_all_host_states_full_resync(self):
+        context = 'fake_context'
+        self._setup_host_state_cache(context)
+
+        # Only the first three nodes are left on the second full resync
+        db.compute_node_get_all(context).AndReturn(fakes.COMPUTE_NODES[:3])
+
+        self.mox.ReplayAll()
+        self.host_manager.get_all_host_states(context)
+        timeutils.advance_time_seconds(601)
+        self.host_manager.get_all_host_states(context)
+
+        host_states_map = self.host_manager.host_state_map
+        self.assertEqual(len(host_states_map), 3)
+        self.assertFalse(('host4', 'node4') in host_states_map)
+        stats = self.host_manager.host_state_cache_stats
+        self.assertEqual(stats['full_resyncs'], 2)
+        self.assertEqual(stats['incremental_refreshes'], 0)
+
 
 class HostStateTestCase(test.TestCase):
     """Test case for HostState class"""
@@ -17,6 +17,7 @@ Tests For Scheduler weights.
 """
 
 from nova import context
+from nova.scheduler import host_table
 from nova.scheduler import weights
 from nova import test
 from nova.tests import matchers
@@ -115,3 +116,72 @@ class RamWeigherTestCase(test.TestCase):
         weighed_host = self._get_weighed_host(hostinfo_list)
         self.assertEqual(weighed_host.weight, 8192 * 2)
         self.assertEqual(weighed_host.obj.host, 'host4')
+
+
+class FakeHostWeigher(weights.BaseHostWeigher):
+    """Per-host weigher with no host table support."""
+    def _weigh_object(self, host_state, weight_properties):
+        return host_state.vcpus_used
+
+
+class HostTableWeighingTestCase(test.TestCase):
+    def setUp(self):
+        super(HostTableWeighingTestCase, self).setUp()
+        if not host_table.is_available():
+            self.skipTest("Unable to test due to lack of numpy")
+        self.weight_handler = weights.HostWeightHandler()
+
+    def _make_hosts(self):
+        return [fakes.FakeHostState('host%s' % x, 'node',
+                                    {'free_ram_mb': 512 * (x % 6),
+                                     'vcpus_used': x % 4})
+                for x in xrange(30)]
+
+    def _test_weighers(self, weigher_class_names):
+        weight_classes = self.weight_handler.get_matching_classes(
+                weigher_class_names)
+        self.flags(scheduler_host_table_weighers=False)
+        expected = self.weight_handler.get_weighed_objects(weight_classes,
+                self._make_hosts(), {})
+        self.flags(scheduler_host_table_weighers=True)
+        result = self.weight_handler.get_weighed_objects(weight_classes,
+                self._make_hosts(), {})
+        self.assertEqual([(h.obj.host, h.weight) for h in expected],
+                         [(h.obj.host, h.weight) for h in result])
+
+    def test_ram_weigher(self):
+        self.flags(ram_weight_multiplier=-2.0)
+        self._test_weighers(['nova.scheduler.weights.ram.RAMWeigher'])
+
+    def test_mixed_weighers(self):
+        self._test_weighers(['nova.scheduler.weights.ram.RAMWeigher',
+                'nova.tests.scheduler.test_weights.FakeHostWeigher'])
+
+    def test_least_cost_weigher(self):
+        self.flags(least_cost_functions=[
+                'nova.scheduler.least_cost.compute_fill_first_cost_fn',
+                'nova.scheduler.least_cost.noop_cost_fn'])
+        self._test_weighers(['nova.scheduler.weights.all_weighers'])
+
+    def test_limit(self):
+        weight_classes = self.weight_handler.get_matching_classes(
+                ['nova.scheduler.weights.ram.RAMWeigher'])
+        for host_table_weighers in (False, True):
+            self.flags(scheduler_host_table_weighers=host_table_weighers)
+            expected = self.weight_handler.get_weighed_objects(
+                    weight_classes, self._make_hosts(), {})
+            # Hosts come in groups of 5 with the same weight, so some
+            # limits cut through a group
+            for limit in (0, 1, 7, 10, 30, 40):
+                result = self.weight_handler.get_weighed_objects(
+                        weight_classes, self._make_hosts(), {}, limit)
+                self.assertEqual([(h.obj.host, h.weight)
+                                  for h in expected[:limit]],
+                                 [(h.obj.host, h.weight) for h in result])
+
+    def test_no_hosts(self):
+        self.flags(scheduler_host_table_weighers=True)
+        weight_classes = self.weight_handler.get_matching_classes(
+                ['nova.scheduler.weights.ram.RAMWeigher'])
+        self.assertEqual([], self.weight_handler.get_weighed_objects(
+                weight_classes, [], {}))
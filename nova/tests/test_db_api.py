@@ -24,9 +24,12 @@ import uuid as stdlib_uuid
 
 from nova import context
 from nova import db
+from nova.db.sqlalchemy import api as sqlalchemy_api
+from nova.db.sqlalchemy import models
 from nova import exception
 from nova.openstack.common import cfg
 from nova.openstack.common import timeutils
+from nova import quota
 from nova import test
 from nova.tests import matchers
 
@@ -105,6 +108,16 @@ class DbApiTestCase(test.TestCase):
         result = db.instance_get_all_by_filters(self.context, {})
         self.assertEqual(2, len(result))
 
+    def test_instance_get_all_by_uuids(self):
+        inst1 = self.create_instances_with_args()
+        inst2 = self.create_instances_with_args()
+        self.create_instances_with_args()
+        result = db.instance_get_all_by_uuids(self.context,
+                [inst1['uuid'], inst2['uuid'], 'fake-uuid'])
+        self.assertEqual(set([inst1['uuid'], inst2['uuid']]),
+                         set(inst['uuid'] for inst in result))
+        self.assertEqual([], db.instance_get_all_by_uuids(self.context, []))
+
     def test_instance_get_all_by_filters_regex(self):
         self.create_instances_with_args(display_name='test1')
         self.create_instances_with_args(display_name='teeeest2')
@@ -126,6 +139,98 @@ class DbApiTestCase(test.TestCase):
                                                 {'display_name': '%test%'})
         self.assertEqual(2, len(result))
 
+    def test_instance_get_all_by_fixed_ip_addresses(self):
+        ctxt = context.get_admin_context()
+        db.service_create(ctxt, {'host': 'host1', 'topic': 'compute',
+                                 'availability_zone': 'zone1'})
+        instance1 = self.create_instances_with_args(
+                metadata={'foo': 'bar'})
+        instance2 = self.create_instances_with_args(host='host2')
+        group = db.security_group_create(ctxt, {'name': 'group1',
+                                                'project_id': 'fake'})
+        db.instance_add_security_group(ctxt, instance1['uuid'], group['id'])
+        db.block_device_mapping_create(ctxt, {
+                'instance_uuid': instance1['uuid'],
+                'device_name': '/dev/vdb', 'volume_id': 'fake-volume'})
+        db.fixed_ip_create(ctxt, {'address': '10.0.0.1',
+                                  'instance_uuid': instance1['uuid']})
+        db.fixed_ip_create(ctxt, {'address': '10.0.0.2',
+                                  'instance_uuid': instance1['uuid']})
+        db.fixed_ip_create(ctxt, {'address': '10.0.0.3',
+                                  'instance_uuid': instance2['uuid']})
+        db.fixed_ip_create(ctxt, {'address': '10.0.0.4'})
+
+        result = db.instance_get_all_by_fixed_ip_addresses(ctxt,
+                ['10.0.0.1', '10.0.0.3', '10.0.0.4', '10.0.0.5'])
+        self.assertEqual(sorted(result.keys()), ['10.0.0.1', '10.0.0.3'])
+
+        instance, availability_zone = result['10.0.0.1']
+        # Everything the metadata needs was loaded by the query itself
+        for column in ('security_groups', 'block_device_mapping',
+                       'info_cache', 'metadata', 'system_metadata',
+                       'instance_type'):
+            self.assertTrue(column in instance.__dict__)
+        self.assertEqual(instance['uuid'], instance1['uuid'])
+        self.assertEqual(availability_zone, 'zone1')
+        self.assertEqual([g['name'] for g in instance['security_groups']],
+                         ['group1'])
+        self.assertEqual([bdm['device_name']
+                          for bdm in instance['block_device_mapping']],
+                         ['/dev/vdb'])
+        self.assertEqual([(m['key'], m['value'])
+                          for m in instance['metadata']], [('foo', 'bar')])
+
+        instance, availability_zone = result['10.0.0.3']
+        self.assertEqual(instance['uuid'], instance2['uuid'])
+        self.assertEqual(availability_zone, None)
+
+    def test_regex_filter_plan(self):
+        self.flags(sql_connection='mysql://')
+        plan = sqlalchemy_api.regex_filter_plan(models.Instance, {
+                'display_name': '^test1$',
+                'hostname': '^host',
+                'host': 'net$',
+                'uuid': 'a_b%',
+                'project_id': 't.*st',
+                'user_id': 'a\\.b\\d',
+                'no_such_column': 'foo'})
+        self.assertEqual(plan, {
+                'display_name': ('exact', 'test1'),
+                'hostname': ('prefix', 'host%'),
+                'host': ('suffix', '%net'),
+                'uuid': ('substring', '%a\\_b\\%%'),
+                'project_id': ('regexp', 't.*st'),
+                'user_id': ('regexp', 'a\\.b\\d')})
+
+    def test_regex_filter_plan_sqlite(self):
+        # sqlite LIKE is case insensitive, unlike its REGEXP
+        self.flags(sql_connection='sqlite://')
+        plan = sqlalchemy_api.regex_filter_plan(models.Instance, {
+                'display_name': '^test1$',
+                'hostname': '^host'})
+        self.assertEqual(plan, {
+                'display_name': ('exact', 'test1'),
+                'hostname': ('regexp', '^host')})
+
+    def test_instance_get_all_by_filters_regex_literal(self):
+        self.flags(sql_connection='mysql://')
+        self.create_instances_with_args(display_name='test1')
+        self.create_instances_with_args(display_name='test10')
+        self.create_instances_with_args(display_name='my_test')
+        self.create_instances_with_args(display_name='mytest.1')
+
+        def _names(regexp):
+            result = db.instance_get_all_by_filters(self.context,
+                    {'display_name': regexp})
+            return sorted(instance['display_name'] for instance in result)
+
+        self.assertEqual(['test1'], _names('^test1$'))
+        self.assertEqual(['test1', 'test10'], _names('^test1'))
+        self.assertEqual(['my_test'], _names('y_test$'))
+        self.assertEqual(['mytest.1'], _names('t\\.1'))
+        self.assertEqual(['my_test', 'mytest.1', 'test1', 'test10'],
+                         _names('test'))
+
     def test_instance_get_all_by_filters_metadata(self):
         self.create_instances_with_args(metadata={'foo': 'bar'})
         self.create_instances_with_args()
@@ -177,12 +282,49 @@ class DbApiTestCase(test.TestCase):
                                                 sort_dir="asc",
                                                 marker=test3['uuid'])
         self.assertEqual(0, len(result))
-
         self.assertRaises(exception.MarkerNotFound,
                           db.instance_get_all_by_filters,
                           self.context, {'display_name': '%test%'},
                           marker=str(stdlib_uuid.uuid4()))
 
+    def test_instance_get_all_by_filters_paginate_deleted_marker(self):
+        test1 = self.create_instances_with_args()
+        test2 = self.create_instances_with_args()
+        db.instance_destroy(self.context, test1['uuid'])
+
+        result = db.instance_get_all_by_filters(self.context, {},
+                                                sort_dir="asc",
+                                                marker=test1['uuid'])
+        self.assertEqual([test2['uuid']], [i['uuid'] for i in result])
+
+    def test_instance_get_all_by_filters_paginate_marker_deleted_since(self):
+        # The last instance of a page is deleted before the next page is
+        # asked for, in a listing that excludes deleted instances
+        test1 = self.create_instances_with_args()
+        test2 = self.create_instances_with_args()
+        test3 = self.create_instances_with_args()
+        db.instance_destroy(self.context, test3['uuid'])
+
+        result = db.instance_get_all_by_filters(self.context,
+                                                {'deleted': False},
+                                                sort_dir="asc", limit=1)
+        self.assertEqual([test1['uuid']], [i['uuid'] for i in result])
+        db.instance_destroy(self.context, test1['uuid'])
+        result = db.instance_get_all_by_filters(self.context,
+                                                {'deleted': False},
+                                                sort_dir="asc",
+                                                marker=test1['uuid'])
+        self.assertEqual([test2['uuid']], [i['uuid'] for i in result])
+
+    def test_instance_get_all_by_filters_columns_to_join(self):
+        self.create_instances_with_args(metadata={'foo': 'bar'})
+        result = db.instance_get_all_by_filters(self.context, {},
+                columns_to_join=['metadata'])
+        self.assertEqual(1, len(result))
+        self.assertTrue('metadata' in result[0].__dict__)
+        self.assertFalse('system_metadata' in result[0].__dict__)
+        self.assertFalse('security_groups' in result[0].__dict__)
+
     def test_migration_get_unconfirmed_by_dest_compute(self):
         ctxt = context.get_admin_context()
 
@@ -725,6 +867,33 @@ class DbApiTestCase(test.TestCase):
         _compare(bw_usages[2], expected_bw_usages[2])
         timeutils.clear_time_override()
 
+    def test_bw_usage_update_bulk(self):
+        ctxt = context.get_admin_context()
+        now = timeutils.utcnow()
+        start_period = now - datetime.timedelta(seconds=10)
+
+        db.bw_usage_update(ctxt, 'fake_uuid1', 'fake_mac1', start_period,
+                           100, 200, 12345, 67890)
+        db.bw_usage_update_bulk(ctxt, start_period,
+                [{'uuid': 'fake_uuid1', 'mac': 'fake_mac1',
+                  'bw_in': 150, 'bw_out': 250,
+                  'last_ctr_in': 12395, 'last_ctr_out': 67940},
+                 {'uuid': 'fake_uuid2', 'mac': 'fake_mac2',
+                  'bw_in': 0, 'bw_out': 0,
+                  'last_ctr_in': 42, 'last_ctr_out': 43}],
+                last_refreshed=now)
+
+        bw_usages = db.bw_usage_get_by_uuids(ctxt,
+                ['fake_uuid1', 'fake_uuid2'], start_period)
+        self.assertEqual(len(bw_usages), 2)
+        bw_usages = dict((bw_usage['uuid'], bw_usage)
+                         for bw_usage in bw_usages)
+        self.assertEqual(bw_usages['fake_uuid1']['bw_in'], 150)
+        self.assertEqual(bw_usages['fake_uuid1']['last_ctr_out'], 67940)
+        self.assertEqual(bw_usages['fake_uuid1']['last_refreshed'], now)
+        self.assertEqual(bw_usages['fake_uuid2']['mac'], 'fake_mac2')
+        self.assertEqual(bw_usages['fake_uuid2']['last_ctr_in'], 42)
+
 
 def _get_fake_aggr_values():
     return {'name': 'fake_aggregate',
@@ -1157,6 +1326,29 @@ class CapacityTestCase(test.TestCase):
         self.assertEqual(2, int(stats['num_proj_12345']))
         self.assertEqual(3, int(stats['num_vm_building']))
 
+    def test_compute_node_get_all_updated_since(self):
+        then = timeutils.utcnow()
+        timeutils.set_time_override(then)
+        self.addCleanup(timeutils.clear_time_override)
+        item = self._create_helper('host1')
+
+        timeutils.advance_time_seconds(10)
+        since = timeutils.utcnow()
+        self.assertEqual([], db.compute_node_get_all(self.ctxt,
+                                                     updated_since=since))
+
+        timeutils.advance_time_seconds(10)
+        db.compute_node_update(self.ctxt, item['id'], {'vcpus_used': 1})
+        nodes = db.compute_node_get_all(self.ctxt, updated_since=since)
+        self.assertEqual(1, len(nodes))
+        self.assertEqual(1, nodes[0]['vcpus_used'])
+
+        db.service_destroy(self.ctxt, self.service['id'])
+        self.assertEqual([], db.compute_node_get_all(self.ctxt))
+        nodes = db.compute_node_get_all(self.ctxt, updated_since=since)
+        self.assertEqual(1, len(nodes))
+        self.assertTrue(nodes[0]['deleted'])
+
     def test_compute_node_update(self):
         item = self._create_helper('host1')
 
@@ -1418,3 +1610,104 @@ class VolumeUsageDBApiTestCase(test.TestCase):
         for key, value in expected_vol_usages.items():
             self.assertEqual(vol_usages[0][key], value)
         timeutils.clear_time_override()
+
+
+class ReservationTestCase(test.TestCase):
+    def setUp(self):
+        super(ReservationTestCase, self).setUp()
+        self.context = context.RequestContext('fake', 'fake')
+        self.admin_context = self.context.elevated()
+        self.useFixture(test.TimeOverride())
+
+    def _reserve(self, expire=60, **deltas):
+        quotas = dict((resource, -1) for resource in deltas)
+        expire = timeutils.utcnow() + datetime.timedelta(seconds=expire)
+        return db.quota_reserve(self.context, quota.QUOTAS._resources,
+                                quotas, deltas, expire, 0, 0)
+
+    def _usage(self, resource):
+        usages = db.quota_usage_get_all_by_project(self.context, 'fake')
+        return usages[resource]
+
+    def _reservation_count(self):
+        return len(sqlalchemy_api.model_query(self.admin_context,
+                                              models.Reservation).all())
+
+    def test_reservation_commit(self):
+        reservations = self._reserve(instances=2, cores=4)
+        reservations += self._reserve(instances=1, cores=-2)
+        self.assertEqual(self._usage('instances'),
+                         dict(in_use=0, reserved=3))
+        self.assertEqual(self._usage('cores'), dict(in_use=0, reserved=4))
+
+        db.reservation_commit(self.context, reservations)
+        self.assertEqual(self._usage('instances'),
+                         dict(in_use=3, reserved=0))
+        self.assertEqual(self._usage('cores'), dict(in_use=2, reserved=0))
+        self.assertEqual(self._reservation_count(), 0)
+
+        # Committing again has no effect
+        db.reservation_commit(self.context, reservations)
+        self.assertEqual(self._usage('instances'),
+                         dict(in_use=3, reserved=0))
+
+    def test_reservation_rollback(self):
+        reservations = self._reserve(instances=2, cores=4)
+        other = self._reserve(instances=1)
+        db.reservation_rollback(self.context, reservations)
+
+        self.assertEqual(self._usage('instances'),
+                         dict(in_use=0, reserved=1))
+        self.assertEqual(self._usage('cores'), dict(in_use=0, reserved=0))
+        self.assertEqual(self._reservation_count(), 1)
+
+        db.reservation_commit(self.context, other)
+        self.assertEqual(self._usage('instances'),
+                         dict(in_use=1, reserved=0))
+
+    def test_reservation_expire_batches(self):
+        for i in xrange(5):
+            self._reserve(expire=30, instances=1)
+        self._reserve(expire=120, instances=1, cores=2)
+        timeutils.advance_time_seconds(60)
+
+        calls = []
+        orig_batch = sqlalchemy_api._reservation_expire_batch
+
+        def fake_batch(context, batch_size):
+            count = orig_batch(context, batch_size)
+            calls.append(count)
+            return count
+
+        self.stubs.Set(sqlalchemy_api, '_reservation_expire_batch',
+                       fake_batch)
+        db.reservation_expire(self.admin_context, batch_size=2)
+
+        self.assertEqual(calls, [2, 2, 1])
+        self.assertEqual(self._usage('instances'),
+                         dict(in_use=0, reserved=1))
+        self.assertEqual(self._usage('cores'), dict(in_use=0, reserved=2))
+        self.assertEqual(self._reservation_count(), 2)
+
+    def test_reservation_expire_without_batches(self):
+        for i in xrange(5):
+            self._reserve(expire=30, instances=1)
+        timeutils.advance_time_seconds(60)
+
+        calls = []
+        orig_batch = sqlalchemy_api._reservation_expire_batch
+
+        def fake_batch(context, batch_size):
+            count = orig_batch(context, batch_size)
+            calls.append(count)
+            return count
+
+        self.stubs.Set(sqlalchemy_api, '_reservation_expire_batch',
+                       fake_batch)
+        for batch_size in (0, None):
+            db.reservation_expire(self.admin_context, batch_size=batch_size)
+
+        self.assertEqual(calls, [5, 0])
+        self.assertEqual(self._usage('instances'),
+                         dict(in_use=0, reserved=0))
+        self.assertEqual(self._reservation_count(), 0)
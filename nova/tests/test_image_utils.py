@@ -14,6 +14,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
+import os
+import struct
+
+from nova import exception
+from nova.image import glance
 from nova import test
 from nova import utils
 
@@ -216,3 +222,114 @@ ID        TAG                 VM SIZE                DATE       VM CLOCK
         self.assertEquals(67108864, image_info.virtual_size)
         self.assertEquals(98304, image_info.disk_size)
         self.assertEquals(3, len(image_info.snapshots))
+
+    def _write_qcow2(self, path, size, backing_file=None, cluster_bits=16):
+        backing_file = backing_file or ''
+        header = struct.pack('>4sIQIIQIIQQIIQ', 'QFI\xfb', 2,
+                             512 if backing_file else 0, len(backing_file),
+                             cluster_bits, size, 0, 0, 0, 0, 0, 0, 0)
+        with open(path, 'wb') as image_file:
+            image_file.write(header.ljust(512, '\0') + backing_file)
+
+    def test_cached_image_info_qcow2(self):
+        self.stubs.Set(images, '_image_info_cache', {})
+        self.mox.StubOutWithMock(utils, 'execute')
+        self.mox.ReplayAll()
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'disk')
+            self._write_qcow2(path, 10 * 1024 ** 3, backing_file='../base/a')
+            image_info = images.cached_image_info(path)
+            self.assertEquals('qcow2', image_info.file_format)
+            self.assertEquals(10 * 1024 ** 3, image_info.virtual_size)
+            self.assertEquals(65536, image_info.cluster_size)
+            self.assertEquals(os.path.join(tmpdir, '../base/a'),
+                              image_info.backing_file)
+            self.assertEquals('a', libvirt_utils.get_disk_backing_file(path))
+            self.assertEquals(10 * 1024 ** 3,
+                              libvirt_utils.get_disk_size(path))
+
+    def test_cached_image_info_raw(self):
+        self.stubs.Set(images, '_image_info_cache', {})
+        self.mox.StubOutWithMock(utils, 'execute')
+        self.mox.ReplayAll()
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'disk')
+            with open(path, 'wb') as image_file:
+                image_file.write('\0' * 4096)
+            image_info = images.cached_image_info(path)
+            self.assertEquals('raw', image_info.file_format)
+            self.assertEquals(4096, image_info.virtual_size)
+            self.assertEquals(None, image_info.backing_file)
+
+    def test_cached_image_info_other_format(self):
+        self.stubs.Set(images, '_image_info_cache', {})
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'disk.vmdk')
+            with open(path, 'wb') as image_file:
+                image_file.write('KDMV'.ljust(512, '\0'))
+            self.mox.StubOutWithMock(utils, 'execute')
+            utils.execute('env', 'LC_ALL=C', 'LANG=C', 'qemu-img', 'info',
+                          path).AndReturn(('file format: vmdk', ''))
+            self.mox.ReplayAll()
+            image_info = images.cached_image_info(path)
+            self.assertEquals('vmdk', image_info.file_format)
+            # Cached, qemu-img is only run once
+            self.assertTrue(image_info is images.cached_image_info(path))
+
+    def test_cached_image_info_changed_image(self):
+        self.stubs.Set(images, '_image_info_cache', {})
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'disk')
+            self._write_qcow2(path, 1024 ** 3)
+            image_info = images.cached_image_info(path)
+            self.assertTrue(image_info is images.cached_image_info(path))
+
+            self._write_qcow2(path, 2 * 1024 ** 3, backing_file='base')
+            image_info = images.cached_image_info(path)
+            self.assertEquals(2 * 1024 ** 3, image_info.virtual_size)
+            self.assertEquals(os.path.join(tmpdir, 'base'),
+                              image_info.backing_file)
+
+    def _stub_image_service(self, data, checksum):
+        class FakeImageService(object):
+            def show(self, context, image_id):
+                return {'id': image_id, 'checksum': checksum}
+
+            def download(self, context, image_id, image_file):
+                for offset in xrange(0, len(data), 3):
+                    image_file.write(data[offset:offset + 3])
+
+        self.stubs.Set(glance, 'get_remote_image_service',
+                       lambda context, image_href: (FakeImageService(),
+                                                    image_href))
+
+    def test_fetch_checksums_image(self):
+        data = 'image data' * 10
+        self._stub_image_service(data, hashlib.md5(data).hexdigest())
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image')
+            sha1 = images.fetch(None, 'fake-image', path, None, None)
+            self.assertEquals(hashlib.sha1(data).hexdigest(), sha1)
+            with open(path) as image_file:
+                self.assertEquals(data, image_file.read())
+
+    def test_fetch_bad_checksum(self):
+        self._stub_image_service('image data', 'not the checksum')
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image')
+            self.assertRaises(exception.ImageUnacceptable, images.fetch,
+                              None, 'fake-image', path, None, None)
+            self.assertFalse(os.path.exists(path))
+
+    def test_fetch_to_raw_returns_sha1_of_raw_images(self):
+        data = 'image data'
+        self._stub_image_service(data, None)
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'image')
+            self.mox.StubOutWithMock(utils, 'execute')
+            utils.execute('env', 'LC_ALL=C', 'LANG=C', 'qemu-img', 'info',
+                          path + '.part').AndReturn(('file format: raw', ''))
+            self.mox.ReplayAll()
+            sha1 = images.fetch_to_raw(None, 'fake-image', path, None, None)
+            self.assertEquals(hashlib.sha1(data).hexdigest(), sha1)
+            self.assertTrue(os.path.exists(path))
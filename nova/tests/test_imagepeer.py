@@ -0,0 +1,433 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for distributing base images between compute nodes."""
+
+import cStringIO
+import hashlib
+import httplib
+import os
+
+import webob
+
+from nova.compute import vm_states
+from nova import context
+from nova import db
+from nova import exception
+from nova.image import glance
+from nova.openstack.common import cfg
+from nova.openstack.common import fileutils
+from nova.openstack.common import timeutils
+from nova import servicegroup
+from nova import test
+from nova import utils
+from nova.virt import images
+from nova.virt.libvirt import imagecache
+from nova.virt.libvirt import imagepeer
+from nova.virt.libvirt import utils as libvirt_utils
+
+CONF = cfg.CONF
+
+IMAGE_DATA = 'base image data' * 1000
+IMAGE_MD5 = hashlib.md5(IMAGE_DATA).hexdigest()
+IMAGE_SHA1 = hashlib.sha1(IMAGE_DATA).hexdigest()
+
+
+class FakeImageService(object):
+    def __init__(self):
+        self.shown = []
+        self.checksum = IMAGE_MD5
+
+    def show(self, context, image_id):
+        self.shown.append(image_id)
+        return {'id': image_id, 'checksum': self.checksum}
+
+
+class FakeResponse(object):
+    def __init__(self, status, body='', checksum=None):
+        self.status = status
+        self.body = cStringIO.StringIO(body)
+        self.checksum = checksum
+
+    def getheader(self, name):
+        if name == imagepeer.CHECKSUM_HEADER:
+            return self.checksum
+
+    def read(self, size):
+        return self.body.read(size)
+
+
+class ImagePeerTestCase(test.TestCase):
+    def setUp(self):
+        super(ImagePeerTestCase, self).setUp()
+        self.flags(image_peer_secret='secret')
+        self.flags(use_local=True, group='conductor')
+        self.context = context.get_admin_context()
+        self.image_service = FakeImageService()
+        self.stubs.Set(glance, 'get_remote_image_service',
+                       lambda ctxt, image_id: (self.image_service, image_id))
+        self.image_format = 'raw'
+        self.stubs.Set(images, 'qemu_img_info',
+                       lambda path: images.QemuImgInfo(
+                           'file format: %s' % self.image_format))
+
+    def _base_path(self, tmpdir, filename):
+        self.flags(instances_path=tmpdir)
+        base_dir = os.path.join(tmpdir, CONF.base_dir_name)
+        fileutils.ensure_tree(base_dir)
+        return os.path.join(base_dir, filename)
+
+    def _write_base_image(self, tmpdir, filename, converted=False):
+        path = self._base_path(tmpdir, filename)
+        with open(path, 'w') as f:
+            f.write(IMAGE_DATA)
+        imagecache.write_stored_info(path, field='sha1', value=IMAGE_SHA1)
+        if not converted:
+            imagecache.write_stored_info(path, field='md5', value=IMAGE_MD5)
+        return path
+
+    def _request(self, app, path, headers=None):
+        if headers is None:
+            headers = imagepeer._signature_headers(path.lstrip('/'))
+        request = webob.Request.blank(path)
+        request.headers.update(headers)
+        return request.get_response(app)
+
+    def _stub_peers(self, responses):
+        """Run instances of every image on each host, and answer requests
+        to each host with responses[host].
+        """
+        requests = []
+        self.sent_headers = []
+        sent_headers = self.sent_headers
+
+        class FakeConnection(object):
+            def __init__(self, endpoint, timeout=None):
+                self.host = endpoint.split(':')[0]
+
+            def request(self, method, url, headers=None):
+                requests.append((self.host, url))
+                sent_headers.append(headers)
+
+            def getresponse(self):
+                return responses[self.host]
+
+            def close(self):
+                pass
+
+        def fake_compute_node_get_by_host(context, host):
+            return {'stats': [{'key': imagepeer.ENDPOINT_STAT,
+                               'value': '%s:8786' % host}]}
+
+        self.stubs.Set(httplib, 'HTTPConnection', FakeConnection)
+        self.stubs.Set(db, 'instance_get_all_by_filters',
+                       lambda context, filters, sort_key, sort_dir, limit,
+                              columns_to_join:
+                           [{'host': host} for host in responses])
+        self.stubs.Set(db, 'compute_node_get_by_host',
+                       fake_compute_node_get_by_host)
+        self.stubs.Set(servicegroup.API, 'get_all',
+                       lambda self, topic: list(responses))
+        return requests
+
+    def _create_compute_node(self, host, endpoint=None):
+        service = db.service_create(self.context,
+                                    {'host': host, 'binary': 'nova-compute',
+                                     'topic': CONF.compute_topic,
+                                     'report_count': 0})
+        stats = {}
+        if endpoint:
+            stats[imagepeer.ENDPOINT_STAT] = endpoint
+        db.compute_node_create(self.context,
+                               {'service_id': service['id'], 'vcpus': 1,
+                                'memory_mb': 1, 'local_gb': 1,
+                                'vcpus_used': 0, 'memory_mb_used': 0,
+                                'local_gb_used': 0, 'hypervisor_type': 'qemu',
+                                'hypervisor_version': 1, 'cpu_info': '',
+                                'stats': stats})
+
+    def test_get_stats(self):
+        self.flags(image_peer_host='10.0.0.1', image_peer_port=8786)
+        self.assertEqual(imagepeer.get_stats(), {})
+        self.flags(image_peer_distribution=True)
+        self.assertEqual(imagepeer.get_stats(),
+                         {'image_peer_endpoint': '10.0.0.1:8786'})
+        self.flags(image_peer_secret='')
+        self.assertEqual(imagepeer.get_stats(), {})
+
+    def test_find_peers(self):
+        """Only the published endpoints of the other nodes running
+        instances of the image are found.
+        """
+        self.flags(host='self')
+        self._create_compute_node('self', 'self:8786')
+        self._create_compute_node('peer', 'peer:8786')
+        self._create_compute_node('unpublished')
+        self._create_compute_node('other', 'other:8786')
+        self._create_compute_node('deleted', 'deleted:8786')
+        for host in ('self', 'peer', 'unpublished', 'deleted'):
+            instance = db.instance_create(self.context,
+                                          {'image_ref': 'image',
+                                           'host': host,
+                                           'vm_state': vm_states.ACTIVE})
+        db.instance_destroy(self.context, instance['uuid'])
+        db.instance_create(self.context, {'image_ref': 'other-image',
+                                          'host': 'other',
+                                          'vm_state': vm_states.ACTIVE})
+
+        self.assertEqual(imagepeer._find_peers(self.context, 'image'),
+                         ['peer:8786'])
+        self.assertEqual(imagepeer._find_peers(self.context, 'kernel'), [])
+
+    def test_find_peers_skips_nodes_down(self):
+        self._stub_peers({'up': None, 'down': None})
+        self.stubs.Set(servicegroup.API, 'get_all',
+                       lambda self, topic: ['up'])
+        self.assertEqual(imagepeer._find_peers(self.context, 'image'),
+                         ['up:8786'])
+
+    def test_serves_image_with_checksum(self):
+        with utils.tempdir() as tmpdir:
+            self._write_base_image(tmpdir, 'abc')
+            app = imagepeer.ImagePeerApp()
+            response = self._request(app, '/abc')
+            self.assertEqual(response.status_int, 200)
+            self.assertEqual(response.headers['X-Image-Md5'], IMAGE_MD5)
+            self.assertEqual(response.body, IMAGE_DATA)
+            self.assertEqual(app.uploads, 0)
+
+    def test_unsigned_requests_refused(self):
+        with utils.tempdir() as tmpdir:
+            self._write_base_image(tmpdir, 'abc')
+            app = imagepeer.ImagePeerApp()
+            response = webob.Request.blank('/abc').get_response(app)
+            self.assertEqual(response.status_int, 403)
+            response = self._request(app, '/abc',
+                                     imagepeer._signature_headers('def'))
+            self.assertEqual(response.status_int, 403)
+
+    def test_expired_requests_refused(self):
+        self.useFixture(test.TimeOverride())
+        with utils.tempdir() as tmpdir:
+            self._write_base_image(tmpdir, 'abc')
+            app = imagepeer.ImagePeerApp()
+            headers = imagepeer._signature_headers('abc')
+            self.assertEqual(self._request(app, '/abc', headers).status_int,
+                             200)
+
+            timeutils.advance_time_seconds(61)
+            self.assertEqual(self._request(app, '/abc', headers).status_int,
+                             403)
+            # Signing a later expiry needs the secret
+            headers[imagepeer.EXPIRES_HEADER] = str(
+                timeutils.utcnow_ts() + 60)
+            self.assertEqual(self._request(app, '/abc', headers).status_int,
+                             403)
+
+    def test_requests_refused_without_secret(self):
+        with utils.tempdir() as tmpdir:
+            self._write_base_image(tmpdir, 'abc')
+            app = imagepeer.ImagePeerApp()
+            self.flags(image_peer_secret='')
+            response = self._request(app, '/abc')
+            self.assertEqual(response.status_int, 403)
+
+    def test_server_not_started_without_secret(self):
+        self.flags(image_peer_secret='')
+        self.assertEqual(imagepeer.start_server(), None)
+
+    def test_converted_image_not_served(self):
+        with utils.tempdir() as tmpdir:
+            self._write_base_image(tmpdir, 'abc', converted=True)
+            app = imagepeer.ImagePeerApp()
+            response = self._request(app, '/abc')
+            self.assertEqual(response.status_int, 404)
+
+    def test_only_base_images_served(self):
+        with utils.tempdir() as tmpdir:
+            self._write_base_image(tmpdir, 'abc')
+            fileutils.ensure_tree(os.path.join(tmpdir, 'instance'))
+            with open(os.path.join(tmpdir, 'instance', 'disk'), 'w') as f:
+                f.write(IMAGE_DATA)
+            app = imagepeer.ImagePeerApp()
+            for path in ('/', '/../instance/disk', '/abc.info',
+                         '/.abc'):
+                response = self._request(app, path)
+                self.assertEqual(response.status_int, 404)
+
+    def test_max_uploads(self):
+        self.flags(image_peer_max_uploads=1)
+        with utils.tempdir() as tmpdir:
+            self._write_base_image(tmpdir, 'abc')
+            app = imagepeer.ImagePeerApp()
+            app.uploads = 1
+            response = self._request(app, '/abc')
+            self.assertEqual(response.status_int, 503)
+
+    def test_fetch_from_peers(self):
+        requests = self._stub_peers({
+            'busy': FakeResponse(503),
+            'peer': FakeResponse(200, IMAGE_DATA, IMAGE_MD5)})
+        self.flags(host='self')
+        with utils.tempdir() as tmpdir:
+            target = self._base_path(tmpdir, 'abc')
+            self.assertTrue(imagepeer.fetch_from_peers(
+                    self.context, 'image', target, IMAGE_MD5))
+            with open(target) as f:
+                self.assertEqual(f.read(), IMAGE_DATA)
+            self.assertEqual(imagecache.read_stored_checksum(
+                    target, timestamped=False), IMAGE_SHA1)
+            self.assertEqual(imagecache.read_stored_info(
+                    target, field='md5'), IMAGE_MD5)
+            self.assertFalse(os.path.exists(target + '.part'))
+        self.assertTrue(('peer', '/abc') in requests)
+
+    def test_peer_copy_served_on(self):
+        """An image copied from a peer is served with the checksum glance
+        has for it.
+        """
+        self._stub_peers({'peer': FakeResponse(200, IMAGE_DATA, IMAGE_MD5)})
+        with utils.tempdir() as tmpdir:
+            target = self._base_path(tmpdir, 'abc')
+            self.assertTrue(imagepeer.fetch_from_peers(
+                    self.context, 'image', target, IMAGE_MD5))
+            response = self._request(imagepeer.ImagePeerApp(), '/abc')
+            self.assertEqual(response.status_int, 200)
+            self.assertEqual(response.headers['X-Image-Md5'], IMAGE_MD5)
+
+    def test_fetch_from_peers_checks_glance_checksum(self):
+        """The data is checked against the checksum glance has, not the
+        one the peer sends.
+        """
+        bad_md5 = hashlib.md5('bad').hexdigest()
+        self._stub_peers({
+            'other': FakeResponse(200, 'bad', bad_md5),
+            'liar': FakeResponse(200, 'bad', IMAGE_MD5)})
+        with utils.tempdir() as tmpdir:
+            target = self._base_path(tmpdir, 'abc')
+            self.assertFalse(imagepeer.fetch_from_peers(
+                    self.context, 'image', target, IMAGE_MD5))
+            self.assertEqual(os.listdir(os.path.dirname(target)), [])
+
+    def test_fetch_from_peers_signs_requests(self):
+        self._stub_peers({'peer': FakeResponse(200, IMAGE_DATA, IMAGE_MD5)})
+        with utils.tempdir() as tmpdir:
+            target = self._base_path(tmpdir, 'abc')
+            self.assertTrue(imagepeer.fetch_from_peers(
+                    self.context, 'image', target, IMAGE_MD5))
+        headers = self.sent_headers[0]
+        self.assertEqual(headers['X-Image-Peer-Signature'],
+                         imagepeer._sign('abc',
+                                         headers['X-Image-Peer-Expires']))
+
+    def test_fetch_from_peers_converts_image(self):
+        """Images from peers not forcing raw images are converted."""
+        self.image_format = 'qcow2'
+
+        def fake_convert_image(source, dest, out_format):
+            self.image_format = out_format
+            os.rename(source, dest)
+
+        self.stubs.Set(images, 'convert_image', fake_convert_image)
+        self._stub_peers({'peer': FakeResponse(200, IMAGE_DATA, IMAGE_MD5)})
+        with utils.tempdir() as tmpdir:
+            target = self._base_path(tmpdir, 'abc')
+            self.assertTrue(imagepeer.fetch_from_peers(
+                    self.context, 'image', target, IMAGE_MD5))
+            self.assertEqual(self.image_format, 'raw')
+            self.assertTrue(os.path.exists(target))
+            # It no longer matches the checksum glance has
+            self.assertEqual(imagecache.read_stored_info(
+                    target, field='md5'), None)
+
+    def test_fetch_from_peers_rejects_backing_file(self):
+        self.stubs.Set(images, 'qemu_img_info',
+                       lambda path: images.QemuImgInfo(
+                           'file format: qcow2\nbacking file: /etc/shadow'))
+        self._stub_peers({'peer': FakeResponse(200, IMAGE_DATA, IMAGE_MD5)})
+        with utils.tempdir() as tmpdir:
+            target = self._base_path(tmpdir, 'abc')
+            self.assertRaises(exception.ImageUnacceptable,
+                              imagepeer.fetch_from_peers, self.context,
+                              'image', target, IMAGE_MD5)
+            self.assertEqual(os.listdir(os.path.dirname(target)), [])
+
+    def test_fetch_from_peers_needs_secret(self):
+        self.flags(image_peer_secret='')
+        requests = self._stub_peers({
+            'peer': FakeResponse(200, IMAGE_DATA, IMAGE_MD5)})
+        with utils.tempdir() as tmpdir:
+            target = self._base_path(tmpdir, 'abc')
+            self.assertFalse(imagepeer.fetch_from_peers(
+                    self.context, 'image', target, IMAGE_MD5))
+        self.assertEqual(requests, [])
+
+    def test_fetch_from_peers_skips_self_and_limits_tries(self):
+        self.flags(host='self', image_peer_max_tries=2)
+        requests = self._stub_peers(dict(
+                (host, FakeResponse(404))
+                for host in ('self', 'peer1', 'peer2', 'peer3')))
+        with utils.tempdir() as tmpdir:
+            target = self._base_path(tmpdir, 'abc')
+            self.assertFalse(imagepeer.fetch_from_peers(
+                    self.context, 'image', target, IMAGE_MD5))
+        self.assertEqual(len(requests), 2)
+        self.assertFalse('self' in [host for host, url in requests])
+
+    def _fetch_image(self, tmpdir, converted=False):
+        def fake_fetch_to_raw(context, image_id, target, user_id,
+                              project_id):
+            with open(target, 'w') as f:
+                f.write(IMAGE_DATA)
+            if not converted:
+                return IMAGE_SHA1
+
+        self.stubs.Set(images, 'fetch_to_raw', fake_fetch_to_raw)
+        target = self._base_path(tmpdir, 'abc')
+        libvirt_utils.fetch_image(self.context, target, 'image',
+                                  'user', 'project')
+        return target
+
+    def test_fetch_image_falls_back_to_glance(self):
+        self.flags(image_peer_distribution=True)
+        requests = self._stub_peers({'peer': FakeResponse(404)})
+        with utils.tempdir() as tmpdir:
+            target = self._fetch_image(tmpdir)
+            self.assertEqual(imagecache.read_stored_info(
+                    target, field='md5'), IMAGE_MD5)
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(self.image_service.shown, ['image'])
+
+    def test_fetch_image_converted_not_served(self):
+        self.flags(image_peer_distribution=True)
+        self._stub_peers({'peer': FakeResponse(404)})
+        with utils.tempdir() as tmpdir:
+            target = self._fetch_image(tmpdir, converted=True)
+            self.assertEqual(imagecache.read_stored_info(
+                    target, field='md5'), None)
+
+    def test_fetch_image_without_glance_checksum(self):
+        """Peers are not asked for images glance has no checksum for."""
+        self.flags(image_peer_distribution=True)
+        self.image_service.checksum = None
+        requests = self._stub_peers({
+            'peer': FakeResponse(200, IMAGE_DATA, IMAGE_MD5)})
+        with utils.tempdir() as tmpdir:
+            target = self._fetch_image(tmpdir)
+            self.assertEqual(imagecache.read_stored_info(
+                    target, field='md5'), None)
+        self.assertEqual(requests, [])
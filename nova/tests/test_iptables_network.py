@@ -18,6 +18,7 @@
 """Unit Tests for network code."""
 
 from nova.network import linux_net
+from nova.openstack.common import timeutils
 from nova import test
 
 
@@ -170,3 +171,93 @@ class IptablesManagerTestCase(test.TestCase):
             self.assertTrue('[0:0] -A %s -j %s-%s' %
                             (chain, self.binary_name, chain) in new_lines,
                             "Built-in chain %s not wrapped" % (chain,))
+
+
+class IptablesIncrementalApplyTestCase(test.TestCase):
+
+    def setUp(self):
+        super(IptablesIncrementalApplyTestCase, self).setUp()
+        self.flags(iptables_incremental_apply=True, use_ipv6=False)
+        self.useFixture(test.TimeOverride())
+        self.stubs.Set(linux_net, 'binary_name', 'test')
+        self.executes = []
+        self.inputs = []
+        self.manager = linux_net.IptablesManager(execute=self.fake_execute)
+
+    def fake_execute(self, *args, **kwargs):
+        self.executes.append(args)
+        self.inputs.append(kwargs.get('process_input'))
+        return '', ''
+
+    def _apply(self):
+        self.executes = []
+        self.inputs = []
+        self.manager.apply()
+
+    def test_first_apply_is_full(self):
+        self._apply()
+        self.assertEqual(self.executes,
+                         [('iptables-save', '-c', '-t', 'filter'),
+                          ('iptables-restore', '-c'),
+                          ('iptables-save', '-c', '-t', 'nat'),
+                          ('iptables-restore', '-c')])
+
+    def test_only_changed_chains_are_restored(self):
+        self._apply()
+        self.manager.ipv4['filter'].add_rule('FORWARD', '-s 1.2.3.4 -j DROP')
+        self._apply()
+
+        self.assertEqual(self.executes,
+                         [('iptables-restore', '-c', '--noflush')])
+        lines = self.inputs[0].split('\n')
+        self.assertEqual(lines[0], '*filter')
+        self.assertTrue(':test-FORWARD - [0:0]' in lines)
+        self.assertTrue('[0:0] -A test-FORWARD -s 1.2.3.4 -j DROP' in lines)
+        self.assertFalse(':test-INPUT - [0:0]' in lines)
+        self.assertEqual(lines[-2:], ['COMMIT', ''])
+
+        # Nothing changed since the last apply
+        self._apply()
+        self.assertEqual(self.executes, [])
+
+        # Adding and removing a rule leaves the chain as applied
+        table = self.manager.ipv4['filter']
+        table.add_rule('FORWARD', '-s 5.6.7.8 -j DROP')
+        table.remove_rule('FORWARD', '-s 5.6.7.8 -j DROP')
+        self._apply()
+        self.assertEqual(self.executes, [])
+
+    def test_removed_chain_is_deleted(self):
+        table = self.manager.ipv4['nat']
+        table.add_chain('extra')
+        table.add_rule('snat', '-j $extra')
+        self._apply()
+        table.remove_chain('extra')
+        self._apply()
+
+        self.assertEqual(self.executes,
+                         [('iptables-restore', '-c', '--noflush')])
+        lines = self.inputs[0].split('\n')
+        self.assertTrue(':test-snat - [0:0]' in lines)
+        self.assertFalse('[0:0] -A test-snat -j test-extra' in lines)
+        self.assertTrue(lines.index('-X test-extra') >
+                        lines.index(':test-snat - [0:0]'))
+
+    def test_unwrapped_chain_change_is_full(self):
+        self._apply()
+        self.manager.ipv4['filter'].add_rule('nova-filter-top',
+                                             '-s 1.2.3.4 -j DROP',
+                                             wrap=False)
+        self._apply()
+        self.assertEqual(self.executes,
+                         [('iptables-save', '-c', '-t', 'filter'),
+                          ('iptables-restore', '-c')])
+
+    def test_full_apply_interval(self):
+        self.flags(iptables_full_apply_interval=60)
+        self._apply()
+        timeutils.advance_time_seconds(61)
+        self._apply()
+        self.assertEqual(len(self.executes), 4)
+        self.assertEqual(self.executes[0], ('iptables-save', '-c',
+                                            '-t', 'filter'))
@@ -57,6 +57,7 @@ from nova.virt.libvirt import config as vconfig
 from nova.virt.libvirt import driver as libvirt_driver
 from nova.virt.libvirt import firewall
 from nova.virt.libvirt import imagebackend
+from nova.virt.libvirt import imagecache
 from nova.virt.libvirt import snapshots
 from nova.virt.libvirt import utils as libvirt_utils
 from nova.virt.libvirt import volume
@@ -1095,6 +1096,94 @@ class LibvirtConnTestCase(test.TestCase):
         # None should be listed, since we fake deleted the last one
         self.assertEquals(len(instances), 0)
 
+    def test_get_all_power_states(self):
+        running = FakeVirtDomain()
+        running.name = lambda: 'running'
+        running.info = lambda: [libvirt_driver.VIR_DOMAIN_RUNNING,
+                                2048, 2048, 1, 0]
+
+        def fake_lookup(domain_id):
+            if domain_id == 2:
+                raise libvirt.libvirtError("we deleted an instance!")
+            return running
+
+        self.mox.StubOutWithMock(libvirt_driver.LibvirtDriver, '_conn')
+        libvirt_driver.LibvirtDriver._conn.lookupByID = fake_lookup
+        libvirt_driver.LibvirtDriver._conn.numOfDomains = lambda: 3
+        libvirt_driver.LibvirtDriver._conn.listDomainsID = lambda: [0, 1, 2]
+        libvirt_driver.LibvirtDriver._conn.listDefinedDomains = (
+            lambda: ['stopped'])
+
+        self.mox.ReplayAll()
+        conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+        self.assertEqual(conn.get_all_power_states(),
+                         {'running': power_state.RUNNING,
+                          'stopped': power_state.SHUTDOWN})
+
+    def test_get_available_resource_looks_up_domains_once(self):
+        xml = """
+            <domain type='kvm'>
+                <devices>
+                    <disk type='file'>
+                        <driver name='qemu' type='raw'/>
+                        <source file='/test/disk'/>
+                    </disk>
+                </devices>
+            </domain>
+        """
+        calls = []
+
+        def make_domain(domain_id):
+            domain = FakeVirtDomain(xml)
+            domain.name = lambda: 'instance-%d' % domain_id
+            domain.info = lambda: [libvirt_driver.VIR_DOMAIN_RUNNING,
+                                   2048, 2048, 2, 0]
+            domain.vcpus = lambda: ([], [True, True])
+
+            def fake_xml_desc(flags):
+                calls.append(('XMLDesc', domain_id))
+                return xml
+            domain.XMLDesc = fake_xml_desc
+            return domain
+
+        def fake_lookup(domain_id):
+            calls.append(('lookupByID', domain_id))
+            if domain_id == 3:
+                raise libvirt.libvirtError("we deleted an instance!")
+            return make_domain(domain_id)
+
+        self.mox.StubOutWithMock(libvirt_driver.LibvirtDriver, '_conn')
+        libvirt_driver.LibvirtDriver._conn.lookupByID = fake_lookup
+        libvirt_driver.LibvirtDriver._conn.numOfDomains = lambda: 3
+        libvirt_driver.LibvirtDriver._conn.listDomainsID = lambda: [1, 2, 3]
+        self.mox.StubOutWithMock(os.path, 'getsize')
+        os.path.getsize('/test/disk').MultipleTimes().AndReturn(1024)
+
+        self.mox.ReplayAll()
+        conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+
+        def returns(value):
+            return lambda *args, **kwargs: value
+
+        for name, value in (('get_vcpu_total', 8),
+                            ('get_memory_mb_total', 8192),
+                            ('get_memory_mb_used', 4096),
+                            ('get_hypervisor_type', 'QEMU'),
+                            ('get_hypervisor_version', 13091),
+                            ('get_hypervisor_hostname', 'compute1'),
+                            ('get_cpu_info', '{}')):
+            self.stubs.Set(conn, name, returns(value))
+        resources = conn.get_available_resource(None)
+
+        self.assertEqual(resources['vcpus_used'], 4)
+        self.assertEqual(sorted(calls),
+                         [('XMLDesc', 1), ('XMLDesc', 2),
+                          ('lookupByID', 1), ('lookupByID', 2),
+                          ('lookupByID', 3)])
+        self.assertEqual(conn.resource_stats['domains'], 2)
+        for name in ('inventory_time', 'disk_time', 'total_time'):
+            self.assertTrue(name in conn.resource_stats)
+
     def test_get_all_block_devices(self):
         xml = [
             # NOTE(vish): id 0 is skipped
@@ -3454,6 +3543,309 @@ class IptablesFirewallTestCase(test.TestCase):
         self.fw.instances[instance_ref['id']] = instance_ref
         self.fw.do_refresh_security_group_rules("fake")
 
+    def _stub_refreshes(self):
+        refreshed = []
+        applies = []
+        timers = []
+
+        class FakeTimer(object):
+            def cancel(self):
+                pass
+
+        def fake_spawn_after(seconds, func):
+            timers.append((seconds, func))
+            return FakeTimer()
+
+        self.stubs.Set(base_firewall.greenthread, 'spawn_after',
+                       fake_spawn_after)
+        self.stubs.Set(self.fw, 'do_refresh_instance_rules',
+                       lambda instance: refreshed.append(instance['id']))
+        self.stubs.Set(self.fw, 'do_refresh_security_group_rules',
+                       lambda security_group: refreshed.append('all'))
+        self.stubs.Set(self.fw.iptables, 'apply',
+                       lambda: applies.append(True))
+        self.fw.instances = {1: {'id': 1}, 2: {'id': 2}}
+        return refreshed, applies, timers
+
+    def test_refresh_security_group_without_delay(self):
+        refreshed, applies, timers = self._stub_refreshes()
+        self.fw.refresh_security_group_rules(1)
+        self.fw.refresh_security_group_members(2)
+        self.assertEqual(refreshed, ['all', 'all'])
+        self.assertEqual(len(applies), 2)
+        self.assertEqual(timers, [])
+        self.assertEqual(self.fw.refresh_stats,
+                         dict(requests=2, merged=0, applies=2))
+
+    def test_refresh_security_group_merges_refreshes(self):
+        self.flags(firewall_refresh_delay=0.5)
+        refreshed, applies, timers = self._stub_refreshes()
+        for security_group in (1, 2, 1):
+            self.fw.refresh_security_group_rules(security_group)
+        self.fw.refresh_security_group_members(3)
+        self.assertEqual(refreshed, [])
+        self.assertEqual(applies, [])
+        self.assertEqual(len(timers), 1)
+        self.assertEqual(timers[0][0], 0.5)
+
+        timers[0][1]()
+        self.assertEqual(sorted(refreshed), [1, 2])
+        self.assertEqual(len(applies), 1)
+        self.assertEqual(self.fw.refresh_stats,
+                         dict(requests=4, merged=3, applies=1))
+
+        # Nothing is left to flush, and the next refresh starts a new timer
+        self.fw.flush_refreshes()
+        self.assertEqual(len(applies), 1)
+        self.fw.refresh_security_group_rules(1)
+        self.assertEqual(len(timers), 2)
+
+    def test_refresh_instance_without_delay(self):
+        refreshed, applies, timers = self._stub_refreshes()
+        self.fw.refresh_instance_security_rules({'id': 1})
+        self.assertEqual(refreshed, [1])
+        self.assertEqual(len(applies), 1)
+        self.assertEqual(timers, [])
+
+    def test_refresh_instance_merges_refreshes(self):
+        self.flags(firewall_refresh_delay=0.5)
+        refreshed, applies, timers = self._stub_refreshes()
+        self.fw.instances[3] = {'id': 3}
+        for instance_id in (1, 2, 1, 1):
+            self.fw.refresh_instance_security_rules({'id': instance_id})
+        # Not filtered here (any more)
+        self.fw.refresh_instance_security_rules({'id': 4})
+        self.assertEqual(refreshed, [])
+        self.assertEqual(applies, [])
+        self.assertEqual(len(timers), 1)
+
+        timers[0][1]()
+        self.assertEqual(sorted(refreshed), [1, 2])
+        self.assertEqual(len(applies), 1)
+        self.assertEqual(self.fw.refresh_stats,
+                         dict(requests=5, merged=4, applies=1))
+
+    def test_refresh_instance_merges_with_security_group_refreshes(self):
+        self.flags(firewall_refresh_delay=0.5)
+        refreshed, applies, timers = self._stub_refreshes()
+        self.fw.refresh_instance_security_rules({'id': 1})
+        self.fw.refresh_security_group_members(3)
+        self.fw.refresh_instance_security_rules({'id': 2})
+        self.assertEqual(len(timers), 1)
+
+        timers[0][1]()
+        self.assertEqual(sorted(refreshed), [1, 2])
+        self.assertEqual(len(applies), 1)
+
+    def test_failed_refreshes_are_logged_and_retried(self):
+        self.flags(firewall_refresh_delay=0.5)
+        refreshed, applies, timers = self._stub_refreshes()
+        failures = []
+
+        def fake_apply():
+            if not failures:
+                failures.append(True)
+                raise test.TestingException()
+            applies.append(True)
+
+        self.stubs.Set(self.fw.iptables, 'apply', fake_apply)
+        logged = []
+        self.stubs.Set(base_firewall.LOG, 'exception',
+                       lambda *args, **kwargs: logged.append(args))
+        self.fw.refresh_instance_security_rules({'id': 1})
+
+        # The timer logs the failure instead of losing it
+        timers[0][1]()
+        self.assertEqual(len(logged), 1)
+        self.assertEqual(applies, [])
+
+        # The failed refresh is retried with the next one
+        self.fw.refresh_instance_security_rules({'id': 2})
+        self.assertEqual(len(timers), 2)
+        timers[1][1]()
+        self.assertEqual(refreshed, [1, 1, 2])
+        self.assertEqual(len(applies), 1)
+        self.assertEqual(len(logged), 1)
+
+    def _stub_security_group_rules(self, rules):
+        """rules is a dict of the rules of each security group."""
+        lookups = []
+
+        def fake_get_by_instance(ctxt, instance):
+            return [{'id': security_group_id}
+                    for security_group_id in sorted(rules)]
+
+        def fake_rule_get(ctxt, security_group):
+            lookups.append(security_group['id'])
+            return rules[security_group['id']]
+
+        self.stubs.Set(self.fw._virtapi, 'security_group_get_by_instance',
+                       fake_get_by_instance)
+        self.stubs.Set(self.fw._virtapi,
+                       'security_group_rule_get_by_security_group',
+                       fake_rule_get)
+        return lookups
+
+    def test_instance_rules_share_compiled_security_group_rules(self):
+        lookups = self._stub_security_group_rules({1: [
+            {'cidr': '10.0.0.0/8', 'protocol': 'TCP', 'from_port': 22,
+             'to_port': 22, 'grantee_group': None}]})
+        network_info = _fake_network_info(self.stubs, 1)
+        first = self.fw.instance_rules({'id': 1}, network_info)
+        second = self.fw.instance_rules({'id': 2}, network_info)
+        self.assertEqual(first, second)
+        self.assertTrue('-j ACCEPT -p tcp --dport 22 -s 10.0.0.0/8'
+                        in first[0])
+        self.assertEqual(lookups, [1])
+        self.assertEqual(self.fw.compiled_rules_stats,
+                         dict(hits=1, misses=1))
+
+    def test_refresh_security_group_rules_invalidates_compiled_rules(self):
+        self._stub_refreshes()
+        lookups = self._stub_security_group_rules({1: [], 2: []})
+        ctxt = context.get_admin_context()
+        self.fw._security_group_rules(ctxt, {'id': 1})
+        self.fw._security_group_rules(ctxt, {'id': 2})
+        self.fw.refresh_security_group_rules(1)
+        self.fw._security_group_rules(ctxt, {'id': 1})
+        self.fw._security_group_rules(ctxt, {'id': 2})
+        self.assertEqual(lookups, [1, 2, 1])
+
+    def test_refresh_instance_invalidates_its_compiled_rules(self):
+        self._stub_refreshes()
+        lookups = self._stub_security_group_rules({
+            1: [{'cidr': None, 'protocol': None,
+                 'grantee_group': {'instances': []}}],
+            2: [{'cidr': '10.0.0.0/8', 'protocol': None,
+                 'grantee_group': None}]})
+        ctxt = context.get_admin_context()
+        self.fw._security_group_rules(ctxt, {'id': 1})
+        self.fw._security_group_rules(ctxt, {'id': 2})
+        self.fw._instance_security_groups[1] = set([1])
+        self.fw.refresh_instance_security_rules({'id': 1})
+        self.fw._security_group_rules(ctxt, {'id': 1})
+        self.fw._security_group_rules(ctxt, {'id': 2})
+        self.assertEqual(lookups, [1, 2, 1])
+
+        # The groups of an instance not filtered yet are not known
+        self.fw.refresh_instance_security_rules({'id': 2})
+        self.fw._security_group_rules(ctxt, {'id': 1})
+        self.fw._security_group_rules(ctxt, {'id': 2})
+        self.assertEqual(lookups, [1, 2, 1, 1, 2])
+
+    def test_refresh_instances_in_a_group_compiles_rules_once(self):
+        self.flags(firewall_refresh_delay=0.5)
+        lookups = self._stub_security_group_rules({1: []})
+        self.stubs.Set(self.fw, '_inner_do_refresh_rules',
+                       lambda *args: None)
+        self.stubs.Set(self.fw.iptables, 'apply', lambda: None)
+        network_info = _fake_network_info(self.stubs, 1)
+        self.fw.instances = {1: {'id': 1}, 2: {'id': 2}}
+        self.fw.network_infos = {1: network_info, 2: network_info}
+        self.fw.instance_rules({'id': 1}, network_info)
+        self.fw.instance_rules({'id': 2}, network_info)
+        self.assertEqual(lookups, [1])
+
+        # As the compute API does for each instance in a group whose
+        # rules changed
+        self.fw.refresh_instance_security_rules({'id': 1})
+        self.fw.refresh_instance_security_rules({'id': 2})
+        self.fw.flush_refreshes()
+        self.assertEqual(lookups, [1, 1])
+        self.assertEqual(self.fw.compiled_rules_stats,
+                         dict(hits=2, misses=2))
+
+    def test_rules_invalidated_while_compiled_are_not_kept(self):
+        lookups = self._stub_security_group_rules({1: []})
+        get_rules = self.fw._virtapi.security_group_rule_get_by_security_group
+
+        def fake_rule_get(ctxt, security_group):
+            # e.g. a refresh arriving while the rules are read
+            self.fw.invalidate_security_group_rules()
+            return get_rules(ctxt, security_group)
+
+        self.stubs.Set(self.fw._virtapi,
+                       'security_group_rule_get_by_security_group',
+                       fake_rule_get)
+        ctxt = context.get_admin_context()
+        self.fw._security_group_rules(ctxt, {'id': 1})
+        self.assertEqual(self.fw._compiled_rules, {})
+        self.assertEqual(lookups, [1])
+
+    def test_compiled_rules_pruned_for_unused_security_groups(self):
+        self._stub_security_group_rules({1: [], 2: []})
+        self.stubs.Set(self.fw, '_inner_do_refresh_rules',
+                       lambda *args: None)
+        self.stubs.Set(self.fw, 'remove_filters_for_instance',
+                       lambda instance: None)
+        self.stubs.Set(self.fw.nwfilter, 'unfilter_instance',
+                       lambda instance, network_info: None)
+        self.stubs.Set(self.fw.iptables, 'apply', lambda: None)
+        network_info = _fake_network_info(self.stubs, 1)
+        self.fw.instances = {1: {'id': 1}}
+        self.fw.network_infos = {1: network_info}
+        self.fw.instance_rules({'id': 1}, network_info)
+        self.assertEqual(sorted(key[1] for key in self.fw._compiled_rules),
+                         [1, 2])
+
+        # Group 2 was deleted, after the instance left it
+        self._stub_security_group_rules({1: []})
+        self.fw.refresh_security_group_rules(2)
+        self.assertEqual([key[1] for key in self.fw._compiled_rules], [1])
+        self.assertEqual(self.fw._security_group_revisions, {})
+
+        self.fw.unfilter_instance({'id': 1}, network_info)
+        self.assertEqual(self.fw._compiled_rules, {})
+
+    def test_refresh_instance_applies_revoked_cidr_rule(self):
+        admin_ctxt = context.get_admin_context()
+        instance_ref = self._create_instance_ref()
+        other_instance_ref = self._create_instance_ref()
+        secgroup = db.security_group_create(admin_ctxt,
+                                            {'user_id': 'fake',
+                                             'project_id': 'fake',
+                                             'name': 'testgroup',
+                                             'description': 'test group'})
+        rule = db.security_group_rule_create(admin_ctxt,
+                {'parent_group_id': secgroup['id'],
+                 'protocol': 'tcp',
+                 'from_port': 22,
+                 'to_port': 22,
+                 'cidr': '192.168.99.0/24'})
+        db.instance_add_security_group(admin_ctxt, instance_ref['uuid'],
+                                       secgroup['id'])
+        db.instance_add_security_group(admin_ctxt,
+                                       other_instance_ref['uuid'],
+                                       secgroup['id'])
+
+        def fake_iptables_execute(*cmd, **kwargs):
+            if cmd == ('iptables-restore', '-c'):
+                lines = kwargs['process_input'].split('\n')
+                if '*filter' in lines:
+                    self.out_rules = lines
+            elif cmd == ('iptables-save', '-c', '-t', 'filter'):
+                return '\n'.join(self.in_filter_rules), None
+            elif cmd == ('iptables-save', '-c', '-t', 'nat'):
+                return '\n'.join(self.in_nat_rules), None
+            elif cmd == ('ip6tables-save', '-c', '-t', 'filter'):
+                return '\n'.join(self.in6_filter_rules), None
+            return '', ''
+
+        self.stubs.Set(self.fw.iptables, 'execute', fake_iptables_execute)
+        network_info = _fake_network_info(self.stubs, 1)
+        self.fw.prepare_instance_filter(instance_ref, network_info)
+        self.fw.prepare_instance_filter(other_instance_ref, network_info)
+        regex = re.compile('\[0\:0\] -A .* -j ACCEPT -p tcp --dport 22 '
+                           '-s 192.168.99.0/24')
+        self.assertEqual(len(filter(regex.match, self.out_rules)), 2)
+
+        # As compute API does when a rule is revoked
+        db.security_group_rule_destroy(admin_ctxt, rule['id'])
+        self.fw.refresh_instance_security_rules(instance_ref)
+        self.assertEqual(len(filter(regex.match, self.out_rules)), 1)
+        self.fw.refresh_instance_security_rules(other_instance_ref)
+        self.assertEqual(len(filter(regex.match, self.out_rules)), 0)
+
     def test_unfilter_instance_undefines_nwfilter(self):
         admin_ctxt = context.get_admin_context()
 
@@ -3901,6 +4293,18 @@ disk size: 4.4M''', ''))
         libvirt_utils.fetch_image(context, target, image_id,
                                   user_id, project_id)
 
+    def test_fetch_image_stores_checksum(self):
+        self.flags(checksum_base_images=True, instances_path='/instances')
+        target = '/instances/_base/c0ffee'
+        self.mox.StubOutWithMock(images, 'fetch_to_raw')
+        images.fetch_to_raw('ctxt', '4', target, 'fake',
+                            'fake').AndReturn('da39a3ee')
+        self.mox.StubOutWithMock(imagecache, 'write_stored_info')
+        imagecache.write_stored_info(target, field='sha1', value='da39a3ee')
+
+        self.mox.ReplayAll()
+        libvirt_utils.fetch_image('ctxt', target, '4', 'fake', 'fake')
+
     def test_get_disk_backing_file(self):
         with_actual_path = False
 
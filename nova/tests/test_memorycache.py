@@ -0,0 +1,96 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the in-process memcache client."""
+
+from nova.common import memorycache
+from nova.openstack.common import timeutils
+from nova import test
+
+
+class MemorycacheTestCase(test.TestCase):
+    def setUp(self):
+        super(MemorycacheTestCase, self).setUp()
+        self.useFixture(test.TimeOverride())
+        self.client = memorycache.Client([], debug=0, max_items=3)
+
+    def test_get_set(self):
+        self.assertEqual(self.client.get('foo'), None)
+        self.assertTrue(self.client.set('foo', 'bar'))
+        self.assertEqual(self.client.get('foo'), 'bar')
+        self.assertEqual(self.client.stats['hits'], 1)
+        self.assertEqual(self.client.stats['misses'], 1)
+
+    def test_add(self):
+        self.assertTrue(self.client.add('foo', 'bar'))
+        self.assertFalse(self.client.add('foo', 'baz'))
+        self.assertEqual(self.client.get('foo'), 'bar')
+
+    def test_incr(self):
+        self.assertEqual(self.client.incr('foo'), None)
+        self.client.set('foo', '1', time=10)
+        self.assertEqual(self.client.incr('foo', 2), 3)
+        self.assertEqual(self.client.get('foo'), '3')
+        timeutils.advance_time_seconds(10)
+        self.assertEqual(self.client.get('foo'), None)
+
+    def test_delete(self):
+        self.client.set('foo', 'bar')
+        self.assertTrue(self.client.delete('foo'))
+        self.assertFalse(self.client.delete('foo'))
+        self.assertEqual(self.client.get('foo'), None)
+
+    def test_expire(self):
+        self.client.set('foo', 'bar', time=10)
+        self.client.set('baz', 'qux', time=20)
+        timeutils.advance_time_seconds(9)
+        self.assertEqual(self.client.get('foo'), 'bar')
+        timeutils.advance_time_seconds(1)
+        self.assertEqual(self.client.get('foo'), None)
+        self.assertEqual(self.client.get('baz'), 'qux')
+        self.assertEqual(self.client.stats['expirations'], 1)
+
+    def test_set_again_resets_timeout(self):
+        self.client.set('foo', 'bar', time=10)
+        self.client.set('foo', 'baz', time=30)
+        timeutils.advance_time_seconds(20)
+        self.assertEqual(self.client.get('foo'), 'baz')
+        self.client.set('foo', 'qux')
+        timeutils.advance_time_seconds(20)
+        self.assertEqual(self.client.get('foo'), 'qux')
+        self.assertEqual(self.client.stats['expirations'], 0)
+
+    def test_evict_least_recently_used(self):
+        self.client.set('a', 1)
+        self.client.set('b', 2)
+        self.client.set('c', 3)
+        self.client.get('a')
+        self.client.set('d', 4)
+
+        self.assertEqual(self.client.get('b'), None)
+        self.assertEqual(self.client.get('a'), 1)
+        self.assertEqual(self.client.get('c'), 3)
+        self.assertEqual(self.client.get('d'), 4)
+        self.assertEqual(self.client.stats['evictions'], 1)
+
+    def test_many_keys(self):
+        for i in xrange(1000):
+            self.client.set(str(i), i, time=i % 7 + 1)
+            self.assertEqual(self.client.get(str(i)), i)
+        self.assertEqual(len(self.client.cache), 3)
+        self.assertTrue(len(self.client._timeouts) <= 2 * 3 + 65)
+        self.assertTrue(len(self.client._uses) <= 2 * 3 + 65)
@@ -228,6 +228,37 @@ class MetadataTestCase(test.TestCase):
         self.assertRaises(base.InvalidMetadataPath,
             md.lookup, "/2009-04-04/meta-data/kernel-id")
 
+    def test_get_metadata_by_addresses(self):
+        inst = copy(self.instance)
+        inst['security_groups'] = [{'name': 'group1'}]
+        inst['block_device_mapping'] = [{'device_name': '/dev/sdb',
+                                         'snapshot_id': None,
+                                         'volume_id': 'fake-volume',
+                                         'virtual_name': None,
+                                         'no_device': None}]
+
+        def fake_get_all_by_addresses(context, addresses):
+            self.assertEqual(addresses, ['10.0.0.1'])
+            return {'10.0.0.1': (inst, 'zone1')}
+
+        def fail(*args, **kwargs):
+            self.fail('unexpected query')
+
+        self.stubs.Set(db, 'instance_get_all_by_fixed_ip_addresses',
+                       fake_get_all_by_addresses)
+        self.stubs.Set(api, 'service_get_all_by_host', fail)
+        self.stubs.Set(api, 'security_group_get_by_instance', fail)
+        self.stubs.Set(api, 'block_device_mapping_get_all_by_instance', fail)
+        self.stubs.Set(network_api.API, 'get_instance_nw_info', fail)
+
+        md = base.get_metadata_by_address('10.0.0.1')
+        self.assertEqual(md.address, '10.0.0.1')
+        self.assertEqual(md.availability_zone, 'zone1')
+        self.assertEqual(md.security_groups, [{'name': 'group1'}])
+        data = md.get_ec2_metadata(version='2009-04-04')
+        self.assertEqual(data['meta-data']['block-device-mapping']['ebs0'],
+                         '/dev/sdb')
+
     def test_check_version(self):
         inst = copy(self.instance)
         md = fake_InstanceMetadata(self.stubs, inst)
@@ -434,6 +465,123 @@ class MetadataHandlerTestCase(test.TestCase):
                                 headers=None)
         self.assertEqual(response.status_int, 500)
 
+    def test_render(self):
+        self.mdinst.render()
+        paths = ["/ec2", "/latest", "/2009-04-04/meta-data/",
+                 "/latest/meta-data/hostname",
+                 "/latest/meta-data/public-keys/0/openssh-key",
+                 "/latest/meta-data/block-device-mapping/ami",
+                 "/latest/user-data", "/openstack",
+                 "/openstack/latest/meta_data.json",
+                 "/openstack/2012-08-10/user_data"]
+        for path in paths:
+            path_tokens = self.mdinst._get_path_tokens(path)
+            self.assertEqual(self.mdinst.rendered["/" + "/".join(path_tokens)],
+                             base.ec2_md_print(self.mdinst.lookup(path)))
+
+        # Callables are not rendered
+        self.assertEqual(self.mdinst.lookup_rendered(
+                "/openstack/latest/password"), password.handle_password)
+        self.assertRaises(base.InvalidMetadataPath,
+                          self.mdinst.lookup_rendered, "/latest/foo")
+
+    def test_prerender(self):
+        self.flags(metadata_prerender=True)
+        self.mdinst.render()
+
+        def fake_lookup(path):
+            raise Exception("lookup called for %s" % path)
+
+        self.stubs.Set(self.mdinst, 'lookup', fake_lookup)
+        response = fake_request(self.stubs, self.mdinst,
+                                "/2009-04-04/meta-data/local-hostname")
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.body, self.mdinst._get_hostname())
+
+    def test_warm_cache(self):
+        cached = {}
+
+        class FakeClient(object):
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def set(self, key, value, time=0):
+                cached[key] = (value, time)
+
+        def fake_get_metadata_by_addresses(addresses):
+            return dict((address, fake_InstanceMetadata(self.stubs,
+                                                        self.instance,
+                                                        address))
+                        for address in addresses)
+
+        self.flags(memcached_servers=['fake'], metadata_prerender=True)
+        self.stubs.Set(handler.memcache, 'Client', FakeClient)
+        self.stubs.Set(base, 'get_metadata_by_addresses',
+                       fake_get_metadata_by_addresses)
+        handler.warm_cache(['10.0.0.2'])
+
+        meta_data, expiration = cached['metadata-10.0.0.2']
+        self.assertEqual(expiration, CONF.metadata_warm_cache_expiration)
+        self.assertEqual(meta_data.address, '10.0.0.2')
+        self.assertEqual(meta_data.rendered['/ec2/latest/meta-data/'
+                                            'local-ipv4'], '10.0.0.2')
+
+    def test_warm_cache_without_memcached_servers(self):
+        self.stubs.Set(base, 'get_metadata_by_addresses', None)
+        handler.warm_cache(['10.0.0.2'])
+
+    def test_boot_storm(self):
+        """Serve the requests cloud-init makes as several instances boot."""
+        num_instances = 5
+        paths = ["/latest/meta-data/", "/latest/meta-data/instance-id",
+                 "/latest/meta-data/hostname",
+                 "/latest/meta-data/local-hostname",
+                 "/latest/meta-data/public-keys/",
+                 "/latest/meta-data/public-keys/0/openssh-key",
+                 "/latest/meta-data/block-device-mapping/",
+                 "/latest/meta-data/placement/availability-zone",
+                 "/latest/user-data", "/openstack/latest/meta_data.json"]
+        mdinsts = {}
+        for i in xrange(num_instances):
+            inst = copy(self.instance)
+            inst['uuid'] = 'b65cee2f-8c69-4aeb-be2f-%012d' % i
+            mdinsts['10.0.0.%d' % i] = fake_InstanceMetadata(self.stubs,
+                                                             inst)
+
+        lookups = []
+        orig_lookup = base.InstanceMetadata.lookup
+
+        def counting_lookup(mdinst, path):
+            lookups.append(path)
+            return orig_lookup(mdinst, path)
+
+        self.stubs.Set(base.InstanceMetadata, 'lookup', counting_lookup)
+
+        app = handler.MetadataRequestHandler()
+        self.stubs.Set(app, 'get_metadata_by_remote_address',
+                       mdinsts.get)
+
+        results = {}
+        for prerender in (False, True):
+            self.flags(metadata_prerender=prerender)
+            bodies = []
+            if prerender:
+                for mdinst in mdinsts.values():
+                    mdinst.render()
+            del lookups[:]
+            for address in sorted(mdinsts):
+                for path in paths:
+                    request = webob.Request.blank(path)
+                    request.remote_addr = address
+                    response = request.get_response(app)
+                    self.assertEqual(response.status_int, 200)
+                    bodies.append(response.body)
+            results[prerender] = (bodies, len(lookups))
+
+        self.assertEqual(results[False][0], results[True][0])
+        self.assertEqual(results[False][1], num_instances * len(paths))
+        self.assertEqual(results[True][1], 0)
+
     def test_user_data_with_quantum_instance_id(self):
         expected_instance_id = 'a-b-c-d'
 
@@ -0,0 +1,145 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the periodic task scheduler of Manager."""
+
+import random
+
+from nova import context
+from nova import manager
+from nova.openstack.common import cfg
+from nova.openstack.common import timeutils
+from nova import test
+
+CONF = cfg.CONF
+CONF.import_opt('sync_power_state_interval', 'nova.compute.manager')
+
+
+class PeriodicTasksTestCase(test.TestCase):
+    def setUp(self):
+        super(PeriodicTasksTestCase, self).setUp()
+        self.useFixture(test.TimeOverride())
+        self.context = context.get_admin_context()
+        self.flags(periodic_task_jitter=0)
+        self.runs = []
+
+    def _make_manager(self, task_durations=None, failing=None,
+                      **decorator_kwargs):
+        runs = self.runs
+        task_durations = task_durations or {}
+
+        def make_task(name):
+            def task(self, context):
+                runs.append(name)
+                duration = task_durations.get(name, 0)
+                if duration:
+                    timeutils.advance_time_seconds(duration)
+                if name == failing:
+                    raise test.TestingException()
+            task.__name__ = name
+            if decorator_kwargs:
+                return manager.periodic_task(**decorator_kwargs)(task)
+            return manager.periodic_task(task)
+
+        # A new class each time, as tick counts are kept on the class
+        attrs = dict((name, make_task(name)) for name in ('_a', '_b'))
+        return type('FakeManager', (manager.Manager,), attrs)()
+
+    def test_ticks_between_runs(self):
+        mgr = self._make_manager(ticks_between_runs=1)
+        for i in xrange(4):
+            mgr.periodic_tasks(self.context)
+        self.assertEqual(sorted(self.runs), ['_a', '_a', '_b', '_b'])
+
+    def test_spacing(self):
+        mgr = self._make_manager(spacing=60)
+        mgr.periodic_tasks(self.context)
+        self.assertEqual(len(self.runs), 2)
+        timeutils.advance_time_seconds(30)
+        mgr.periodic_tasks(self.context)
+        self.assertEqual(len(self.runs), 2)
+        timeutils.advance_time_seconds(30)
+        mgr.periodic_tasks(self.context)
+        self.assertEqual(len(self.runs), 4)
+
+    def test_spacing_option(self):
+        self.flags(sync_power_state_interval=60)
+        mgr = self._make_manager(spacing='sync_power_state_interval')
+
+        # The option is read when the tasks are scheduled, not decorated
+        self.flags(sync_power_state_interval=120)
+        mgr.periodic_tasks(self.context)
+        self.assertEqual(len(self.runs), 2)
+        timeutils.advance_time_seconds(60)
+        mgr.periodic_tasks(self.context)
+        self.assertEqual(len(self.runs), 2)
+        timeutils.advance_time_seconds(60)
+        mgr.periodic_tasks(self.context)
+        self.assertEqual(len(self.runs), 4)
+
+    def test_spacing_jitter(self):
+        self.flags(periodic_task_jitter=0.5)
+        self.stubs.Set(random, 'uniform', lambda low, high: high)
+        mgr = self._make_manager(spacing=60)
+        mgr.periodic_tasks(self.context)
+        self.assertEqual(self.runs, [])
+        timeutils.advance_time_seconds(29)
+        mgr.periodic_tasks(self.context)
+        self.assertEqual(self.runs, [])
+        timeutils.advance_time_seconds(1)
+        mgr.periodic_tasks(self.context)
+        self.assertEqual(len(self.runs), 2)
+
+    def test_budget_defers_tasks(self):
+        self.flags(periodic_task_budget=10)
+        mgr = self._make_manager(task_durations={'_a': 20, '_b': 20})
+        mgr.periodic_tasks(self.context)
+        self.assertEqual(len(self.runs), 1)
+        first = self.runs[0]
+
+        # The task deferred on the first pass goes first on the next one
+        mgr.periodic_tasks(self.context)
+        self.assertEqual(len(self.runs), 2)
+        self.assertNotEqual(self.runs[1], first)
+
+        stats = mgr.periodic_task_stats()
+        self.assertEqual(stats['_a']['deferrals'], 1)
+        self.assertEqual(stats['_b']['deferrals'], 1)
+
+    def test_stats(self):
+        mgr = self._make_manager(task_durations={'_a': 3}, spacing=2)
+        mgr.periodic_tasks(self.context)
+        timeutils.advance_time_seconds(2)
+        mgr.periodic_tasks(self.context)
+
+        stats = mgr.periodic_task_stats()
+        self.assertEqual(stats['_a']['runs'], 2)
+        self.assertEqual(stats['_a']['last_time'], 3)
+        self.assertEqual(stats['_a']['total_time'], 6)
+        self.assertEqual(stats['_a']['overruns'], 2)
+        self.assertEqual(stats['_b']['runs'], 2)
+        self.assertEqual(stats['_b']['overruns'], 0)
+
+    def test_errors_are_counted(self):
+        mgr = self._make_manager(failing='_a')
+        mgr.periodic_tasks(self.context)
+        self.assertEqual(len(self.runs), 2)
+        stats = mgr.periodic_task_stats()
+        self.assertEqual(stats['_a']['errors'], 1)
+        self.assertEqual(stats['_b']['errors'], 0)
+        self.assertRaises(test.TestingException, mgr.periodic_tasks,
+                          self.context, raise_on_error=True)
@@ -18,6 +18,8 @@
 
 import datetime
 
+import eventlet
+
 from nova import compute
 from nova.compute import instance_types
 from nova import context
@@ -303,6 +305,9 @@ class FakeDriver(object):
     def expire(self, context):
         self.called.append(('expire', context))
 
+    def invalidate(self, project_id=None, quota_class=None):
+        self.called.append(('invalidate', project_id, quota_class))
+
 
 class BaseResourceTestCase(test.TestCase):
     def test_no_flag(self):
@@ -687,6 +692,17 @@ class QuotaEngineTestCase(test.TestCase):
                 ('expire', context),
                 ])
 
+    def test_invalidate(self):
+        driver = FakeDriver()
+        quota_obj = self._make_quota_obj(driver)
+        quota_obj.invalidate(project_id='test_project')
+        quota_obj.invalidate(quota_class='test_class')
+
+        self.assertEqual(driver.called, [
+                ('invalidate', 'test_project', None),
+                ('invalidate', None, 'test_class'),
+                ])
+
     def test_resources(self):
         quota_obj = self._make_quota_obj(None)
 
@@ -1338,6 +1354,174 @@ class DbQuotaDriverTestCase(test.TestCase):
         self.assertEqual(calls, exemplar)
 
 
+class CachedDbQuotaDriverTestCase(test.TestCase):
+    def setUp(self):
+        super(CachedDbQuotaDriverTestCase, self).setUp()
+        self.flags(quota_cache_ttl=60)
+        self.driver = quota.CachedDbQuotaDriver()
+        self.calls = []
+        self.useFixture(test.TimeOverride())
+
+        def fake_qgabp(context, project_id):
+            self.calls.append(('quota_get_all_by_project', project_id))
+            return dict(cores=10)
+
+        def fake_qcgabn(context, quota_class):
+            self.calls.append(('quota_class_get_all_by_name', quota_class))
+            return dict(instances=5, cores=8)
+
+        self.stubs.Set(db, 'quota_get_all_by_project', fake_qgabp)
+        self.stubs.Set(db, 'quota_class_get_all_by_name', fake_qcgabn)
+
+    def _get_limits(self, project_id='test_project', quota_class='test_class'):
+        quotas = self.driver.get_project_quotas(
+            FakeContext(project_id, quota_class), quota.QUOTAS._resources,
+            project_id, usages=False)
+        return dict((k, v['limit']) for k, v in quotas.items())
+
+    def test_get_project_quotas_cached(self):
+        result = self._get_limits()
+        self.assertEqual(result['instances'], 5)
+        self.assertEqual(result['cores'], 10)
+        self.assertEqual(result['ram'], 50 * 1024)
+        self.assertEqual(self._get_limits(), result)
+
+        self.assertEqual(self.calls, [
+                ('quota_get_all_by_project', 'test_project'),
+                ('quota_class_get_all_by_name', 'test_class'),
+                ])
+        self.assertEqual(self.driver.cache_stats, dict(hits=1, misses=1))
+
+    def test_get_project_quotas_expired(self):
+        self._get_limits()
+        timeutils.advance_time_seconds(59)
+        self._get_limits()
+        self.assertEqual(len(self.calls), 2)
+        timeutils.advance_time_seconds(1)
+        self._get_limits()
+        self.assertEqual(len(self.calls), 4)
+
+    def test_get_project_quotas_keyed_by_class(self):
+        self._get_limits(quota_class='test_class')
+        self._get_limits(quota_class=None)
+        self._get_limits(quota_class=None)
+
+        self.assertEqual(self.calls, [
+                ('quota_get_all_by_project', 'test_project'),
+                ('quota_class_get_all_by_name', 'test_class'),
+                ('quota_get_all_by_project', 'test_project'),
+                ])
+
+    def test_get_project_quotas_usages_not_cached(self):
+        self.stubs.Set(db, 'quota_usage_get_all_by_project',
+                       lambda context, project_id: {})
+        self._get_limits()
+        self.driver.get_project_quotas(
+            FakeContext('test_project', 'test_class'),
+            quota.QUOTAS._resources, 'test_project')
+        self.assertEqual(len(self.calls), 4)
+
+    def test_invalidate(self):
+        self._get_limits(project_id='project1')
+        self._get_limits(project_id='project2')
+        self.driver.invalidate('project1')
+        self._get_limits(project_id='project1')
+        self._get_limits(project_id='project2')
+        self.assertEqual(self.driver.cache_stats, dict(hits=1, misses=3))
+
+        self.driver.invalidate()
+        self._get_limits(project_id='project2')
+        self.assertEqual(self.driver.cache_stats, dict(hits=1, misses=4))
+
+    def test_invalidate_quota_class(self):
+        self._get_limits(project_id='project1', quota_class='class1')
+        self._get_limits(project_id='project2', quota_class='class2')
+        self.driver.invalidate(quota_class='class1')
+        self._get_limits(project_id='project1', quota_class='class1')
+        self._get_limits(project_id='project2', quota_class='class2')
+        self.assertEqual(self.driver.cache_stats, dict(hits=1, misses=3))
+
+    def test_cache_size(self):
+        self.flags(quota_cache_size=2)
+        self._get_limits(project_id='project1')
+        timeutils.advance_time_seconds(1)
+        self._get_limits(project_id='project2')
+        timeutils.advance_time_seconds(1)
+        self._get_limits(project_id='project3')
+        self.assertEqual(sorted(key[0] for key in self.driver._limits),
+                         ['project2', 'project3'])
+
+        self._get_limits(project_id='project2')
+        self.assertEqual(self.driver.cache_stats, dict(hits=1, misses=3))
+
+        # The limits that expire first are dropped
+        self._get_limits(project_id='project4')
+        self.assertEqual(sorted(key[0] for key in self.driver._limits),
+                         ['project3', 'project4'])
+
+    def test_destroy_all_by_project(self):
+        self.stubs.Set(db, 'quota_destroy_all_by_project',
+                       lambda context, project_id: None)
+        self._get_limits()
+        self.driver.destroy_all_by_project(None, 'test_project')
+        self._get_limits()
+        self.assertEqual(self.driver.cache_stats, dict(hits=0, misses=2))
+
+
+class QuotaDriverContentionTestCase(test.TestCase):
+    """Reserve and commit concurrently against the database with each
+    quota driver.
+    """
+
+    def setUp(self):
+        super(QuotaDriverContentionTestCase, self).setUp()
+        self.flags(quota_instances=-1, quota_cores=-1, quota_ram=-1)
+        self.context = context.RequestContext('fake_user', 'fake_project',
+                                              quota_class='fake_class')
+        self.limit_lookups = 0
+        orig_qgabp = db.quota_get_all_by_project
+
+        def counting_qgabp(context, project_id):
+            self.limit_lookups += 1
+            return orig_qgabp(context, project_id)
+
+        self.stubs.Set(db, 'quota_get_all_by_project', counting_qgabp)
+
+    def _reserve_and_commit(self, driver, requests):
+        deltas = dict(instances=1, cores=1, ram=512)
+
+        def _boot():
+            reservations = driver.reserve(self.context,
+                                          quota.QUOTAS._resources, deltas)
+            eventlet.sleep(0)
+            driver.commit(self.context, reservations)
+
+        pool = eventlet.GreenPool(size=20)
+        for i in xrange(requests):
+            pool.spawn_n(_boot)
+        pool.waitall()
+
+    def test_reserve_commit_contention(self):
+        requests = 40
+        results = {}
+        for driver_class in (quota.DbQuotaDriver, quota.CachedDbQuotaDriver):
+            db.quota_destroy_all_by_project(self.context.elevated(),
+                                            'fake_project')
+            self.limit_lookups = 0
+            self._reserve_and_commit(driver_class(), requests)
+            results[driver_class] = self.limit_lookups
+
+            usages = db.quota_usage_get_all_by_project(self.context,
+                                                       'fake_project')
+            self.assertEqual(usages['instances'],
+                             dict(in_use=requests, reserved=0))
+            self.assertEqual(usages['ram'],
+                             dict(in_use=requests * 512, reserved=0))
+
+        self.assertEqual(results[quota.DbQuotaDriver], requests)
+        self.assertEqual(results[quota.CachedDbQuotaDriver], 1)
+
+
 class FakeSession(object):
     def begin(self):
         return self
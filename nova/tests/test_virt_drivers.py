@@ -415,6 +415,13 @@ class _VirtDriverTestCase(_FakeDriverBackendTestCase):
                           self.connection.get_info,
                           {'name': 'I just made this name up'})
 
+    @catch_notimplementederror
+    def test_get_all_power_states(self):
+        instance_ref, network_info = self._get_running_instance()
+        states = self.connection.get_all_power_states()
+        self.assertEqual(states[instance_ref['name']],
+                         self.connection.get_info(instance_ref)['state'])
+
     @catch_notimplementederror
     def test_get_diagnostics(self):
         instance_ref, network_info = self._get_running_instance()
@@ -127,6 +127,16 @@ class ComputeDriver(object):
         # TODO(Vek): Need to pass context in for access to auth_token
         raise NotImplementedError()
 
+    def get_all_power_states(self):
+        """Return the power state of every virtual machine known to the
+        hypervisor as a dict of {instance name: power_state code}.
+
+        This lets callers such as the power state sync query the
+        hypervisor once instead of calling get_info() per instance.
+        Instances that are not in the result are not on the hypervisor.
+        """
+        raise NotImplementedError()
+
     def get_num_instances(self):
         """Return the total number of virtual machines.
 
@@ -375,7 +385,8 @@ class ComputeDriver(object):
         :param nodename:
             node which the caller want to get resources from
             a driver that manages only one node can safely ignore this
-        :returns: Dictionary describing resources
+        :returns: Dictionary describing resources.  Its optional 'stats'
+            dictionary is stored in the compute node stats
         """
         raise NotImplementedError()
 
@@ -17,10 +17,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from eventlet import greenthread
+
 from nova import context
 from nova import network
 from nova.network import linux_net
 from nova.openstack.common import cfg
+from nova.openstack.common import excutils
 from nova.openstack.common import importutils
 from nova.openstack.common import lockutils
 from nova.openstack.common import log as logging
@@ -37,6 +40,12 @@ firewall_opts = [
     cfg.BoolOpt('allow_same_net_traffic',
                 default=True,
                 help='Whether to allow network traffic from same network'),
+    cfg.FloatOpt('firewall_refresh_delay',
+                 default=0.0,
+                 help='Seconds to wait before applying a security group '
+                      'refresh, so that refreshes arriving in that time '
+                      'are merged into a single iptables apply.  0 '
+                      'applies every refresh right away'),
 ]
 
 CONF = cfg.CONF
@@ -148,6 +157,21 @@ class IptablesFirewallDriver(FirewallDriver):
         self.network_infos = {}
         self.basicly_filtered = False
 
+        # Security groups and instances with a refresh waiting for
+        # CONF.firewall_refresh_delay
+        self._pending_refresh_groups = set()
+        self._pending_refresh_instances = {}
+        self._refresh_timer = None
+        self.refresh_stats = dict(requests=0, merged=0, applies=0)
+        # { (generation, security group id, revision) :
+        #       (ipv4 rules, ipv6 rules) }
+        self._compiled_rules = {}
+        self._compiled_rules_generation = 0
+        self._security_group_revisions = {}
+        # { instance id : ids of the security groups of the instance }
+        self._instance_security_groups = {}
+        self.compiled_rules_stats = dict(hits=0, misses=0)
+
         self.iptables.ipv4['filter'].add_chain('sg-fallback')
         self.iptables.ipv4['filter'].add_rule('sg-fallback', '-j DROP')
         self.iptables.ipv6['filter'].add_chain('sg-fallback')
@@ -173,6 +197,8 @@ class IptablesFirewallDriver(FirewallDriver):
         if self.instances.pop(instance['id'], None):
             # NOTE(vish): use the passed info instead of the stored info
             self.network_infos.pop(instance['id'])
+            self._instance_security_groups.pop(instance['id'], None)
+            self._prune_compiled_rules()
             self.remove_filters_for_instance(instance)
             self.iptables.apply()
         else:
@@ -351,87 +377,241 @@ class IptablesFirewallDriver(FirewallDriver):
         security_groups = self._virtapi.security_group_get_by_instance(
             ctxt, instance)
 
+        self._instance_security_groups[instance['id']] = set(
+                security_group['id'] for security_group in security_groups)
+
         # then, security group chains and rules
         for security_group in security_groups:
-            rules = self._virtapi.security_group_rule_get_by_security_group(
+            sg_ipv4_rules, sg_ipv6_rules = self._security_group_rules(
                 ctxt, security_group)
+            ipv4_rules += sg_ipv4_rules
+            ipv6_rules += sg_ipv6_rules
 
-            for rule in rules:
-                LOG.debug(_('Adding security group rule: %r'), rule,
-                          instance=instance)
+        ipv4_rules += ['-j $sg-fallback']
+        ipv6_rules += ['-j $sg-fallback']
 
-                if not rule['cidr']:
-                    version = 4
-                else:
-                    version = netutils.get_ip_version(rule['cidr'])
+        return ipv4_rules, ipv6_rules
 
-                if version == 4:
-                    fw_rules = ipv4_rules
-                else:
-                    fw_rules = ipv6_rules
+    def _security_group_rules(self, ctxt, security_group):
+        """Return the ipv4 and ipv6 rules of a security group.
 
-                protocol = rule['protocol']
+        Rules are compiled once per revision of the group and shared by
+        all the instances in it; see invalidate_security_group_rules.
+        """
+        key = self._compiled_rules_key(security_group['id'])
+        compiled = self._compiled_rules.get(key)
+        if compiled is not None:
+            self.compiled_rules_stats['hits'] += 1
+            return compiled
+        self.compiled_rules_stats['misses'] += 1
+
+        ipv4_rules = []
+        ipv6_rules = []
+        rules = self._virtapi.security_group_rule_get_by_security_group(
+            ctxt, security_group)
 
-                if protocol:
-                    protocol = rule['protocol'].lower()
+        for rule in rules:
+            LOG.debug(_('Adding security group rule: %r'), rule)
 
-                if version == 6 and protocol == 'icmp':
-                    protocol = 'icmpv6'
+            if not rule['cidr']:
+                version = 4
+            else:
+                version = netutils.get_ip_version(rule['cidr'])
 
-                args = ['-j ACCEPT']
-                if protocol:
-                    args += ['-p', protocol]
+            if version == 4:
+                fw_rules = ipv4_rules
+            else:
+                fw_rules = ipv6_rules
 
-                if protocol in ['udp', 'tcp']:
-                    args += self._build_tcp_udp_rule(rule, version)
-                elif protocol == 'icmp':
-                    args += self._build_icmp_rule(rule, version)
-                if rule['cidr']:
-                    LOG.debug('Using cidr %r', rule['cidr'], instance=instance)
-                    args += ['-s', rule['cidr']]
-                    fw_rules += [' '.join(args)]
-                else:
-                    if rule['grantee_group']:
-                        # FIXME(jkoelker) This needs to be ported up into
-                        #                 the compute manager which already
-                        #                 has access to a nw_api handle,
-                        #                 and should be the only one making
-                        #                 making rpc calls.
-                        nw_api = network.API()
-                        for instance in rule['grantee_group']['instances']:
-                            nw_info = nw_api.get_instance_nw_info(ctxt,
-                                                                  instance)
-
-                            ips = [ip['address']
-                                for ip in nw_info.fixed_ips()
-                                    if ip['version'] == version]
-
-                            LOG.debug('ips: %r', ips, instance=instance)
-                            for ip in ips:
-                                subrule = args + ['-s %s' % ip]
-                                fw_rules += [' '.join(subrule)]
-
-                LOG.debug('Using fw_rules: %r', fw_rules, instance=instance)
+            protocol = rule['protocol']
 
-        ipv4_rules += ['-j $sg-fallback']
-        ipv6_rules += ['-j $sg-fallback']
+            if protocol:
+                protocol = rule['protocol'].lower()
 
+            if version == 6 and protocol == 'icmp':
+                protocol = 'icmpv6'
+
+            args = ['-j ACCEPT']
+            if protocol:
+                args += ['-p', protocol]
+
+            if protocol in ['udp', 'tcp']:
+                args += self._build_tcp_udp_rule(rule, version)
+            elif protocol == 'icmp':
+                args += self._build_icmp_rule(rule, version)
+            if rule['cidr']:
+                LOG.debug('Using cidr %r', rule['cidr'])
+                args += ['-s', rule['cidr']]
+                fw_rules += [' '.join(args)]
+            else:
+                if rule['grantee_group']:
+                    # FIXME(jkoelker) This needs to be ported up into
+                    #                 the compute manager which already
+                    #                 has access to a nw_api handle,
+                    #                 and should be the only one making
+                    #                 making rpc calls.
+                    nw_api = network.API()
+                    for member in rule['grantee_group']['instances']:
+                        nw_info = nw_api.get_instance_nw_info(ctxt, member)
+
+                        ips = [ip['address']
+                            for ip in nw_info.fixed_ips()
+                                if ip['version'] == version]
+
+                        LOG.debug('ips: %r', ips, instance=member)
+                        for ip in ips:
+                            subrule = args + ['-s %s' % ip]
+                            fw_rules += [' '.join(subrule)]
+
+            LOG.debug('Using fw_rules: %r', fw_rules)
+
+        # Do not keep the rules if the group was invalidated while they
+        # were compiled
+        if key == self._compiled_rules_key(security_group['id']):
+            self._compiled_rules[key] = (ipv4_rules, ipv6_rules)
         return ipv4_rules, ipv6_rules
 
+    def _compiled_rules_key(self, security_group_id):
+        return (self._compiled_rules_generation, security_group_id,
+                self._security_group_revisions.get(security_group_id, 0))
+
+    def invalidate_security_group_rules(self, security_group_id=None):
+        """Drop the compiled rules of a security group, or of every group
+        if security_group_id is None.
+        """
+        if security_group_id is None:
+            self._compiled_rules = {}
+            self._security_group_revisions = {}
+            self._compiled_rules_generation += 1
+            return
+        revision = self._security_group_revisions.get(security_group_id, 0)
+        self._compiled_rules.pop((self._compiled_rules_generation,
+                                  security_group_id, revision), None)
+        self._security_group_revisions[security_group_id] = revision + 1
+
+    def _prune_compiled_rules(self):
+        """Drop the compiled rules of the security groups that no
+        filtered instance is in any more, e.g. deleted groups.
+        """
+        in_use = set()
+        for security_group_ids in self._instance_security_groups.values():
+            in_use |= security_group_ids
+        for key in self._compiled_rules.keys():
+            if key[1] not in in_use:
+                del self._compiled_rules[key]
+        for security_group_id in self._security_group_revisions.keys():
+            if security_group_id not in in_use:
+                del self._security_group_revisions[security_group_id]
+
     def instance_filter_exists(self, instance, network_info):
         pass
 
     def refresh_security_group_members(self, security_group):
-        self.do_refresh_security_group_rules(security_group)
-        self.iptables.apply()
+        self.invalidate_security_group_rules(security_group)
+        self._queue_refresh(security_group)
 
     def refresh_security_group_rules(self, security_group):
-        self.do_refresh_security_group_rules(security_group)
+        self.invalidate_security_group_rules(security_group)
+        self._queue_refresh(security_group)
+
+    def _queue_refresh(self, security_group=None, instance=None):
+        """Refresh the instance rules for a security group change, or for
+        a single instance, or wait CONF.firewall_refresh_delay for more
+        refreshes to merge with."""
+        self.refresh_stats['requests'] += 1
+        if CONF.firewall_refresh_delay <= 0:
+            if instance is not None:
+                self._invalidate_instance_security_groups([instance['id']])
+                self.do_refresh_instance_rules(instance)
+            else:
+                self.do_refresh_security_group_rules(security_group)
+            self.iptables.apply()
+            self.refresh_stats['applies'] += 1
+            return
+
+        if self._refresh_timer is None:
+            self._refresh_timer = greenthread.spawn_after(
+                CONF.firewall_refresh_delay, self._flush_refreshes_logged)
+        else:
+            self.refresh_stats['merged'] += 1
+        if instance is not None:
+            self._pending_refresh_instances[instance['id']] = instance
+        else:
+            self._pending_refresh_groups.add(security_group)
+
+    def _flush_refreshes_logged(self):
+        """Run the queued refreshes from the refresh timer, where an
+        exception would be lost."""
+        try:
+            self.flush_refreshes()
+        except Exception:
+            LOG.exception(_('Failed to refresh instance rules, they will '
+                            'be retried with the next refresh'))
+
+    def flush_refreshes(self):
+        """Run the security group refreshes waiting for
+        CONF.firewall_refresh_delay now, with a single iptables apply.
+        If they fail, they stay queued for the next refresh."""
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+            self._refresh_timer = None
+        security_groups = self._pending_refresh_groups
+        self._pending_refresh_groups = set()
+        instances = self._pending_refresh_instances
+        self._pending_refresh_instances = {}
+        if not security_groups and not instances:
+            return
+
+        try:
+            self._do_flush_refreshes(security_groups, instances)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self._pending_refresh_groups |= security_groups
+                for instance_id, instance in instances.items():
+                    # Keep the instances queued again since then
+                    self._pending_refresh_instances.setdefault(instance_id,
+                                                               instance)
+
+    def _do_flush_refreshes(self, security_groups, instances):
+        # Instances in the same groups are refreshed for the same change,
+        # so their groups are compiled once for all of them.
+        self._invalidate_instance_security_groups(instances)
+        if security_groups:
+            LOG.debug(_('Refreshing instance rules for security groups %s'),
+                      sorted(security_groups))
+            # Every instance is refreshed once, as
+            # do_refresh_security_group_rules does for a single group:
+            # instances added to a group still have their old
+            # security_groups here.
+            instances = self.instances
+        for instance_id, instance in instances.items():
+            # Skip the instances unfiltered since their refresh was queued
+            if instance_id in self.instances:
+                self.do_refresh_instance_rules(instance)
+        if security_groups:
+            self._prune_compiled_rules()
         self.iptables.apply()
+        self.refresh_stats['applies'] += 1
 
     def refresh_instance_security_rules(self, instance):
-        self.do_refresh_instance_rules(instance)
-        self.iptables.apply()
+        # Sent when a rule is added to or removed from a group of the
+        # instance, or when a group granted access by them gains or loses
+        # a member.  The message does not say which of the instance's
+        # groups changed, so all of them are invalidated when the refresh
+        # runs.
+        self._queue_refresh(instance=instance)
+
+    def _invalidate_instance_security_groups(self, instance_ids):
+        """Drop the compiled rules of the security groups of instances."""
+        security_group_ids = set()
+        for instance_id in instance_ids:
+            if instance_id not in self._instance_security_groups:
+                # Not filtered yet, so its groups are not known
+                self.invalidate_security_group_rules()
+                return
+            security_group_ids |= self._instance_security_groups[instance_id]
+        for security_group_id in security_group_ids:
+            self.invalidate_security_group_rules(security_group_id)
 
     @lockutils.synchronized('iptables', 'nova-', external=True)
     def _inner_do_refresh_rules(self, instance, ipv4_rules,
@@ -445,6 +625,7 @@ class IptablesFirewallDriver(FirewallDriver):
             ipv4_rules, ipv6_rules = self.instance_rules(instance,
                                                          network_info)
             self._inner_do_refresh_rules(instance, ipv4_rules, ipv6_rules)
+        self._prune_compiled_rules()
 
     def do_refresh_instance_rules(self, instance):
         network_info = self.network_infos[instance['id']]
@@ -21,8 +21,10 @@
 Handling of VM disk images.
 """
 
+import hashlib
 import os
 import re
+import struct
 
 from nova import exception
 from nova.image import glance
@@ -37,10 +39,15 @@ image_opts = [
     cfg.BoolOpt('force_raw_images',
                 default=True,
                 help='Force backing images to raw format'),
+    cfg.IntOpt('image_fetch_buffer_size',
+               default=4 * 1024 * 1024,
+               help='Size in bytes of the write buffer used when '
+                    'downloading images'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(image_opts)
+CONF.import_opt('glance_download_workers', 'nova.image.glance')
 
 
 class QemuImgInfo(object):
@@ -181,13 +188,156 @@ def qemu_img_info(path):
     return QemuImgInfo(out)
 
 
+# Start of the headers of the formats qemu-img probes for, other than
+# qcow and raw.  Images starting with one of these are left to qemu-img.
+_OTHER_FORMAT_MAGICS = (
+    'QED\x00',
+    'KDMV',  # vmdk
+    'COWD',  # vmdk version 3
+    'conectix',  # vpc
+    'vhdxfile',
+    'LUKS\xba\xbe',
+    'OOOM',  # cow
+    'Bochs Virtual HD Image',
+    'WithoutFreeSpace',  # parallels
+    'WithouFreSpacExt',  # parallels
+    '#!/bin/sh\n#V2.0 Format',  # cloop
+)
+
+_VDI_SIGNATURE = '\x7f\x10\xda\xbe'
+_QCOW2_MAGIC = 'QFI\xfb'
+# magic, version, backing_file_offset, backing_file_size, cluster_bits,
+# size, crypt_method, l1_size, l1_table_offset, refcount_table_offset,
+# refcount_table_clusters, nb_snapshots
+_QCOW2_HEADER = struct.Struct('>4sIQIIQIIQQIIQ')
+_HEADER_READ_SIZE = 512
+
+# { path : (mtime, size, QemuImgInfo) }
+_image_info_cache = {}
+_IMAGE_INFO_CACHE_MAX = 4096
+
+
+def _read_qcow2_info(path, image_file, header, stat):
+    """Return a QemuImgInfo for a qcow2 header, or None if qemu-img should
+    be asked instead.
+    """
+    if len(header) < _QCOW2_HEADER.size:
+        return None
+    (magic, version, backing_file_offset, backing_file_size, cluster_bits,
+     size, crypt_method, _l1_size, _l1_table_offset, _refcount_table_offset,
+     _refcount_table_clusters, nb_snapshots,
+     _snapshots_offset) = _QCOW2_HEADER.unpack(header[:_QCOW2_HEADER.size])
+    # Version 1 is the qcow format
+    if version not in (2, 3) or not 9 <= cluster_bits <= 21:
+        return None
+    if nb_snapshots:
+        # The snapshot list is not parsed here
+        return None
+
+    info = QemuImgInfo(None)
+    info.image = path
+    info.file_format = 'qcow2'
+    info.virtual_size = size
+    info.cluster_size = 1 << cluster_bits
+    info.disk_size = stat.st_blocks * 512
+    if crypt_method:
+        info.encryption = 'yes'
+    if backing_file_offset:
+        if backing_file_size > 1023:
+            return None
+        image_file.seek(backing_file_offset)
+        backing_file = image_file.read(backing_file_size)
+        if len(backing_file) != backing_file_size:
+            return None
+        # qemu-img reports the path relative to the image as actual path
+        info.backing_file = os.path.join(os.path.dirname(path), backing_file)
+    return info
+
+
+def _read_image_info(path, stat):
+    """Read the format, size and backing file of a qcow2 or raw image
+    from its header.  Returns None for other formats.
+    """
+    if path.endswith('.dmg'):
+        # Probed by file name by qemu-img
+        return None
+    with open(path, 'rb') as image_file:
+        header = image_file.read(_HEADER_READ_SIZE)
+        if header.startswith(_QCOW2_MAGIC):
+            return _read_qcow2_info(path, image_file, header, stat)
+
+    if header.startswith(_OTHER_FORMAT_MAGICS):
+        return None
+    # vmdk descriptor files and vdi images
+    if ('Disk DescriptorFile' in header or
+        header[64:68] == _VDI_SIGNATURE):
+        return None
+    info = QemuImgInfo(None)
+    info.image = path
+    info.file_format = 'raw'
+    info.virtual_size = stat.st_size
+    info.disk_size = stat.st_blocks * 512
+    return info
+
+
+def cached_image_info(path):
+    """Return a QemuImgInfo for an image, like qemu_img_info.
+
+    qcow2 and raw images are read without running qemu-img.  Results are
+    cached until the modification time or the size of the image changes.
+    Not meant for untrusted images: formats are told apart by a subset
+    of the probes of qemu-img.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return qemu_img_info(path)
+
+    cached = _image_info_cache.get(path)
+    if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+
+    try:
+        info = _read_image_info(path, stat)
+    except IOError:
+        info = None
+    if info is None:
+        info = qemu_img_info(path)
+    if len(_image_info_cache) >= _IMAGE_INFO_CACHE_MAX:
+        _image_info_cache.clear()
+    _image_info_cache[path] = (stat.st_mtime, stat.st_size, info)
+    return info
+
+
 def convert_image(source, dest, out_format):
     """Convert image to other format"""
     cmd = ('qemu-img', 'convert', '-O', out_format, source, dest)
     utils.execute(*cmd)
 
 
+class _ChecksummingWriter(object):
+    """Write data through to a file, hashing it on the way."""
+
+    def __init__(self, image_file):
+        self.image_file = image_file
+        self.md5 = hashlib.md5()
+        self.sha1 = hashlib.sha1()
+
+    def update(self, data):
+        self.md5.update(data)
+        self.sha1.update(data)
+
+    def write(self, data):
+        self.update(data)
+        self.image_file.write(data)
+
+
 def fetch(context, image_href, path, _user_id, _project_id):
+    """Download an image to path.
+
+    The image is checked against the checksum glance has for it, if any.
+    Returns the sha1 of the image, as hex.
+    """
     # TODO(vish): Improve context handling and add owner and auth data
     #             when it is added to glance.  Right now there is no
     #             auth checking in glance, so we assume that access was
@@ -195,14 +345,56 @@ def fetch(context, image_href, path, _user_id, _project_id):
     (image_service, image_id) = glance.get_remote_image_service(context,
                                                                 image_href)
     with utils.remove_path_on_error(path):
-        with open(path, "wb") as image_file:
-            image_service.download(context, image_id, image_file)
+        image_meta = image_service.show(context, image_id)
+        expected_md5 = image_meta.get('checksum')
+        ranged = False
+        with open(path, "wb", CONF.image_fetch_buffer_size) as image_file:
+            writer = _ChecksummingWriter(image_file)
+            if CONF.glance_download_workers > 1:
+                # Ranges are written to path directly, and the image is
+                # only streamed through writer if glance does not serve
+                # them
+                ranged = image_service.download(context, image_id, writer,
+                                                dst_path=path,
+                                                image_meta=image_meta)
+            else:
+                image_service.download(context, image_id, writer)
+        if ranged:
+            # Ranges are written out of order, hash the image once complete
+            writer = _ChecksummingWriter(None)
+            with open(path, 'rb') as image_file:
+                for chunk in iter(lambda: image_file.read(
+                                      CONF.image_fetch_buffer_size), ''):
+                    writer.update(chunk)
+
+        md5 = writer.md5.hexdigest()
+        if expected_md5 and md5 != expected_md5:
+            raise exception.ImageUnacceptable(image_id=image_href,
+                reason=_("checksum is %(md5)s, glance has %(expected_md5)s")
+                       % locals())
+    return writer.sha1.hexdigest()
 
 
 def fetch_to_raw(context, image_href, path, user_id, project_id):
+    """Download an image to path, converting it to raw if
+    CONF.force_raw_images is set.
+
+    Returns the sha1 of the image at path if it was not converted, so it
+    does not have to be read again to get it, or None.
+    """
     path_tmp = "%s.part" % path
-    fetch(context, image_href, path_tmp, user_id, project_id)
+    sha1 = fetch(context, image_href, path_tmp, user_id, project_id)
+    if move_to_raw(image_href, path_tmp, path):
+        return None
+    return sha1
+
+
+def move_to_raw(image_href, path_tmp, path):
+    """Check an image downloaded to path_tmp and move it to path, converting
+    it to raw if CONF.force_raw_images is set.
 
+    Returns True if the image was converted.
+    """
     with utils.remove_path_on_error(path_tmp):
         data = qemu_img_info(path_tmp)
 
@@ -230,6 +422,8 @@ def fetch_to_raw(context, image_href, path, user_id, project_id):
                         data.file_format)
 
                 os.rename(staged, path)
+                return True
 
         else:
             os.rename(path_tmp, path)
+            return False
@@ -47,6 +47,7 @@ import os
 import shutil
 import sys
 import tempfile
+import time
 import uuid
 
 from eventlet import greenthread
@@ -77,6 +78,7 @@ from nova.virt.libvirt import config as vconfig
 from nova.virt.libvirt import firewall as libvirt_firewall
 from nova.virt.libvirt import imagebackend
 from nova.virt.libvirt import imagecache
+from nova.virt.libvirt import imagepeer
 from nova.virt.libvirt import utils as libvirt_utils
 from nova.virt import netutils
 
@@ -274,6 +276,8 @@ class LibvirtDriver(driver.ComputeDriver):
         self._initiator = None
         self._wrapped_conn = None
         self.read_only = read_only
+        # Timings of the last get_available_resource
+        self.resource_stats = {}
         self.firewall_driver = firewall.load_driver(
             DEFAULT_FIREWALL_DRIVER,
             self.virtapi,
@@ -341,6 +345,9 @@ class LibvirtDriver(driver.ComputeDriver):
                         '%(major)i.%(minor)i.%(micro)i or greater.') %
                         locals())
 
+        if CONF.image_peer_distribution:
+            imagepeer.start_server()
+
     def _get_connection(self):
         if not self._wrapped_conn or not self._test_connection():
             LOG.debug(_('Connecting to libvirt: %s'), self.uri)
@@ -1909,6 +1916,28 @@ class LibvirtDriver(driver.ComputeDriver):
                 'num_cpu': num_cpu,
                 'cpu_time': cpu_time}
 
+    def get_all_power_states(self):
+        """Efficient override of base get_all_power_states method.
+
+        Running domains are enumerated by ID and each is queried once;
+        domains that are defined but not running are powered off.
+        """
+        states = {}
+        for domain_id in self.list_instance_ids():
+            # We skip domains with ID 0 (hypervisors).
+            if domain_id == 0:
+                continue
+            try:
+                domain = self._conn.lookupByID(domain_id)
+                state = domain.info()[0]
+                states[domain.name()] = LIBVIRT_POWER_STATE[state]
+            except libvirt.libvirtError:
+                # Instance was deleted while listing... ignore it
+                pass
+        for name in self._conn.listDefinedDomains():
+            states.setdefault(name, power_state.SHUTDOWN)
+        return states
+
     def _create_domain(self, xml=None, domain=None, launch_flags=0):
         """Create a domain.
 
@@ -2048,30 +2077,58 @@ class LibvirtDriver(driver.ComputeDriver):
         stats = libvirt_utils.get_fs_info(CONF.instances_path)
         return stats['total'] / (1024 ** 3)
 
-    def get_vcpu_used(self):
-        """ Get vcpu usage number of physical computer.
-
-        :returns: The total number of vcpu that currently used.
+    def _get_domain_inventory(self, xml=True):
+        """Look up every running domain once for resource accounting.
 
+        :param xml: whether to also get the XML of the domains.
+        :returns: a list of dicts with the id, name, state, memory (KB),
+                  number of vcpus and XML of each domain.  The XML is
+                  None for domain 0, or if xml is False.
         """
-
-        total = 0
-        for dom_id in self.list_instance_ids():
-            dom = self._conn.lookupByID(dom_id)
-            vcpus = dom.vcpus()
+        domains = []
+        for domain_id in self.list_instance_ids():
+            try:
+                dom = self._conn.lookupByID(domain_id)
+                (state, _max_mem, mem, _num_cpu, _cpu_time) = dom.info()
+                vcpus = dom.vcpus()
+                domain = {'id': domain_id,
+                          'name': dom.name(),
+                          'state': LIBVIRT_POWER_STATE[state],
+                          'memory': int(mem),
+                          'xml': None}
+                if xml and domain_id != 0:
+                    domain['xml'] = dom.XMLDesc(0)
+            except libvirt.libvirtError:
+                # Instance was deleted while listing... ignore it
+                continue
             if vcpus is None:
                 # dom.vcpus is not implemented for lxc, but returning 0 for
                 # a used count is hardly useful for something measuring usage
-                total += 1
+                domain['vcpus'] = 1
             else:
-                total += len(vcpus[1])
+                domain['vcpus'] = len(vcpus[1])
+            domains.append(domain)
             # NOTE(gtt116): give change to do other task.
             greenthread.sleep(0)
-        return total
+        return domains
+
+    def get_vcpu_used(self, domains=None):
+        """ Get vcpu usage number of physical computer.
+
+        :param domains: domains from _get_domain_inventory, looked up
+                        if not given.
+        :returns: The total number of vcpu that currently used.
+
+        """
+        if domains is None:
+            domains = self._get_domain_inventory(xml=False)
+        return sum(domain['vcpus'] for domain in domains)
 
-    def get_memory_mb_used(self):
+    def get_memory_mb_used(self, domains=None):
         """Get the free memory size(MB) of physical computer.
 
+        :param domains: domains from _get_domain_inventory, looked up
+                        if not given and needed.
         :returns: the total usage of memory(MB).
 
         """
@@ -2084,11 +2141,13 @@ class LibvirtDriver(driver.ComputeDriver):
         idx2 = m.index('Buffers:')
         idx3 = m.index('Cached:')
         if CONF.libvirt_type == 'xen':
+            if domains is None:
+                domains = self._get_domain_inventory(xml=False)
             used = 0
-            for domain_id in self.list_instance_ids():
+            for domain in domains:
                 # skip dom0
-                dom_mem = int(self._conn.lookupByID(domain_id).info()[2])
-                if domain_id != 0:
+                dom_mem = domain['memory']
+                if domain['id'] != 0:
                     used += dom_mem
                 else:
                     # the mem reported by dom0 is be greater of what
@@ -2288,17 +2347,34 @@ class LibvirtDriver(driver.ComputeDriver):
         :param nodename: ignored in this driver
         :returns: dictionary containing resource info
         """
+        start = time.time()
+        # Domains are looked up once and shared by the accessors below
+        domains = self._get_domain_inventory()
+        inventory_time = time.time() - start
         dic = {'vcpus': self.get_vcpu_total(),
                'memory_mb': self.get_memory_mb_total(),
                'local_gb': self.get_local_gb_total(),
-               'vcpus_used': self.get_vcpu_used(),
-               'memory_mb_used': self.get_memory_mb_used(),
+               'vcpus_used': self.get_vcpu_used(domains),
+               'memory_mb_used': self.get_memory_mb_used(domains),
                'local_gb_used': self.get_local_gb_used(),
                'hypervisor_type': self.get_hypervisor_type(),
                'hypervisor_version': self.get_hypervisor_version(),
                'hypervisor_hostname': self.get_hypervisor_hostname(),
-               'cpu_info': self.get_cpu_info(),
-               'disk_available_least': self.get_disk_available_least()}
+               'cpu_info': self.get_cpu_info()}
+        disk_start = time.time()
+        dic['disk_available_least'] = self.get_disk_available_least(domains)
+        # Tells other compute nodes where base images are served
+        dic['stats'] = imagepeer.get_stats()
+        end = time.time()
+
+        self.resource_stats = {'domains': len(domains),
+                               'inventory_time': inventory_time,
+                               'disk_time': end - disk_start,
+                               'total_time': end - start}
+        LOG.debug(_("Collected resources of %(domains)d domains in "
+                    "%(total_time).3fs: %(inventory_time).3fs looking up "
+                    "domains, %(disk_time).3fs reading their disks"),
+                  self.resource_stats)
         return dic
 
     def check_can_live_migrate_destination(self, ctxt, instance_ref,
@@ -2736,10 +2812,15 @@ class LibvirtDriver(driver.ComputeDriver):
                   'disk_size':'83886080'},...]"
 
         """
-        disk_info = []
-
         virt_dom = self._lookup_by_name(instance_name)
         xml = virt_dom.XMLDesc(0)
+        return jsonutils.dumps(self._get_disk_info_from_xml(xml))
+
+    def _get_disk_info_from_xml(self, xml):
+        """Return the disk info of get_instance_disk_info, as a list, for
+        the file backed disks in a domain XML.
+        """
+        disk_info = []
         doc = etree.fromstring(xml)
         disk_nodes = doc.findall('.//devices/disk')
         path_nodes = doc.findall('.//devices/disk/source')
@@ -2771,9 +2852,9 @@ class LibvirtDriver(driver.ComputeDriver):
                               'virt_disk_size': virt_size,
                               'backing_file': backing_file,
                               'disk_size': dk_size})
-        return jsonutils.dumps(disk_info)
+        return disk_info
 
-    def get_disk_available_least(self):
+    def get_disk_available_least(self, domains=None):
         """Return disk available least size.
 
         The size of available disk, when block_migration command given
@@ -2782,17 +2863,28 @@ class LibvirtDriver(driver.ComputeDriver):
         The size that deducted real nstance disk size from the total size
         of the virtual disk of all instances.
 
+        :param domains: domains from _get_domain_inventory, to use instead
+                        of looking up the XML of every instance again.
         """
         # available size of the disk
         dk_sz_gb = self.get_local_gb_total() - self.get_local_gb_used()
 
         # Disk size that all instance uses : virtual_size - disk_size
-        instances_name = self.list_instances()
+        if domains is None:
+            domains = [{'name': name, 'xml': None}
+                       for name in self.list_instances()]
+        else:
+            # We skip domains with ID 0 (hypervisors).
+            domains = [domain for domain in domains if domain['id'] != 0]
         instances_sz = 0
-        for i_name in instances_name:
+        for domain in domains:
+            i_name = domain['name']
             try:
-                disk_infos = jsonutils.loads(
-                        self.get_instance_disk_info(i_name))
+                if domain['xml'] is None:
+                    disk_infos = jsonutils.loads(
+                            self.get_instance_disk_info(i_name))
+                else:
+                    disk_infos = self._get_disk_info_from_xml(domain['xml'])
                 for info in disk_infos:
                     i_vt_sz = int(info['virt_disk_size'])
                     i_dk_sz = int(info['disk_size'])
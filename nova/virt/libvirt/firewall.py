@@ -244,6 +244,8 @@ class IptablesFirewallDriver(base_firewall.IptablesFirewallDriver):
         if self.instances.pop(instance['id'], None):
             # NOTE(vish): use the passed info instead of the stored info
             self.network_infos.pop(instance['id'])
+            self._instance_security_groups.pop(instance['id'], None)
+            self._prune_compiled_rules()
             self.remove_filters_for_instance(instance)
             self.iptables.apply()
             self.nwfilter.unfilter_instance(instance, network_info)
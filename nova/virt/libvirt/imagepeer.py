@@ -0,0 +1,328 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Distribution of base images between compute nodes.
+
+A compute node missing a base image first asks a few of the other compute
+nodes running instances of that image for it, and downloads it from
+glance only if none of them can send it.  Each node serves the base
+images it downloaded unconverted to a limited number of peers at a time,
+at the address it publishes in its compute node stats.  An image new to
+every node is then copied from the first nodes to get it, in a tree,
+instead of from glance by every node.
+
+Nodes are found through the instances of the image, so images no
+instance was booted from, such as kernels and ramdisks, and images whose
+instances are all deleted are always downloaded from glance.
+
+Images are only copied from peers if glance has a checksum for them, and
+the copy is checked against it, then checked and converted like images
+downloaded from glance.  Requests between nodes are signed with a secret
+shared by all compute nodes, and expire shortly after being sent.
+
+Compute nodes are looked up through the conductor.
+"""
+
+import hashlib
+import hmac
+import httplib
+import os
+import random
+import urllib
+
+from nova import conductor
+from nova.image import glance
+from nova.openstack.common import cfg
+from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
+from nova import servicegroup
+from nova import utils
+from nova.virt import images
+from nova.virt.libvirt import imagecache
+from nova import wsgi
+
+
+LOG = logging.getLogger(__name__)
+
+imagepeer_opts = [
+    cfg.BoolOpt('image_peer_distribution',
+                default=False,
+                help='Get base images from other compute nodes before '
+                     'glance, and serve base images to them.  Needs '
+                     'image_peer_secret'),
+    cfg.StrOpt('image_peer_secret',
+               default='',
+               help='Secret shared by the compute nodes to sign the base '
+                    'image requests they send each other'),
+    cfg.StrOpt('image_peer_host',
+               default='$my_ip',
+               help='Address to serve base images to other compute nodes '
+                    'on.  It is published to them, so it must be one they '
+                    'can reach'),
+    cfg.IntOpt('image_peer_port',
+               default=8786,
+               help='Port to serve base images to other compute nodes on'),
+    cfg.IntOpt('image_peer_max_uploads',
+               default=2,
+               help='Number of compute nodes a base image is sent to at a '
+                    'time.  Other nodes asking for it get it elsewhere'),
+    cfg.IntOpt('image_peer_max_tries',
+               default=5,
+               help='Number of compute nodes running instances of a base '
+                    'image asked for it before downloading it from glance'),
+    cfg.IntOpt('image_peer_timeout',
+               default=30,
+               help='Seconds to wait for another compute node sending a '
+                    'base image'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(imagepeer_opts)
+CONF.import_opt('base_dir_name', 'nova.virt.libvirt.imagecache')
+CONF.import_opt('compute_topic', 'nova.config')
+CONF.import_opt('host', 'nova.config')
+CONF.import_opt('image_fetch_buffer_size', 'nova.virt.images')
+CONF.import_opt('instances_path', 'nova.compute.manager')
+CONF.import_opt('my_ip', 'nova.config')
+
+CHECKSUM_HEADER = 'X-Image-Md5'
+SIGNATURE_HEADER = 'X-Image-Peer-Signature'
+EXPIRES_HEADER = 'X-Image-Peer-Expires'
+ENDPOINT_STAT = 'image_peer_endpoint'
+
+# Most recent instances of an image looked at to find the nodes having it
+_MAX_INSTANCES = 100
+# Seconds a signed request is accepted for
+_REQUEST_LIFETIME = 60
+
+
+def _sign(filename, expires):
+    return hmac.new(CONF.image_peer_secret, '%s:%s' % (filename, expires),
+                    hashlib.sha256).hexdigest()
+
+
+def _signature_headers(filename):
+    expires = timeutils.utcnow_ts() + _REQUEST_LIFETIME
+    return {SIGNATURE_HEADER: _sign(filename, expires),
+            EXPIRES_HEADER: str(expires)}
+
+
+def _check_signature(filename, environ):
+    """Return True if a request for filename is signed and not expired."""
+    signature = environ.get('HTTP_X_IMAGE_PEER_SIGNATURE')
+    expires = environ.get('HTTP_X_IMAGE_PEER_EXPIRES', '')
+    if not CONF.image_peer_secret or not signature or not expires.isdigit():
+        return False
+    if int(expires) < timeutils.utcnow_ts():
+        return False
+    return utils.strcmp_const_time(signature, _sign(filename, expires))
+
+
+class ImagePeerApp(object):
+    """WSGI application sending base images to other compute nodes.
+
+    GET /<base image file name> returns the image, with the md5 glance has
+    for it in the X-Image-Md5 header.  Requests must carry an expiry time
+    in the X-Image-Peer-Expires header, and the signature of the file name
+    and expiry time in the X-Image-Peer-Signature header.  Only images
+    stored as downloaded from glance, whose md5 is known, are sent.
+    """
+
+    def __init__(self):
+        self.uploads = 0
+
+    def __call__(self, environ, start_response):
+        filename = environ.get('PATH_INFO', '').lstrip('/')
+        if not _check_signature(filename, environ):
+            LOG.warn(_('Invalid signature for base image %(filename)s '
+                       'requested by %(peer)s'),
+                     {'filename': filename,
+                      'peer': environ.get('REMOTE_ADDR')})
+            start_response('403 Forbidden', [('Content-Length', '0')])
+            return []
+
+        path = os.path.join(CONF.instances_path, CONF.base_dir_name,
+                            filename)
+        checksum = None
+        if (environ['REQUEST_METHOD'] == 'GET' and filename and
+            filename == os.path.basename(filename) and
+            not filename.startswith('.') and os.path.isfile(path)):
+            checksum = imagecache.read_stored_info(path, field='md5')
+        if not checksum:
+            start_response('404 Not Found', [('Content-Length', '0')])
+            return []
+        if self.uploads >= CONF.image_peer_max_uploads:
+            start_response('503 Service Unavailable',
+                           [('Content-Length', '0')])
+            return []
+
+        image_file = open(path, 'rb')
+        size = os.fstat(image_file.fileno()).st_size
+        LOG.debug(_('Sending base image %(filename)s to %(peer)s'),
+                  {'filename': filename, 'peer': environ.get('REMOTE_ADDR')})
+        start_response('200 OK', [('Content-Length', str(size)),
+                                  ('Content-Type', 'application/octet-stream'),
+                                  (CHECKSUM_HEADER, checksum)])
+        self.uploads += 1
+        return self._send(image_file)
+
+    def _send(self, image_file):
+        try:
+            for chunk in iter(lambda: image_file.read(65536), ''):
+                yield chunk
+        finally:
+            image_file.close()
+            self.uploads -= 1
+
+
+def start_server():
+    """Start serving base images to other compute nodes."""
+    if not CONF.image_peer_secret:
+        LOG.error(_('image_peer_secret is not set, not serving base images '
+                    'to other compute nodes'))
+        return None
+    server = wsgi.Server('image-peer', ImagePeerApp(),
+                         host=CONF.image_peer_host,
+                         port=CONF.image_peer_port)
+    server.start()
+    return server
+
+
+def get_stats():
+    """Return the compute node stats telling other compute nodes where
+    base images are served, if they are.
+    """
+    if not CONF.image_peer_distribution or not CONF.image_peer_secret:
+        return {}
+    return {ENDPOINT_STAT: '%s:%s' % (CONF.image_peer_host,
+                                      CONF.image_peer_port)}
+
+
+def _find_peers(context, image_id):
+    """Return the endpoints of up to CONF.image_peer_max_tries other
+    compute nodes running instances of image_id, in random order.
+    """
+    context = context.elevated()
+    conductor_api = conductor.API()
+    instances = conductor_api.instance_get_all_by_filters(context,
+            {'image_ref': image_id, 'deleted': False},
+            limit=_MAX_INSTANCES, columns_to_join=[])
+    hosts = set(instance['host'] for instance in instances)
+    hosts &= set(servicegroup.API().get_all(CONF.compute_topic))
+    hosts.discard(CONF.host)
+    hosts = list(hosts)
+    random.shuffle(hosts)
+
+    endpoints = []
+    for host in hosts:
+        compute_node = conductor_api.compute_node_get_by_host(context, host)
+        if not compute_node:
+            continue
+        for stat in compute_node['stats']:
+            if stat['key'] == ENDPOINT_STAT:
+                endpoints.append(stat['value'])
+        if len(endpoints) == CONF.image_peer_max_tries:
+            break
+    return endpoints
+
+
+def _fetch_from_peer(host, target, checksum, image_id):
+    """Copy base image target from host, if it matches md5 checksum.
+    host is the host:port endpoint the node publishes.  Returns True if
+    it did.
+    """
+    filename = os.path.basename(target)
+    conn = httplib.HTTPConnection(host, timeout=CONF.image_peer_timeout)
+    try:
+        conn.request('GET', '/' + urllib.quote(filename),
+                     headers=_signature_headers(filename))
+        response = conn.getresponse()
+        if response.status != httplib.OK:
+            LOG.debug(_('%(host)s did not send %(filename)s: '
+                        '%(status)s'),
+                      {'host': host, 'filename': filename,
+                       'status': response.status})
+            return False
+        if response.getheader(CHECKSUM_HEADER) != checksum:
+            LOG.debug(_('%(host)s has another %(filename)s'),
+                      {'host': host, 'filename': filename})
+            return False
+
+        md5 = hashlib.md5()
+        sha1 = hashlib.sha1()
+        path_tmp = '%s.part' % target
+        with utils.remove_path_on_error(path_tmp):
+            with open(path_tmp, 'wb',
+                      CONF.image_fetch_buffer_size) as image_file:
+                for chunk in iter(lambda: response.read(65536), ''):
+                    md5.update(chunk)
+                    sha1.update(chunk)
+                    image_file.write(chunk)
+            if md5.hexdigest() != checksum:
+                LOG.warn(_('%(filename)s from %(host)s does not match the '
+                           'checksum glance has'),
+                         {'host': host, 'filename': filename})
+                os.unlink(path_tmp)
+                return False
+    finally:
+        conn.close()
+
+    # Checked and converted like images downloaded from glance, as the
+    # peer may not force raw images
+    if images.move_to_raw(image_id, path_tmp, target):
+        return True
+    imagecache.write_stored_info(target, field='sha1',
+                                 value=sha1.hexdigest())
+    imagecache.write_stored_info(target, field='md5', value=checksum)
+    return True
+
+
+def get_checksum(context, image_id):
+    """Return the md5 glance has for an image, or None.
+
+    Asking glance also checks the user can access the image, which other
+    compute nodes do not.
+    """
+    (image_service, image_id) = glance.get_remote_image_service(context,
+                                                                image_id)
+    return image_service.show(context, image_id).get('checksum')
+
+
+def fetch_from_peers(context, image_id, target, checksum):
+    """Copy base image target from another compute node.
+
+    Up to CONF.image_peer_max_tries of the nodes running instances of the
+    image are asked, in random order.  The image is only kept if it
+    matches checksum, the md5 glance has for it.  Returns True if one of
+    them sent the image, or False.
+    """
+    if not CONF.image_peer_secret:
+        LOG.warn(_('image_peer_secret is not set, not asking other compute '
+                   'nodes for base images'))
+        return False
+
+    for host in _find_peers(context, image_id):
+        try:
+            if _fetch_from_peer(host, target, checksum, image_id):
+                LOG.info(_('Copied base image %(target)s from %(host)s'),
+                         locals())
+                return True
+        except (httplib.HTTPException, IOError) as e:
+            LOG.debug(_('Could not get %(target)s from %(host)s: %(e)s'),
+                      locals())
+    return False
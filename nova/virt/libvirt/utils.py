@@ -75,7 +75,7 @@ def create_cow_image(backing_file, path):
     cow_opts = []
     if backing_file:
         cow_opts += ['backing_file=%s' % backing_file]
-        base_details = images.qemu_img_info(backing_file)
+        base_details = images.cached_image_info(backing_file)
     else:
         base_details = None
     # This doesn't seem to get inherited so force it to...
@@ -258,7 +258,7 @@ def get_disk_size(path):
     :returns: Size (in bytes) of the given disk image as it would be seen
               by a virtual machine.
     """
-    size = images.qemu_img_info(path).virtual_size
+    size = images.cached_image_info(path).virtual_size
     return int(size)
 
 
@@ -268,7 +268,7 @@ def get_disk_backing_file(path):
     :param path: Path to the disk image
     :returns: a path to the image's backing store
     """
-    backing_file = images.qemu_img_info(path).backing_file
+    backing_file = images.cached_image_info(path).backing_file
     if backing_file:
         backing_file = os.path.basename(backing_file)
 
@@ -444,7 +444,7 @@ def get_disk_type(path):
     if path.startswith('/dev'):
         return 'lvm'
 
-    return images.qemu_img_info(path).file_format
+    return images.cached_image_info(path).file_format
 
 
 def get_fs_info(path):
@@ -468,4 +468,28 @@ def get_fs_info(path):
 
 def fetch_image(context, target, image_id, user_id, project_id):
     """Grab image"""
-    images.fetch_to_raw(context, image_id, target, user_id, project_id)
+    # import here to avoid circularity:
+    from nova.virt.libvirt import imagecache
+    from nova.virt.libvirt import imagepeer
+    base_dir = os.path.join(CONF.instances_path, CONF.base_dir_name)
+    in_base_dir = os.path.dirname(target) == base_dir
+    peers = in_base_dir and CONF.image_peer_distribution
+    checksum = None
+    if peers:
+        # Peers are only trusted with images glance has a checksum for
+        checksum = imagepeer.get_checksum(context, image_id)
+        if checksum and imagepeer.fetch_from_peers(context, image_id,
+                                                   target, checksum):
+            return
+
+    sha1 = images.fetch_to_raw(context, image_id, target, user_id,
+                               project_id)
+    if not in_base_dir or not (CONF.checksum_base_images or peers):
+        return
+    if sha1:
+        # Saves the image cache manager from reading the image again
+        imagecache.write_stored_info(target, field='sha1', value=sha1)
+        if checksum:
+            # Not converted, so other compute nodes can check it against
+            # the checksum glance has
+            imagecache.write_stored_info(target, field='md5', value=checksum)
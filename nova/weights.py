@@ -17,6 +17,8 @@
 Pluggable Weighing support
 """
 
+import heapq
+
 from nova import loadables
 
 
@@ -57,8 +59,12 @@ class BaseWeightHandler(loadables.BaseLoader):
     object_class = WeighedObject
 
     def get_weighed_objects(self, weigher_classes, obj_list,
-            weighing_properties):
-        """Return a sorted (highest score first) list of WeighedObjects."""
+            weighing_properties, limit=None):
+        """Return a sorted (highest score first) list of WeighedObjects.
+
+        If limit is given, only the limit first WeighedObjects are
+        returned.
+        """
 
         if not obj_list:
             return []
@@ -68,4 +74,7 @@ class BaseWeightHandler(loadables.BaseLoader):
             weigher = weigher_cls()
             weigher.weigh_objects(weighed_objs, weighing_properties)
 
+        if limit is not None:
+            return heapq.nlargest(limit, weighed_objs,
+                                  key=lambda x: x.weight)
         return sorted(weighed_objs, key=lambda x: x.weight, reverse=True)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+glance_range_download.py
+
+Times GlanceImageService downloading an image in ranges with 1 and
+--workers connections, from a local stand-in for glance that waits between
+the chunks of each response, as a stream limited by its window does.
+
+Options:
+
+    --image_size - Size of the image in bytes
+    --workers - Number of connections to compare with a single one
+    --range_size - Size of the ranges in bytes
+    --chunk_delay - Seconds between the 64KB chunks of a response
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import gettext
+import os
+import sys
+import tempfile
+import time
+
+# If ../../nova/__init__.py exists, add ../../ to Python search path, so
+# that it will override what happens to be installed in
+# /usr/(local/)lib/python...
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova import config
+from nova import context
+from nova.image import glance
+from nova.openstack.common import cfg
+from nova.openstack.common import log as logging
+from nova import wsgi
+
+benchmark_opts = [
+    cfg.IntOpt('image_size',
+               default=64 * 1024 * 1024,
+               help='Size of the image in bytes'),
+    cfg.IntOpt('workers',
+               default=4,
+               help='Number of connections to compare with a single one'),
+    cfg.IntOpt('range_size',
+               default=8 * 1024 * 1024,
+               help='Size of the ranges in bytes'),
+    cfg.FloatOpt('chunk_delay',
+                 default=0.005,
+                 help='Seconds between the 64KB chunks of a response'),
+]
+
+CONF = cfg.CONF
+CONF.register_cli_opts(benchmark_opts)
+CONF.import_opt('glance_api_servers', 'nova.image.glance')
+CONF.import_opt('glance_download_workers', 'nova.image.glance')
+CONF.import_opt('glance_download_range_size', 'nova.image.glance')
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ThrottledImageApp(object):
+    """Serves ranges of an image, waiting between chunks."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __call__(self, environ, start_response):
+        range_header = environ.get('HTTP_RANGE')
+        if range_header:
+            start, end = range_header.split('=')[1].split('-')
+            body = self.data[int(start):int(end) + 1]
+            status = '206 Partial Content'
+        else:
+            body = self.data
+            status = '200 OK'
+        start_response(status, [('Content-Length', str(len(body)))])
+        return self._chunks(body)
+
+    def _chunks(self, body):
+        for offset in xrange(0, len(body), CHUNK_SIZE):
+            eventlet.sleep(CONF.chunk_delay)
+            yield body[offset:offset + CHUNK_SIZE]
+
+
+def main():
+    config.parse_args(sys.argv)
+    logging.setup('nova')
+    data = os.urandom(CONF.image_size)
+    server = wsgi.Server('fake-glance', ThrottledImageApp(data),
+                         host='127.0.0.1')
+    server.start()
+    CONF.set_override('glance_api_servers', ['127.0.0.1:%d' % server.port])
+    CONF.set_override('glance_download_range_size', CONF.range_size)
+
+    ctxt = context.RequestContext('benchmark', 'benchmark', is_admin=False)
+    service = glance.GlanceImageService(glance.GlanceClientWrapper())
+    service.show = lambda context, image_id: {'size': len(data)}
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        for workers in (1, CONF.workers):
+            CONF.set_override('glance_download_workers', workers)
+            start = time.time()
+            service._download_ranges(ctxt, 'benchmark', path)
+            elapsed = time.time() - start
+            with open(path) as image_file:
+                assert image_file.read() == data
+            print "Downloaded %d bytes with %d connections in %.3f seconds" % (
+                    len(data), workers, elapsed)
+    finally:
+        os.unlink(path)
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
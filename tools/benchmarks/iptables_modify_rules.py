@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+iptables_modify_rules.py
+
+Times IptablesManager._modify_rules rebuilding a large filter table, without
+running iptables.
+
+Options:
+
+    --rules - Number of rules in the table
+    --top_rules - Number of top rules, which keep their packet counts
+    --removed_rules - Number of rules to remove
+"""
+
+import gettext
+import os
+import sys
+import time
+
+# If ../../nova/__init__.py exists, add ../../ to Python search path, so
+# that it will override what happens to be installed in
+# /usr/(local/)lib/python...
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova import config
+from nova.network import linux_net
+from nova.openstack.common import cfg
+from nova.openstack.common import log as logging
+
+benchmark_opts = [
+    cfg.IntOpt('rules',
+               default=50000,
+               help='Number of rules in the table'),
+    cfg.IntOpt('top_rules',
+               default=2000,
+               help='Number of top rules, which keep their packet counts'),
+    cfg.IntOpt('removed_rules',
+               default=2000,
+               help='Number of rules to remove'),
+]
+
+CONF = cfg.CONF
+CONF.register_cli_opts(benchmark_opts)
+
+
+def address(network, i):
+    return '%d.%d.%d.%d' % (network, (i >> 16) & 255, (i >> 8) & 255,
+                            i & 255)
+
+
+def main():
+    config.parse_args(sys.argv)
+    logging.setup('nova')
+    linux_net.binary_name = 'benchmark'
+    manager = linux_net.IptablesManager()
+    table = manager.ipv4['filter']
+    current_lines = ['*filter',
+                     ':INPUT ACCEPT [0:0]',
+                     ':FORWARD ACCEPT [0:0]',
+                     ':OUTPUT ACCEPT [0:0]',
+                     ':nova-filter-top - [0:0]',
+                     ':benchmark-FORWARD - [0:0]']
+    for i in xrange(CONF.rules):
+        rule = '-s %s -j DROP' % address(10, i)
+        table.add_rule('FORWARD', rule)
+        current_lines.append('[0:0] -A benchmark-FORWARD %s' % rule)
+    for i in xrange(CONF.top_rules):
+        rule = '-s %s -j ACCEPT' % address(11, i)
+        table.add_rule('nova-filter-top', rule, wrap=False, top=True)
+        current_lines.append('[5:6] -A nova-filter-top %s' % rule)
+    for i in xrange(CONF.removed_rules):
+        rule = '-s %s -j ACCEPT' % address(12, i)
+        current_lines.append('[0:0] -A INPUT %s' % rule)
+        table.remove_rules.append(
+            linux_net.IptablesRule('INPUT', rule, False, False))
+    current_lines.append('COMMIT')
+
+    start = time.time()
+    new_lines = manager._modify_rules(current_lines, table)
+    elapsed = time.time() - start
+    print "Rebuilt %d lines into %d lines in %.3f seconds" % (
+            len(current_lines), len(new_lines), elapsed)
+
+
+if __name__ == "__main__":
+    main()
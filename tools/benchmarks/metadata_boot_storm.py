@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+metadata_boot_storm.py
+
+Times the metadata API serving the requests cloud-init makes as many
+instances boot, with and without metadata_prerender, in an in-memory sqlite
+database unless sql_connection is set in a --config-file.
+
+Options:
+
+    --instances - Number of booting instances
+"""
+
+import gettext
+import os
+import sys
+import time
+
+# If ../../nova/__init__.py exists, add ../../ to Python search path, so
+# that it will override what happens to be installed in
+# /usr/(local/)lib/python...
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+import webob
+
+from nova.api.metadata import base
+from nova.api.metadata import handler
+from nova import config
+from nova import context
+from nova import db
+from nova.db import migration
+from nova.network import api as network_api
+from nova.network import model as network_model
+from nova.openstack.common import cfg
+from nova.openstack.common import log as logging
+
+benchmark_opts = [
+    cfg.IntOpt('instances',
+               default=500,
+               help='Number of booting instances'),
+]
+
+CONF = cfg.CONF
+CONF.register_cli_opts(benchmark_opts)
+CONF.import_opt('compute_driver', 'nova.virt.driver')
+CONF.import_opt('metadata_prerender', 'nova.api.metadata.handler')
+CONF.import_opt('sql_connection', 'nova.db.sqlalchemy.session')
+
+PATHS = ["/latest/meta-data/", "/latest/meta-data/instance-id",
+         "/latest/meta-data/hostname",
+         "/latest/meta-data/local-hostname",
+         "/latest/meta-data/public-keys/",
+         "/latest/meta-data/public-keys/0/openssh-key",
+         "/latest/meta-data/block-device-mapping/",
+         "/latest/meta-data/placement/availability-zone",
+         "/latest/user-data", "/openstack/latest/meta_data.json"]
+
+
+def create_instances(ctxt):
+    instance_type = db.instance_type_get_by_name(ctxt, 'm1.tiny')
+    instances = {}
+    for i in xrange(CONF.instances):
+        instance = db.instance_create(ctxt, {
+                'project_id': 'benchmark', 'user_id': 'benchmark',
+                'host': 'benchmark', 'hostname': 'server-%d' % i,
+                'image_ref': '155d900f-4e14-4e4c-a73d-069cbf4541e6',
+                'instance_type_id': instance_type['id'],
+                'key_name': 'mykey',
+                'key_data': 'ssh-rsa AAAAB3Nzai....N3NtHw== user@host',
+                'user_data': 'dXNlciBkYXRh'})
+        address = '10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255)
+        instances[address] = instance
+    return instances
+
+
+def serve(instances, prerender):
+    CONF.set_override('metadata_prerender', prerender)
+    app = handler.MetadataRequestHandler()
+    base.get_metadata_by_address = (
+            lambda address: base.InstanceMetadata(instances[address],
+                                                  address))
+    start = time.time()
+    for address in instances:
+        for path in PATHS:
+            request = webob.Request.blank(path)
+            request.remote_addr = address
+            response = request.get_response(app)
+            assert response.status_int == 200, response.status
+    return time.time() - start
+
+
+def main():
+    CONF.set_default('compute_driver', 'fake.FakeDriver')
+    CONF.set_default('sql_connection', 'sqlite://')
+    config.parse_args(sys.argv)
+    logging.setup('nova')
+    migration.db_sync()
+    network_api.API.get_instance_nw_info = (
+            lambda self, ctxt, instance: network_model.NetworkInfo())
+
+    instances = create_instances(context.get_admin_context())
+    for prerender in (False, True):
+        elapsed = serve(instances, prerender)
+        print ("Served %d metadata requests for %d instances with "
+               "prerender=%s in %.3f seconds" % (
+               len(instances) * len(PATHS), len(instances), prerender,
+               elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+quota_contention.py
+
+Times concurrent quota reserve() and commit() pairs for one project with
+DbQuotaDriver and CachedDbQuotaDriver, in an in-memory sqlite database
+unless sql_connection is set in a --config-file.
+
+Options:
+
+    --requests - Number of reserve/commit pairs
+    --concurrency - Number of pairs running at a time
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import gettext
+import os
+import sys
+import time
+
+# If ../../nova/__init__.py exists, add ../../ to Python search path, so
+# that it will override what happens to be installed in
+# /usr/(local/)lib/python...
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova import config
+from nova import context
+from nova import db
+from nova.db import migration
+from nova.openstack.common import cfg
+from nova.openstack.common import log as logging
+from nova import quota
+
+benchmark_opts = [
+    cfg.IntOpt('requests',
+               default=100,
+               help='Number of reserve/commit pairs'),
+    cfg.IntOpt('concurrency',
+               default=20,
+               help='Number of pairs running at a time'),
+]
+
+CONF = cfg.CONF
+CONF.register_cli_opts(benchmark_opts)
+CONF.import_opt('sql_connection', 'nova.db.sqlalchemy.session')
+
+
+def reserve_and_commit(ctxt, driver):
+    deltas = dict(instances=1, cores=1, ram=512)
+
+    def boot():
+        reservations = driver.reserve(ctxt, quota.QUOTAS._resources, deltas)
+        driver.commit(ctxt, reservations)
+
+    pool = eventlet.GreenPool(size=CONF.concurrency)
+    for i in xrange(CONF.requests):
+        pool.spawn_n(boot)
+    pool.waitall()
+
+
+def main():
+    CONF.set_default('sql_connection', 'sqlite://')
+    config.parse_args(sys.argv)
+    logging.setup('nova')
+    migration.db_sync()
+    for resource in ('instances', 'cores', 'ram'):
+        CONF.set_override('quota_%s' % resource, -1)
+
+    ctxt = context.RequestContext('benchmark', 'benchmark', is_admin=False)
+    lookups = [0]
+    quota_get_all_by_project = db.quota_get_all_by_project
+
+    def counting_quota_get_all_by_project(context, project_id):
+        lookups[0] += 1
+        return quota_get_all_by_project(context, project_id)
+
+    db.quota_get_all_by_project = counting_quota_get_all_by_project
+
+    for driver_class in (quota.DbQuotaDriver, quota.CachedDbQuotaDriver):
+        db.quota_destroy_all_by_project(ctxt.elevated(), 'benchmark')
+        lookups[0] = 0
+        start = time.time()
+        reserve_and_commit(ctxt, driver_class())
+        elapsed = time.time() - start
+        print ("%s: %d reserve/commit pairs with %d limit lookups in %.3f "
+               "seconds" % (driver_class.__name__, CONF.requests, lookups[0],
+                            elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+reservation_expire.py
+
+Times db.reservation_expire() rolling back a large number of expired quota
+reservations, in batches of reservation_expire_batch_size.  The database is
+an in-memory sqlite one unless sql_connection is set in a --config-file.
+
+Options:
+
+    --reservations - Number of expired reservations to create
+"""
+
+import gettext
+import os
+import sys
+import time
+import uuid
+
+# If ../../nova/__init__.py exists, add ../../ to Python search path, so
+# that it will override what happens to be installed in
+# /usr/(local/)lib/python...
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova import config
+from nova import context
+from nova import db
+from nova.db import migration
+from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy.session import get_session
+from nova.openstack.common import cfg
+from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
+
+benchmark_opts = [
+    cfg.IntOpt('reservations',
+               default=100000,
+               help='Number of expired reservations to create'),
+]
+
+CONF = cfg.CONF
+CONF.register_cli_opts(benchmark_opts)
+CONF.import_opt('reservation_expire_batch_size', 'nova.quota')
+CONF.import_opt('sql_connection', 'nova.db.sqlalchemy.session')
+
+
+def main():
+    CONF.set_default('sql_connection', 'sqlite://')
+    config.parse_args(sys.argv)
+    logging.setup('nova')
+    migration.db_sync()
+
+    ctxt = context.get_admin_context()
+    count = CONF.reservations
+    now = timeutils.utcnow()
+    session = get_session()
+    with session.begin():
+        usage = models.QuotaUsage()
+        usage.update(dict(project_id='benchmark', resource='instances',
+                          in_use=0, reserved=count, until_refresh=None))
+        usage.save(session=session)
+        rows = [dict(created_at=now, deleted=False, uuid=str(uuid.uuid4()),
+                     usage_id=usage.id, project_id='benchmark',
+                     resource='instances', delta=1, expire=now)
+                for i in xrange(count)]
+        session.execute(models.Reservation.__table__.insert(), rows)
+
+    start = time.time()
+    db.reservation_expire(ctxt, batch_size=CONF.reservation_expire_batch_size)
+    elapsed = time.time() - start
+
+    usage = db.quota_usage_get(ctxt, 'benchmark', 'instances')
+    print "Expired %d reservations in %.3f seconds, %d still reserved" % (
+            count, elapsed, usage.reserved)
+
+
+if __name__ == "__main__":
+    main()
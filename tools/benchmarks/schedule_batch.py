@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+schedule_batch.py
+
+Times FilterScheduler placing one large request on many hosts with and
+without scheduler_batch_placement, and counts the hosts each mode checks.
+
+Options:
+
+    --hosts - Number of hosts to schedule on
+    --instances - Number of instances in the request
+"""
+
+import gettext
+import os
+import sys
+import time
+
+# If ../../nova/__init__.py exists, add ../../ to Python search path, so
+# that it will override what happens to be installed in
+# /usr/(local/)lib/python...
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova import config
+from nova import context
+from nova.openstack.common import cfg
+from nova.openstack.common import log as logging
+from nova.scheduler import filter_scheduler
+from nova.scheduler.filters import ram_filter
+from nova.scheduler import host_manager
+
+benchmark_opts = [
+    cfg.IntOpt('hosts',
+               default=500,
+               help='Number of hosts to schedule on'),
+    cfg.IntOpt('instances',
+               default=500,
+               help='Number of instances in the request'),
+]
+
+CONF = cfg.CONF
+CONF.register_cli_opts(benchmark_opts)
+CONF.import_opt('scheduler_batch_placement',
+                'nova.scheduler.filter_scheduler')
+CONF.import_opt('scheduler_default_filters', 'nova.scheduler.host_manager')
+CONF.import_opt('ram_allocation_ratio', 'nova.scheduler.filters.ram_filter')
+
+
+class CountingRamFilter(ram_filter.RamFilter):
+    """RamFilter that counts how many hosts it was asked to check."""
+    calls = 0
+
+    def host_passes(self, host_state, filter_properties):
+        CountingRamFilter.calls += 1
+        return super(CountingRamFilter, self).host_passes(host_state,
+                filter_properties)
+
+
+def host_states(num_hosts):
+    states = []
+    for x in xrange(num_hosts):
+        state = host_manager.HostState('host%s' % x, 'node%s' % x)
+        state.free_ram_mb = state.total_usable_ram_mb = 1024 * (x % 7 + 1)
+        state.free_disk_mb = 1024 * 1024
+        state.vcpus_total = 4
+        states.append(state)
+    return states
+
+
+def schedule(batch):
+    CONF.set_override('scheduler_batch_placement', batch)
+    sched = filter_scheduler.FilterScheduler()
+    sched.host_manager.filter_classes = [CountingRamFilter]
+    states = host_states(CONF.hosts)
+    sched.host_manager.get_all_host_states = lambda ctxt: iter(states)
+
+    ctxt = context.RequestContext('user', 'project', is_admin=True)
+    instance_properties = {'project_id': 1, 'os_type': 'Linux',
+                           'root_gb': 1, 'ephemeral_gb': 0,
+                           'memory_mb': 512, 'vcpus': 1}
+    request_spec = {'num_instances': CONF.instances,
+                    'instance_type': instance_properties,
+                    'instance_properties': instance_properties}
+    CountingRamFilter.calls = 0
+    start = time.time()
+    selected = sched._schedule(ctxt, request_spec, {})
+    return len(selected), CountingRamFilter.calls, time.time() - start
+
+
+def main():
+    config.parse_args(sys.argv)
+    logging.setup('nova')
+    CONF.set_override('scheduler_default_filters', ['CountingRamFilter'])
+    CONF.set_override('ram_allocation_ratio', 1.0)
+
+    for batch in (False, True):
+        placed, calls, elapsed = schedule(batch)
+        print ("Placed %d instances on %d hosts with batch=%s: %d host "
+               "checks in %.3f seconds" % (placed, CONF.hosts, batch,
+                                           calls, elapsed))
+
+
+if __name__ == "__main__":
+    main()